@@ -18,6 +18,7 @@ def __distance__(p, clz):
 def run(database: Database, test_key: str, params, input_format, output_format):
   train_obj = database.get_entry("maccoss-spacenet", params["train_key"])
   train_it = classification.Iterator(train_obj, OffsetBounds(params["train_offsets"][0], params["train_offsets"][1]))
+  train_it.set_read_options(params)
   train_x = []
   train_y = []
   more = True
@@ -0,0 +1,118 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+# Module level so clients survive across warm Lambda invocations and are shared
+# between threads. Clients are thread safe, resources are not, so resources
+# are pooled per thread.
+
+import boto3
+import threading
+from botocore.client import Config
+from typing import Any, Dict, Optional, Tuple
+
+
+MAX_POOL_CONNECTIONS = 50
+
+Key = Tuple[str, Optional[str], Tuple[Tuple[str, Any], ...]]
+
+clients: Dict[Key, Any] = {}
+lock = threading.Lock()
+resources = threading.local()
+session: Optional[boto3.session.Session] = None
+
+
+class PoolStatistics:
+  create_count: int
+  reuse_count: int
+
+  def __init__(self):
+    self.create_count = 0
+    self.reuse_count = 0
+
+  def reuse_rate(self) -> float:
+    total: int = self.create_count + self.reuse_count
+    if total == 0:
+      return 0.0
+    return float(self.reuse_count) / total
+
+
+statistics = PoolStatistics()
+
+
+def __config__(config: Dict[str, Any]) -> Config:
+  config = dict(config)
+  if "max_pool_connections" not in config:
+    config["max_pool_connections"] = MAX_POOL_CONNECTIONS
+  return Config(**config)
+
+
+def __key__(service: str, region: Optional[str], config: Dict[str, Any]) -> Key:
+  return (service, region, tuple(sorted(config.items())))
+
+
+def __session__() -> boto3.session.Session:
+  # The default boto3 session is not safe to create concurrently
+  global session
+  if session is None:
+    session = boto3.session.Session()
+  return session
+
+
+def __record__(created: bool, stats: Optional[Any]):
+  with lock:
+    if created:
+      statistics.create_count += 1
+    else:
+      statistics.reuse_count += 1
+  if stats is not None:
+    if created:
+      stats.connection_create_count += 1
+    else:
+      stats.connection_reuse_count += 1
+
+
+def client(service: str, region: Optional[str]=None, stats: Optional[Any]=None, **config) -> Any:
+  key: Key = __key__(service, region, config)
+  created: bool = False
+  with lock:
+    if key not in clients:
+      clients[key] = __session__().client(service, region_name=region, config=__config__(config))
+      created = True
+    c = clients[key]
+  __record__(created, stats)
+  return c
+
+
+def resource(service: str, region: Optional[str]=None, stats: Optional[Any]=None, **config) -> Any:
+  key: Key = __key__(service, region, config)
+  if not hasattr(resources, "pool"):
+    resources.pool = {}
+  created: bool = False
+  if key not in resources.pool:
+    with lock:
+      resources.pool[key] = __session__().resource(service, region_name=region, config=__config__(config))
+    created = True
+  __record__(created, stats)
+  return resources.pool[key]
+
+
+def clear():
+  global session
+  with lock:
+    clients.clear()
+    session = None
+    statistics.create_count = 0
+    statistics.reuse_count = 0
+  resources.pool = {}
@@ -16,19 +16,39 @@
 import os
 import random
 import time
+from collections import OrderedDict
 from typing import Any, BinaryIO, Dict, List, Optional, Union
 
 
 class Statistics:
+  adjust_chunk_size: int
+  cache_hit_count: int
+  connection_create_count: int
+  connection_reuse_count: int
   list_count: int
+  prefetch_count: int
+  prefetch_saved_time: float
+  prefetch_stall_time: float
   read_byte_count: int
+  read_chunk_sizes: List[int]
   read_count: int
   write_byte_count: int
   write_count: int
 
   def __init__(self):
+    # Largest window needed to find a record boundary
+    self.adjust_chunk_size = 0
+    self.cache_hit_count = 0
+    self.connection_create_count = 0
+    self.connection_reuse_count = 0
     self.list_count = 0
+    # Chunks served by the prefetcher, the fetch time it hid behind parsing and the time still spent waiting
+    self.prefetch_count = 0
+    self.prefetch_saved_time = 0.0
+    self.prefetch_stall_time = 0.0
     self.read_byte_count = 0
+    # Size of each chunk iterators read, which changes with adaptive chunk sizing
+    self.read_chunk_sizes = []
     self.read_count = 0
     self.write_byte_count = 0
     self.write_count = 0
@@ -45,12 +65,88 @@ class Statistics:
     return total_cost
 
 
+class BlockCache:
+  block_size: int
+  blocks: "OrderedDict[int, bytes]"
+  byte_count: int
+  last_block: int
+  max_bytes: int
+  read_ahead: int
+
+  def __init__(self, block_size: int, max_bytes: int, read_ahead: int = 1):
+    assert(block_size > 0)
+    self.block_size = block_size
+    self.blocks = OrderedDict()
+    self.byte_count = 0
+    self.last_block = -1
+    # Always keep room for at least the blocks touched by a single request
+    self.max_bytes = max(max_bytes, block_size)
+    self.read_ahead = read_ahead
+
+  def __evict__(self):
+    while self.byte_count > self.max_bytes and len(self.blocks) > 1:
+      [_, block] = self.blocks.popitem(last=False)
+      self.byte_count -= len(block)
+
+  def __fetch__(self, entry: "Entry", first_block: int, last_block: int, content_length: int):
+    start_index: int = first_block * self.block_size
+    end_index: int = min((last_block + 1) * self.block_size, content_length) - 1
+    entry.statistics.read_count += 1
+    content: bytes = entry.__get_range__(start_index, end_index)
+    entry.statistics.read_byte_count += len(content)
+    for i in range(first_block, last_block + 1):
+      offset: int = (i - first_block) * self.block_size
+      block: bytes = content[offset:offset + self.block_size]
+      self.blocks[i] = block
+      self.byte_count += len(block)
+
+  def get_range(self, entry: "Entry", start_index: int, end_index: int) -> bytes:
+    content_length: int = entry.content_length()
+    end_index = min(end_index, content_length - 1)
+    if start_index > end_index:
+      return b""
+
+    first_block: int = start_index // self.block_size
+    last_block: int = end_index // self.block_size
+    fetch_end_block: int = last_block
+    sequential: bool = self.last_block <= first_block and first_block <= self.last_block + 1
+    hit: bool = all(map(lambda i: i in self.blocks, range(first_block, last_block + 1)))
+    if sequential and not hit:
+      # Sequential access, so fetch the next few blocks in the same request
+      max_block: int = (content_length - 1) // self.block_size
+      fetch_end_block = min(last_block + self.read_ahead, max_block)
+
+    # Fetch each run of missing blocks with a single ranged read
+    run_start: Optional[int] = None
+    for i in range(first_block, fetch_end_block + 2):
+      missing: bool = i <= fetch_end_block and i not in self.blocks
+      if missing and run_start is None:
+        run_start = i
+      elif not missing and run_start is not None:
+        self.__fetch__(entry, run_start, i - 1, content_length)
+        run_start = None
+      if not missing and i <= last_block:
+        entry.statistics.cache_hit_count += 1
+
+    parts: List[bytes] = []
+    for i in range(first_block, last_block + 1):
+      self.blocks.move_to_end(i)
+      parts.append(self.blocks[i])
+    self.last_block = last_block
+    self.__evict__()
+
+    offset: int = first_block * self.block_size
+    return b"".join(parts)[start_index - offset:end_index - offset + 1]
+
+
 class Entry:
+  cache: Optional[BlockCache]
   key: str
   resources: Any
   statistics: Statistics
 
-  def __init__(self, key: str, resources: Any, statistics: Statistics):
+  def __init__(self, key: str, resources: Any, statistics: Statistics, cache: Optional[BlockCache]=None):
+    self.cache = cache
     self.key = key
     self.resources = resources
     self.statistics = statistics
@@ -90,8 +186,12 @@ class Entry:
     raise Exception("Entry::get_metadata not implemented")
 
   def get_range(self, start_index: int, end_index: int) -> bytes:
+    if self.cache is not None:
+      return self.cache.get_range(self, start_index, end_index)
     self.statistics.read_count += 1
-    return self.__get_range__(start_index, end_index)
+    content: bytes = self.__get_range__(start_index, end_index)
+    self.statistics.read_byte_count += len(content)
+    return content
 
   def last_modified_at(self) -> float:
     raise Exception("Entry::last_modified_at not implemented")
@@ -109,11 +209,17 @@ class Table:
 
 
 class Database:
+  block_size: int
+  cache_size: int
   payloads: List[Dict[str, Any]]
+  read_ahead: int
   statistics: Statistics
 
   def __init__(self):
+    self.block_size = 0
+    self.cache_size = 0
     self.payloads = []
+    self.read_ahead = 1
     self.statistics = Statistics()
     self.max_sleep_time = 5
 
@@ -135,9 +241,17 @@ class Database:
   def __write__(self, table_name: str, key: str, content: bytes, metadata: Dict[str, str], invoke: bool):
     raise Exception("Database::__write__ not implemented")
 
+  def __write_if_absent__(self, table_name: str, key: str, content: bytes) -> bool:
+    raise Exception("Database::__write_if_absent__ not implemented")
+
   def contains(self, table_name: str, key: str) -> bool:
     raise Exception("Database::contains not implemented")
 
+  def create_cache(self) -> Optional[BlockCache]:
+    if self.block_size <= 0:
+      return None
+    return BlockCache(self.block_size, self.cache_size, self.read_ahead)
+
   def create_payload(self, table_name: str, key: str, extra: Dict[str, Any]) -> Dict[str, Any]:
     raise Exception("Database::create_payload not implemented")
 
@@ -170,10 +284,18 @@ class Database:
 
   def get_statistics(self) -> Dict[str, Any]:
     return {
+      "adjust_chunk_size": self.statistics.adjust_chunk_size,
+      "cache_hit_count": self.statistics.cache_hit_count,
+      "connection_create_count": self.statistics.connection_create_count,
+      "connection_reuse_count": self.statistics.connection_reuse_count,
       "payloads": self.payloads,
+      "read_chunk_sizes": self.statistics.read_chunk_sizes,
       "read_count": self.statistics.read_count,
       "write_count": self.statistics.write_count,
       "list_count": self.statistics.list_count,
+      "prefetch_count": self.statistics.prefetch_count,
+      "prefetch_saved_time": self.statistics.prefetch_saved_time,
+      "prefetch_stall_time": self.statistics.prefetch_stall_time,
       "write_byte_count": self.statistics.write_byte_count,
       "read_byte_count": self.statistics.read_byte_count,
     }
@@ -184,6 +306,16 @@ class Database:
   def invoke(self, name, payload):
     raise Exception("Database::invoke not implemented")
 
+  def set_cache_options(self, params: Dict[str, Any]):
+    if "block_size" in params:
+      self.block_size = params["block_size"]
+    if "cache_size" in params:
+      self.cache_size = params["cache_size"]
+    else:
+      self.cache_size = 8 * self.block_size
+    if "read_ahead" in params:
+      self.read_ahead = params["read_ahead"]
+
   def put(self, table_name: str, key: str, content: BinaryIO, metadata: Dict[str, str], invoke: bool = True):
     self.statistics.write_count += 1
     self.statistics.write_byte_count += os.path.getsize(content.name)
@@ -199,3 +331,9 @@ class Database:
     self.statistics.write_count += 1
     self.statistics.write_byte_count += len(content)
     self.__write__(table_name, key, content, metadata, invoke)
+
+  def write_if_absent(self, table_name: str, key: str, content: bytes) -> bool:
+    # Atomically creates the object. Returns False if the key already exists.
+    self.statistics.write_count += 1
+    self.statistics.write_byte_count += len(content)
+    return self.__write_if_absent__(table_name, key, content)
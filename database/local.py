@@ -0,0 +1,293 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import importlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from database.database import BlockCache, Database, Entry, Table, Statistics
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+
+METADATA_FOLDER = ".metadata"
+
+
+class File(Entry):
+  path: str
+  metadata_path: str
+
+  def __init__(self, key: str, path: str, metadata_path: str, statistics: Statistics, cache: Optional[BlockCache]=None):
+    Entry.__init__(self, key, None, statistics, cache)
+    self.metadata_path = metadata_path
+    self.path = path
+
+  def __download__(self, f: BinaryIO) -> int:
+    with open(self.path, "rb") as g:
+      shutil.copyfileobj(g, f)
+    return f.tell()
+
+  def __get_content__(self) -> bytes:
+    return self.__get_range__(0, self.content_length() - 1)
+
+  def __get_range__(self, start_index: int, end_index: int) -> bytes:
+    # Callers expect bytes, so this copies the range once out of the mapping. Use get_view to avoid the copy.
+    resources: Optional[mmap.mmap] = self.__map__()
+    if resources is None:
+      return b""
+    return resources[start_index:end_index + 1]
+
+  def __map__(self) -> Optional[mmap.mmap]:
+    # Objects are replaced by rename, so the mapping stays valid even if the key is overwritten
+    if self.resources is None and self.content_length() > 0:
+      with open(self.path, "rb") as f:
+        self.resources = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return self.resources
+
+  def close(self):
+    if self.resources is not None:
+      self.resources.close()
+      self.resources = None
+
+  def content_length(self) -> int:
+    if self.resources is not None:
+      return len(self.resources)
+    return os.path.getsize(self.path)
+
+  def get_metadata(self) -> Dict[str, str]:
+    if not os.path.isfile(self.metadata_path):
+      return {}
+    with open(self.metadata_path) as f:
+      return json.loads(f.read())
+
+  def get_view(self, start_index: int, end_index: int) -> memoryview:
+    resources: Optional[mmap.mmap] = self.__map__()
+    if resources is None:
+      return memoryview(b"")
+    return memoryview(resources)[start_index:end_index + 1]
+
+  def last_modified_at(self) -> float:
+    return os.path.getmtime(self.path)
+
+
+class Dispatcher:
+  # Runs the function for each payload in this process, the way the provider runs a function for
+  # each new object. Payloads from a running stage wait until it returns, so stages run one after
+  # another instead of inside the stage that wrote their input.
+  def __init__(self):
+    self.payloads: List[Tuple[Dict[str, Any], str, Dict[str, Any]]] = []
+    self.running = False
+
+  def __run__(self, configuration: Dict[str, Any], name: str, payload: Dict[str, Any]):
+    # util imports this module, so it can't be imported at the top
+    import util
+    s3: Dict[str, Any] = payload["Records"][0]["s3"]
+    if "extra_params" in s3 and "prefix" in s3["extra_params"]:
+      stage: int = s3["extra_params"]["prefix"]
+    else:
+      stage = util.parse_file_name(s3["object"]["key"])["prefix"]
+    params: Dict[str, Any] = util.stage_parameters(configuration, stage)
+    if params["name"] != name:
+      raise Exception("local::Dispatcher: Function doesn't run the stage", name, stage)
+    params["local_pipeline"] = configuration
+    params["local_root"] = configuration["local_root"]
+    module = importlib.import_module("lambdas." + params["file"])
+    module.main({**payload, "local_params": params}, None)
+
+  def dispatch(self, configuration: Dict[str, Any], name: str, payload: Dict[str, Any]):
+    self.payloads.append((configuration, name, payload))
+    if self.running:
+      return
+    self.running = True
+    try:
+      while len(self.payloads) > 0:
+        [configuration, name, payload] = self.payloads.pop(0)
+        self.__run__(configuration, name, payload)
+    finally:
+      self.payloads.clear()
+      self.running = False
+
+
+dispatcher = Dispatcher()
+
+
+class Folder(Table):
+  def __init__(self, name: str, statistics: Statistics, resources: Any):
+    Table.__init__(self, name, statistics, resources)
+
+
+class LocalDatabase(Database):
+  root: str
+
+  def __init__(self, params: Dict[str, Any], root: str):
+    Database.__init__(self)
+    self.params = params
+    self.root = root
+    self.set_cache_options(params)
+
+  def __download__(self, table_name: str, key: str, f: BinaryIO) -> int:
+    return self.get_entry(table_name, key).__download__(f)
+
+  def __get_entries__(self, table_name: str, prefix: Optional[str]=None) -> List[Entry]:
+    keys: List[str] = self.__list_keys__(table_name)
+    if prefix:
+      start: int = bisect.bisect_left(keys, prefix)
+      end: int = start
+      while end < len(keys) and keys[end].startswith(prefix):
+        end += 1
+      keys = keys[start:end]
+    return list(map(lambda key: self.get_entry(table_name, key), keys))
+
+  def __get_folders__(self, table_name: str, prefix: Optional[str]=None) -> List[str]:
+    folders: List[str] = []
+    for key in self.__list_keys__(table_name):
+      if prefix and not key.startswith(prefix):
+        continue
+      index: int = key.find("/", len(prefix) if prefix else 0)
+      if index != -1 and (len(folders) == 0 or folders[-1] != key[:index]):
+        folders.append(key[:index])
+    return folders
+
+  def __list_keys__(self, table_name: str) -> List[str]:
+    # Other processes can write to the folder, so every listing scans it again
+    folder: str = self.__path__(table_name)
+    keys: List[str] = []
+    for [path, folder_names, file_names] in os.walk(folder):
+      if path == folder and METADATA_FOLDER in folder_names:
+        folder_names.remove(METADATA_FOLDER)
+      for file_name in file_names:
+        # Skip in-flight temporary files
+        if file_name.startswith("."):
+          continue
+        keys.append(os.path.relpath(os.path.join(path, file_name), folder))
+    keys.sort()
+    return keys
+
+  def __metadata_path__(self, table_name: str, key: str) -> str:
+    return os.path.join(self.root, table_name, METADATA_FOLDER, key + ".json")
+
+  def __path__(self, table_name: str, key: Optional[str]=None) -> str:
+    if key is None:
+      return os.path.join(self.root, table_name)
+    return os.path.join(self.root, table_name, key)
+
+  def __put__(self, table_name: str, key: str, content: BinaryIO, metadata: Dict[str, str], invoke: bool=True):
+    self.__local_write__(table_name, key, content, metadata, invoke)
+
+  def __read__(self, table_name: str, key: str) -> bytes:
+    with open(self.__path__(table_name, key), "rb") as f:
+      return f.read()
+
+  def __write__(self, table_name: str, key: str, content: bytes, metadata: Dict[str, str], invoke: bool):
+    self.__local_write__(table_name, key, content, metadata, invoke)
+
+  def __write_if_absent__(self, table_name: str, key: str, content: bytes) -> bool:
+    path: str = self.__path__(table_name, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    [fd, temp_path] = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+      f.write(content)
+    try:
+      # Unlike rename, link fails if the destination exists
+      os.link(temp_path, path)
+    except FileExistsError:
+      return False
+    finally:
+      os.remove(temp_path)
+    return True
+
+  def __local_write__(self, table_name: str, key: str, content: Union[bytes, BinaryIO], metadata: Dict[str, str], invoke: bool):
+    path: str = self.__path__(table_name, key)
+    metadata_path: str = self.__metadata_path__(table_name, key)
+    for p in [path, metadata_path]:
+      os.makedirs(os.path.dirname(p), exist_ok=True)
+
+    # Write to a temporary file in the same folder and rename so readers never see partial objects.
+    # The content goes first, so metadata never describes an object that isn't there yet.
+    [fd, temp_path] = tempfile.mkstemp(prefix=".", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+      if type(content) == bytes:
+        f.write(content)
+      else:
+        content.seek(0)
+        shutil.copyfileobj(content, f)
+    os.replace(temp_path, path)
+
+    [fd, temp_path] = tempfile.mkstemp(prefix=".", dir=os.path.dirname(metadata_path))
+    with os.fdopen(fd, "w") as f:
+      f.write(json.dumps(metadata))
+    os.replace(temp_path, metadata_path)
+
+    if "output_function" in self.params and invoke:
+      payload = {
+        "Records": [{
+          "s3": {
+            "bucket": {
+              "name": table_name
+            },
+            "object": {
+              "key": key
+            },
+            "ancestry": self.params["ancestry"] if "ancestry" in self.params else [],
+          },
+        }]
+      }
+      if "reexecute" in self.params:
+        payload["execute"] = self.params["reexecute"]
+      self.invoke(self.params["output_function"], payload)
+
+  def contains(self, table_name: str, key: str) -> bool:
+    return os.path.isfile(self.__path__(table_name, key))
+
+  def create_payload(self, table_name: str, key: str, extra: Dict[str, Any]) -> Dict[str, Any]:
+    payload = {
+      "Records": [{
+        "s3": {
+          "bucket": {
+            "name": table_name
+          },
+          "object": {
+            "key": key
+          },
+          "extra_params": extra,
+          "ancestry": self.params["ancestry"] if "ancestry" in self.params else [],
+        }
+      }]
+    }
+
+    if "reexecute" in self.params:
+      payload["execute"] = self.params["reexecute"]
+    return payload
+
+  def create_table(self, table_name: str) -> Folder:
+    os.makedirs(self.__path__(table_name), exist_ok=True)
+    return self.get_table(table_name)
+
+  def get_entry(self, table_name: str, key: str) -> Optional[File]:
+    if not self.contains(table_name, key):
+      return None
+    return File(key, self.__path__(table_name, key), self.__metadata_path__(table_name, key), self.statistics, self.create_cache())
+
+  def get_table(self, table_name: str) -> Table:
+    return Folder(table_name, self.statistics, self.__path__(table_name))
+
+  def invoke(self, name, payload):
+    # With the pipeline configuration in the params, the function runs here. Otherwise
+    # the caller drains the payloads.
+    self.payloads.append(payload)
+    if "local_pipeline" in self.params:
+      dispatcher.dispatch({**self.params["local_pipeline"], "local_root": self.root}, name, payload)
@@ -15,14 +15,16 @@
 
 import boto3
 import botocore
-from database.database import Database, Entry, Table, Statistics
+from database import connections
+from database.database import BlockCache, Database, Entry, Table, Statistics
 import json
+import time
 from typing import Any, BinaryIO, Dict, List, Optional, Union
 
 
 class Object(Entry):
-  def __init__(self, key: str, resources: Any, statistics: Statistics):
-    Entry.__init__(self, key, resources, statistics)
+  def __init__(self, key: str, resources: Any, statistics: Statistics, cache: Optional[BlockCache]=None):
+    Entry.__init__(self, key, resources, statistics, cache)
 
   def __download__(self, f: BinaryIO) -> int:
     self.resources.download_fileobj(f)
@@ -52,12 +54,13 @@ class Bucket(Table):
 
 class S3(Database):
   def __init__(self, params):
-    self.s3 = boto3.resource("s3")
-    self.client = boto3.client("lambda")
-    self.list = boto3.client("s3")
+    Database.__init__(self)
+    self.s3 = connections.resource("s3", stats=self.statistics)
+    self.client = connections.client("lambda", stats=self.statistics)
+    self.list = connections.client("s3", stats=self.statistics)
     self.params = params
     self.sleep_time = 1
-    Database.__init__(self)
+    self.set_cache_options(params)
 
   def __download__(self, table_name: str, key: str, f: BinaryIO) -> int:
     bucket = self.s3.Bucket(table_name)
@@ -77,7 +80,7 @@ class S3(Database):
           objects = bucket.objects.filter(Prefix=prefix)
         else:
           objects = bucket.objects.all()
-        objects = list(map(lambda obj: Object(obj.key, self.s3.Object(table_name, obj.key), self.statistics), objects))
+        objects = list(map(lambda obj: Object(obj.key, self.s3.Object(table_name, obj.key), self.statistics, self.create_cache()), objects))
         done = True
         self.sleep_time = min(max(int(self.sleep_time / 2), 1), self.max_sleep_time)
       except Exception as e:
@@ -136,6 +139,21 @@ class S3(Database):
       self.payloads.append(payload)
       self.invoke(self.params["output_function"], payload)
 
+  def __write_if_absent__(self, table_name: str, key: str, content: bytes) -> bool:
+    while True:
+      try:
+        self.s3.Object(table_name, key).put(Body=content, IfNoneMatch="*")
+        return True
+      except botocore.exceptions.ClientError as e:
+        code: str = e.response["Error"]["Code"]
+        if code == "PreconditionFailed":
+          return False
+        elif code == "ConditionalRequestConflict":
+          # Another conditional write to the key is in flight
+          time.sleep(self.sleep_time)
+        else:
+          raise e
+
   def contains(self, table_name: str, key: str) -> bool:
     try:
       self.s3.Object(table_name, key).load()
@@ -144,7 +162,7 @@ class S3(Database):
       return False
 
   def get_entry(self, table_name: str, key: str) -> Optional[Object]:
-    return Object(key, self.s3.Object(table_name, key), self.statistics)
+    return Object(key, self.s3.Object(table_name, key), self.statistics, self.create_cache())
 
   def get_table(self, table_name: str) -> Table:
     return Table(table_name, self.statistics, self.s3)
@@ -0,0 +1,88 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+import sqlite3
+from database.database import Database, Entry
+from typing import Any, Dict, List, Tuple
+
+
+class Tracker:
+  # Keeps a manifest of the files in a group (files that share a token, prefix and bin).
+  # Registering a file returns True for exactly one file, the one that completes the group.
+  # Re-executions of that file also return True, so fault tolerance can rerun the combine.
+
+  def register(self, group: str, key: str, num_files: int) -> Tuple[bool, List[str]]:
+    raise Exception("Tracker::register not implemented")
+
+
+class DatabaseTracker(Tracker):
+  folder: str = "manifest"
+
+  def __init__(self, database: Database, table_name: str):
+    self.database = database
+    self.table_name = table_name
+
+  def register(self, group: str, key: str, num_files: int) -> Tuple[bool, List[str]]:
+    # Each file creates its own marker, so re-executions are idempotent.
+    # Storage is strongly consistent, so the last marker written always sees every marker
+    # when it lists. If several callers see a complete group, the conditional write on the
+    # completion marker picks exactly one of them.
+    prefix: str = "{0:s}/{1:s}/".format(self.folder, group)
+    self.database.write_if_absent(self.table_name, "{0:s}/{1:s}".format(self.folder, key), str.encode(key))
+    entries: List[Entry] = self.database.get_entries(self.table_name, prefix)
+    keys: List[str] = sorted(map(lambda entry: entry.key[len(self.folder) + 1:], entries))
+    if len(keys) < num_files:
+      return (False, keys)
+    complete_key: str = "{0:s}/{1:s}.complete".format(self.folder, group)
+    if self.database.write_if_absent(self.table_name, complete_key, str.encode(key)):
+      return (True, keys)
+    # Let a re-execution of the winning file complete the group again
+    winner: str = self.database.get_entry(self.table_name, complete_key).get_content().decode("utf-8")
+    return (winner == key, keys)
+
+
+class SQLiteTracker(Tracker):
+  def __init__(self, path: str):
+    self.path = path
+    self.connection = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+    self.connection.execute("CREATE TABLE IF NOT EXISTS manifest (grp TEXT, key TEXT, PRIMARY KEY (grp, key))")
+    self.connection.execute("CREATE TABLE IF NOT EXISTS complete (grp TEXT PRIMARY KEY, key TEXT)")
+
+  def register(self, group: str, key: str, num_files: int) -> Tuple[bool, List[str]]:
+    cursor = self.connection.cursor()
+    # Take the write lock up front so the insert and count are atomic across processes
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+      cursor.execute("INSERT OR IGNORE INTO manifest VALUES (?, ?)", (group, key))
+      keys: List[str] = list(map(lambda row: row[0], cursor.execute("SELECT key FROM manifest WHERE grp = ? ORDER BY key", (group,))))
+      complete: bool = False
+      if len(keys) >= num_files:
+        cursor.execute("INSERT OR IGNORE INTO complete VALUES (?, ?)", (group, key))
+        winner: str = cursor.execute("SELECT key FROM complete WHERE grp = ?", (group,)).fetchone()[0]
+        complete = winner == key
+      cursor.execute("COMMIT")
+    except Exception as e:
+      cursor.execute("ROLLBACK")
+      raise e
+    return (complete, keys)
+
+
+def create(params: Dict[str, Any]) -> Tracker:
+  if params["tracker"] == "sqlite":
+    return SQLiteTracker(params["tracker_path"])
+  elif params["tracker"] == "database":
+    table_name: str = params["tracker_table"] if "tracker_table" in params else params["bucket"]
+    return DatabaseTracker(params["database"], table_name)
+  raise Exception("tracker::create: Unknown tracker", params["tracker"])
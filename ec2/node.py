@@ -1,12 +1,18 @@
 import boto3
 import collections
+import inspect
 import os
 import paramiko
 import random
 import re
+import sys
 import threading
 import time
 import ec2_util
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from database import connections
 from enum import Enum
 from typing import Any, Dict, List, Optional, Pattern, Tuple
 
@@ -146,9 +152,8 @@ class Task(threading.Thread):
         self.error = err
       self.pending_queue.appendleft(self.task)
     else:
-      s3 = boto3.resource("s3")
-      bucket = s3.Bucket("maccoss-ec2")
-      objs = list(bucket.objects.filter(Prefix="/".join(self.task.key.split("/")[:2])))
+      response = connections.client("s3").list_objects(Bucket="maccoss-ec2", Prefix="/".join(self.task.key.split("/")[:2]))
+      objs = response["Contents"] if "Contents" in response else []
       if len(objs) != 1:
         print("Cannot find output for", self.task.key, len(objs))
         self.error = "Cannot find output for " + self.task.key
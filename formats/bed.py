@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
-from formats import new_line
+from formats import tsv
 from enum import Enum
 from formats.iterator import OffsetBounds, Options
 from typing import Any, ClassVar, Generic, List, Optional, TypeVar
@@ -27,14 +27,20 @@ class Identifiers(Enum):
   end_position = 1
 
 
-class Iterator(new_line.Iterator):
+class Iterator(tsv.Iterator[Identifiers]):
   identifiers: Identifiers
+  options: ClassVar[Options] = Options(has_header = False)
 
   def __init__(self, obj: Any, offset_bounds: Optional[OffsetBounds] = None):
-    new_line.Iterator.__init__(self, obj, offset_bounds)
+    tsv.Iterator.__init__(self, obj, offset_bounds)
+
+  @classmethod
+  def column_index(cls: Any, identifier: Identifiers) -> int:
+    # The first column is the chromosome
+    return identifier.value + 1
 
   @classmethod
   def get_identifier_value(cls: Any, item: bytes, identifier: T) -> float:
     parts = item.split(b"\t")
-    return float(parts[identifier.value + 1])
+    return float(parts[cls.column_index(identifier)])
 
@@ -0,0 +1,260 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+import ast
+import numpy as np
+import struct
+from database.database import Entry
+from formats import iterator
+from formats.iterator import OffsetBounds, Options, RecordIndex
+from typing import Any, BinaryIO, ClassVar, Dict, Iterable, List, Optional, Tuple, Union
+
+
+# A header followed by fixed width records. The header has the magic, the length of the
+# header and the numpy description of a record, padded so the records are aligned.
+# Fields can be arrays, so the description holds both the type and the shape of the data.
+header_format: struct.Struct = struct.Struct("<4sI")
+header_alignment: int = 64
+magic: bytes = b"RBF1"
+
+
+def create_header(dtype: np.dtype) -> bytes:
+  description: bytes = str.encode(repr(np.lib.format.dtype_to_descr(dtype)))
+  length: int = header_format.size + len(description) + 1
+  length += (header_alignment - length % header_alignment) % header_alignment
+  header: bytes = header_format.pack(magic, length) + description
+  return header + b" " * (length - len(header) - 1) + b"\n"
+
+
+def parse_header(content: bytes) -> Tuple[np.dtype, int]:
+  # Returns the record type and where the records start
+  [m, length] = header_format.unpack(content[:header_format.size])
+  if m != magic:
+    raise Exception("binary::parse_header: Not a binary file")
+  description: Any = ast.literal_eval(content[header_format.size:length].decode("utf-8").strip())
+  dtype: np.dtype = np.lib.format.descr_to_dtype(description)
+  if dtype.itemsize == 0:
+    raise Exception("binary::parse_header: Records can't be empty")
+  return (dtype, length)
+
+
+def to_records(content: bytes) -> np.ndarray:
+  # Reads a whole file as a structured array without copying the records
+  [dtype, length] = parse_header(content)
+  if (len(content) - length) % dtype.itemsize != 0:
+    raise Exception("binary::to_records: Content isn't a whole number of records")
+  return np.frombuffer(content, dtype=dtype, offset=length)
+
+
+def memory_map(path: str) -> np.ndarray:
+  # Reads a local file as a structured array, paging records in as they are accessed
+  with open(path, "rb") as f:
+    start: bytes = f.read(header_format.size)
+    [_, length] = header_format.unpack(start)
+    [dtype, length] = parse_header(start + f.read(length - len(start)))
+  return np.memmap(path, dtype=dtype, mode="r", offset=length)
+
+
+def from_classification(content: bytes) -> bytes:
+  # Converts "<features> <class>" records separated by \r\n
+  from formats import classification
+  items = list(classification.Iterator.to_array(content))
+  width: int = len(items[0][0]) if len(items) > 0 else 0
+  records = np.zeros(len(items), dtype=[("features", np.int64, (width,)), ("classification", np.int64)])
+  for i in range(len(items)):
+    records[i] = items[i]
+  return create_header(records.dtype) + records.tobytes()
+
+
+def from_pixel(content: bytes) -> bytes:
+  # Converts the "<x> <y> <window>" records from convert_to_pixels, which are separated by \n\n
+  items = list(filter(lambda item: len(item.strip()) > 0, content.split(b"\n\n")))
+  parts = list(map(lambda item: item.split(b" ", 2), items))
+  width: int = len(parts[0][2]) // 8 if len(parts) > 0 else 0
+  records = np.zeros(len(parts), dtype=[("x", np.int64), ("y", np.int64), ("window", np.int64, (width,))])
+  for i in range(len(parts)):
+    records[i] = (int(parts[i][0]), int(parts[i][1]), np.frombuffer(parts[i][2], dtype=np.int64))
+  return create_header(records.dtype) + records.tobytes()
+
+
+def from_knn(content: bytes) -> bytes:
+  # Converts "<point>,<distance> <class>,..." records, where the point is space separated numbers.
+  # Every point needs the same number of coordinates and neighbors.
+  from formats import knn
+  items = list(knn.Iterator.to_array(content))
+  width: int = len(items[0][0].split(b" ")) if len(items) > 0 else 0
+  k: int = len(items[0][1]) if len(items) > 0 else 0
+  records = np.zeros(len(items), dtype=[("point", np.float64, (width,)), ("distances", np.float64, (k,)), ("classifications", np.int64, (k,))])
+  for i in range(len(items)):
+    [point, neighbors] = items[i]
+    coordinates: List[float] = list(map(float, point.split(b" ")))
+    if len(coordinates) != width or len(neighbors) != k:
+      raise Exception("binary::from_knn: Points have different shapes", point)
+    records[i] = (coordinates, list(map(lambda n: n[0], neighbors)), list(map(lambda n: n[1], neighbors)))
+  return create_header(records.dtype) + records.tobytes()
+
+
+converters = {
+  "classification": from_classification,
+  "knn": from_knn,
+  "pixel": from_pixel,
+}
+
+
+def convert(content: bytes, input_format: str) -> bytes:
+  if input_format not in converters:
+    raise Exception("binary::convert: Unknown format", input_format)
+  return converters[input_format](content)
+
+
+class Iterator(iterator.Iterator[None]):
+  identifiers = None
+  options: ClassVar[Options] = Options(has_header = True, binary = True)
+
+  def __init__(self, obj: Entry, offset_bounds: Optional[OffsetBounds] = None):
+    iterator.Iterator.__init__(self, Iterator, obj, offset_bounds)
+
+  def __read_header__(self) -> Tuple[np.dtype, int]:
+    start: bytes = self.entry.get_range(0, header_format.size - 1)
+    [_, length] = header_format.unpack(start)
+    return parse_header(start + self.entry.get_range(header_format.size, length - 1))
+
+  def __setup__(self):
+    # Records have a fixed width, so bounds are aligned with arithmetic instead of searching
+    # for delimiters. A split owns the records that end inside it, like the text formats.
+    [self.dtype, self.header_length] = self.__read_header__()
+    self.record_size: int = self.dtype.itemsize
+    length: int = self.entry.content_length() - self.header_length
+    if length % self.record_size != 0:
+      raise Exception("binary::Iterator: Content isn't a whole number of records", self.entry.key)
+    first: int = 0
+    last: int = length // self.record_size - 1
+    if self.offset_bounds:
+      first = max((self.offset_bounds.start_index - self.header_length) // self.record_size, 0)
+      if self.offset_bounds.end_index < self.entry.content_length() - 1:
+        last = min((self.offset_bounds.end_index - self.header_length + 1) // self.record_size - 1, last)
+    self.start_index = self.header_length + first * self.record_size
+    self.end_index = self.header_length + (last + 1) * self.record_size - 1
+    self.content_length = self.end_index - self.start_index
+    self.offsets = [self.next_index]
+
+  def __chunk_end__(self, start_index: int) -> int:
+    records: int = max(self.read_chunk_size // self.record_size, 1)
+    return min(start_index + records * self.record_size - 1, self.end_index)
+
+  def __upcoming__(self) -> List[Tuple[int, int]]:
+    ranges: List[Tuple[int, int]] = []
+    start_index: int = self.next_index
+    while len(ranges) < self.prefetch_depth and start_index <= self.end_index:
+      ranges.append((start_index, self.__chunk_end__(start_index)))
+      start_index = ranges[-1][1] + 1
+    return ranges[:1] if self.chunk_sizer is not None else ranges
+
+  def __next_stream__(self) -> Tuple[bytes, Optional[OffsetBounds], bool]:
+    # Chunks are a whole number of records, so there is never a remainder
+    if self.next_index == -1:
+      self.next_index = self.get_offset_start_index()
+    start_index: int = self.next_index
+    end_index: int = self.__chunk_end__(start_index)
+    stream: bytes = self.__read__(start_index, end_index) if start_index <= end_index else b""
+    self.next_index = end_index + 1
+    more: bool = self.next_index <= self.end_index
+    if self.prefetcher is not None:
+      if more:
+        self.prefetcher.schedule(self.__upcoming__())
+      else:
+        self.close()
+    offset_bounds: Optional[OffsetBounds] = OffsetBounds(start_index, end_index) if len(stream) > 0 else None
+    return (stream, offset_bounds, more)
+
+  def __items__(self, content: bytes) -> np.ndarray:
+    # Chunks don't have the header, so they are read with the type from the entry
+    return np.frombuffer(content, dtype=self.dtype)
+
+  def get_extra(self) -> Dict[str, Any]:
+    return {"dtype": self.dtype}
+
+  def get_item_count(self) -> int:
+    return (self.end_index - self.start_index + 1) // self.record_size
+
+  @classmethod
+  def __concatenate__(cls: Any, entries: List[Entry], f: BinaryIO):
+    dtype: Optional[np.dtype] = None
+    for entry in entries:
+      if entry.content_length() == 0:
+        continue
+      content: bytes = entry.get_content()
+      [entry_dtype, length] = parse_header(content)
+      if dtype is None:
+        dtype = entry_dtype
+        f.write(content[:length])
+      elif entry_dtype != dtype:
+        raise Exception("binary::combine: Entries have different record types", entry.key)
+      f.write(memoryview(content)[length:])
+
+  @classmethod
+  def __write_items__(cls: Any, items: List[Any], f: BinaryIO, extra: Dict[str, Any], count: int) -> Dict[str, str]:
+    # Only the first batch has the header
+    if count > 0:
+      f.write(np.asarray(items).tobytes())
+      return {}
+    [_, metadata] = cls.from_array(items, f, extra)
+    return metadata
+
+  @classmethod
+  def create_index(cls: Any, content: bytes, identifier: Optional[Any] = None) -> Optional[RecordIndex]:
+    [dtype, length] = parse_header(content)
+    records: int = (len(content) - length) // dtype.itemsize
+    block_records: int = max(cls.index_block_size // dtype.itemsize, 1)
+    starts: List[int] = list(range(0, records, block_records))
+    offsets: List[int] = list(map(lambda start: length + start * dtype.itemsize, starts))
+    counts: List[int] = list(map(lambda start: min(block_records, records - start), starts))
+    if identifier is None:
+      return RecordIndex(len(content), offsets, counts)
+    minimums: List[float] = []
+    maximums: List[float] = []
+    for i in range(len(starts)):
+      values: List[float] = cls.get_record_values(np.frombuffer(content, dtype=dtype, count=counts[i], offset=offsets[i]), identifier)
+      minimums.append(min(values))
+      maximums.append(max(values))
+    return RecordIndex(len(content), offsets, counts, iterator.identifier_name(identifier), minimums, maximums)
+
+  @classmethod
+  def from_array(cls: Any, items: Union[np.ndarray, List[Any]], f: Optional[BinaryIO], extra: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
+    if len(items) > 0:
+      records: np.ndarray = np.asarray(items)
+    else:
+      records = np.zeros(0, dtype=extra["dtype"])
+    content: bytes = create_header(records.dtype) + records.tobytes()
+    if f:
+      f.write(content)
+    return (content, {})
+
+  @classmethod
+  def to_array(cls: Any, content: bytes) -> Iterable[Any]:
+    return to_records(content)
+
+  @classmethod
+  def get_identifier_value(cls: Any, item: Any, identifier: None) -> float:
+    raise Exception("Not Implemented")
+
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> Any:
+    # Records don't carry their type, so they can't be spilled and read back on their own
+    raise Exception("Not Implemented")
+
+  @classmethod
+  def to_bytes(cls: Any, item: Any) -> bytes:
+    raise Exception("Not Implemented")
@@ -62,6 +62,14 @@ class Iterator(Generic[T], iterator.Iterator[T]):
       f.write(content)
     return (content, {})
 
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> Classification:
+    return __to_classification__(content)
+
+  @classmethod
+  def to_bytes(cls: Any, item: Classification) -> bytes:
+    return __from_classification__(item)
+
   @classmethod
   def to_array(cls: Any, content: Union[bytes, str]) -> Iterable[Classification]:
     items = filter(lambda item: len(item.strip()) > 0, re.split(cls.delimiter.item_regex, content))
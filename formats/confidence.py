@@ -16,7 +16,7 @@
 from formats import tsv
 import util
 from enum import Enum
-from formats.iterator import OffsetBounds, Options
+from formats.iterator import OffsetBounds, Options, Zone
 from typing import Any, BinaryIO, ClassVar, Dict, List, Optional, Tuple
 
 
@@ -36,6 +36,13 @@ class Iterator(tsv.Iterator[Identifiers]):
   def get_identifier_value(cls: Any, item: str, identifier: Identifiers) -> float:
     return float(item.decode("utf-8").split(cls.item_delimiter)[identifier.value])
 
+  @classmethod
+  def sum_bound(cls: Any, zone: Zone) -> Optional[float]:
+    # sum() counts the items under the q-value threshold
+    if zone.identifier != Identifiers.qvalue.name:
+      return None
+    return 0 if zone.minimum > cls.threshold else zone.count
+
   def sum(self, identifier: Identifiers) -> int:
     [count, total] = self.fraction(identifier)
     return count
@@ -46,8 +53,6 @@ class Iterator(tsv.Iterator[Identifiers]):
     total: int = 0
     while more:
       total += 1
-      [items, _, more] = self.next()
-      for item in items:
-        if float(self.get_identifier_value(item, Identifiers.qvalue)) <= self.threshold:
-          count += 1
+      [columns, _, more] = self.next_columns()
+      count += columns.count(self.column_index(Identifiers.qvalue), self.threshold)
     return (count, total)
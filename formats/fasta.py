@@ -13,17 +13,146 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import boto3
+import re
 import util
+from array import array
+from database.database import Database, Entry
 from formats import iterator
-from formats.iterator import Delimiter, DelimiterPosition, OffsetBounds, Options
-from typing import Any, ClassVar, Optional
+from formats.iterator import Delimiter, DelimiterPosition, IndexCache, OffsetBounds, Options, index_key, load_index
+from typing import Any, ClassVar, List, Optional, Pattern, Tuple
+
+
+class SequenceIndex:
+  # Like a samtools .fai, one tab separated line per sequence with the name, number of residues,
+  # offset of the first residue, residues per line and bytes per line. A sixth column has the
+  # offset of the header line, so a whole record can be read with one ranged request.
+  identifier: ClassVar[Optional[str]] = None
+
+  def __init__(self, content_length: int, names: List[bytes], lengths: List[int], offsets: List[int], line_bases: List[int], line_widths: List[int], starts: List[int]):
+    self.content_length = content_length
+    self.line_bases = array("q", line_bases)
+    self.line_widths = array("q", line_widths)
+    self.lengths = array("q", lengths)
+    self.names = names
+    self.offsets = array("q", offsets)
+    self.starts = array("q", starts)
+    # Residues before each sequence, for splitting by residues instead of bytes
+    self.residues = array("q", [0])
+    for length in self.lengths:
+      self.residues.append(self.residues[-1] + length)
+    self.positions = dict(map(lambda i: (names[i], i), reversed(range(len(names)))))
+
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> Optional["SequenceIndex"]:
+    # Returns None for sidecars in another layout, such as a RecordIndex, so they get rebuilt
+    lines: List[bytes] = content.split(b"\n")
+    if not lines[0].startswith(b"#") or not lines[0][1:].isdigit():
+      return None
+    columns: List[List[bytes]] = list(map(lambda line: line.split(b"\t"), filter(lambda line: len(line) > 0, lines[1:])))
+    values: List[List[int]] = list(map(lambda i: list(map(lambda c: int(c[i]), columns)), range(1, 6)))
+    return SequenceIndex(int(lines[0][1:]), list(map(lambda c: c[0], columns)), values[0], values[1], values[2], values[3], values[4])
+
+  def align(self, offset: int) -> int:
+    # Returns the start of the sequence where the residues reach the same fraction of the total
+    # as offset is of the content, so splits by byte size get about the same number of residues.
+    if len(self.starts) == 0 or offset <= 0:
+      return 0
+    target: float = float(offset) / self.content_length * self.residues[-1]
+    index: int = bisect.bisect_left(self.residues, target)
+    # Cut at whichever sequence boundary is closest to the target
+    if index > 0 and (index == len(self.residues) or target - self.residues[index - 1] <= self.residues[index] - target):
+      index -= 1
+    return self.starts[index] if index < len(self.starts) else self.content_length
+
+  def bounds(self, start_index: int, end_index: int) -> Optional[OffsetBounds]:
+    # The same bounds the iterator finds by reading around the split: it starts at the record with
+    # start_index and ends before the record with the byte after end_index, so a split owns the
+    # records that end inside it. Returns None if no record does.
+    start: int = self.__record_start__(start_index)
+    end: int = self.content_length - 1
+    if end_index < self.content_length - 1:
+      end = self.__record_start__(end_index + 1) - 1
+    if end < start:
+      return None
+    return OffsetBounds(start, end, True)
+
+  def __record_start__(self, offset: int) -> int:
+    # Bytes before the first header belong to the record at the beginning of the entry
+    i: int = bisect.bisect_right(self.starts, offset) - 1
+    return self.starts[i] if i >= 0 else 0
+
+  def find(self, name: bytes) -> Optional[Tuple[int, int]]:
+    # Returns the first and last byte of the record with the name
+    if name not in self.positions:
+      return None
+    i: int = self.positions[name]
+    end: int = self.starts[i + 1] - 1 if i + 1 < len(self.starts) else self.content_length - 1
+    return (self.starts[i], end)
+
+  def to_bytes(self) -> bytes:
+    lines: List[bytes] = [str.encode("#{0:d}".format(self.content_length))]
+    for i in range(len(self.names)):
+      values: List[int] = [self.lengths[i], self.offsets[i], self.line_bases[i], self.line_widths[i], self.starts[i]]
+      lines.append(b"\t".join([self.names[i]] + list(map(lambda value: str.encode(str(value)), values))))
+    return b"\n".join(lines) + b"\n"
 
 
 class Iterator(iterator.Iterator[None]):
   delimiter: Delimiter = Delimiter(item_token=">", offset_token=">", position=DelimiterPosition.start)
-  options: ClassVar[Options] = Options(has_header = False)
+  header_regex: ClassVar[Pattern[bytes]] = re.compile(rb"^>", re.MULTILINE)
+  options: ClassVar[Options] = Options(has_header = False, offset_index = True)
   identifiers = None
+  indices: ClassVar[IndexCache] = IndexCache()
 
   def __init__(self, obj: Any, offset_bounds: Optional[OffsetBounds] = None):
+    index: Optional[SequenceIndex] = Iterator.indices.get(obj.key, obj.content_length())
+    if offset_bounds is not None and not offset_bounds.aligned and index is not None:
+      # With an index, bounds move to sequence boundaries without reading around them.
+      # Splits without a record are left to the adjust path, like they are without an index.
+      offset_bounds = index.bounds(offset_bounds.start_index, offset_bounds.end_index) or offset_bounds
     iterator.Iterator.__init__(self, Iterator, obj, offset_bounds)
+
+  @classmethod
+  def create_index(cls: Any, content: bytes, identifier: Optional[Any] = None) -> SequenceIndex:
+    starts: List[int] = list(map(re.Match.start, cls.header_regex.finditer(content)))
+    names: List[bytes] = []
+    lengths: List[int] = []
+    offsets: List[int] = []
+    line_bases: List[int] = []
+    line_widths: List[int] = []
+    for i in range(len(starts)):
+      end: int = starts[i + 1] if i + 1 < len(starts) else len(content)
+      header_end: int = content.find(b"\n", starts[i], end)
+      offset: int = header_end + 1 if header_end != -1 else end
+      words: List[bytes] = content[starts[i] + 1:offset].split()
+      names.append(words[0] if len(words) > 0 else b"")
+      sequence: bytes = content[offset:end]
+      lengths.append(len(sequence) - sequence.count(b"\n") - sequence.count(b"\r"))
+      offsets.append(offset)
+      line_end: int = content.find(b"\n", offset, end)
+      line_widths.append(line_end + 1 - offset if line_end != -1 else end - offset)
+      line_bases.append(len(content[offset:offset + line_widths[-1]].rstrip(b"\r\n")))
+    return SequenceIndex(len(content), names, lengths, offsets, line_bases, line_widths, starts)
+
+  @classmethod
+  def load_index(cls: Any, key: str, content: bytes) -> Optional[SequenceIndex]:
+    return SequenceIndex.from_bytes(content)
+
+
+def get_sequence(database: Database, table_name: str, key: str, name: bytes) -> Optional[bytes]:
+  # Reads the record with the name using the index sidecar. Without a sidecar, or with one written
+  # for an older version of the object, the lookup reads the object and stores a new one.
+  entry: Entry = database.get_entry(table_name, key)
+  index: Optional[SequenceIndex] = Iterator.indices.get(key, entry.content_length())
+  if index is None:
+    index = load_index(database, table_name, key, Iterator)
+  if index is None:
+    index = Iterator.create_index(entry.get_content())
+    database.write(table_name, index_key(key), index.to_bytes(), {}, False)
+    Iterator.indices.put(key, index)
+  span: Optional[Tuple[int, int]] = index.find(name)
+  if span is None:
+    return None
+  return entry.get_range(span[0], span[1])
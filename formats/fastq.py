@@ -13,28 +13,53 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import numpy as np
 import re
 import util
 from enum import Enum
 from formats  import iterator
-from formats.iterator import Delimiter, DelimiterPosition, OffsetBounds, Optional, Options
-from typing import Any, ClassVar
+from formats.iterator import Delimiter, DelimiterPosition, OffsetBounds, Optional, Options, RecordView
+from typing import Any, ClassVar, List
 
 
 class Identifiers(Enum):
   signature = 0
+  minimizer = 1
 
 
 class Iterator(iterator.Iterator[Identifiers]):
-  delimiter: Delimiter = Delimiter(item_token="\n", offset_token="\n", position=DelimiterPosition.inbetween, regex=b"(@([^\n]*\n){3}[^\n]*)")
+  delimiter: Delimiter = Delimiter(item_token="\n", offset_token="\n", position=DelimiterPosition.inbetween, regex=b"@(?:[^\n]*\n){3}[^\n]*")
   options: ClassVar[Options] = Options(has_header = False)
   identifiers: Identifiers
+  minimizer_length: ClassVar[int] = 7
   signature_length: ClassVar[int] = 8
   base_ids = {"A": 0, "C": 1, "G": 2, "N": 3, "T": 4}
+  # Maps bytes to base ids, with len(base_ids) for anything that isn't a base
+  base_table: ClassVar[Any] = np.full(256, len(base_ids), dtype=np.int64)
+  base_table[np.frombuffer(str.encode("".join(base_ids.keys())), dtype=np.uint8)] = list(base_ids.values())
 
   def __init__(self, obj: Any, offset_bounds: Optional[OffsetBounds] = None):
     iterator.Iterator.__init__(self, Iterator, obj, offset_bounds)
 
+  @classmethod
+  def __encode__(cls: Any, seq: str) -> int:
+    value = 0
+    for base in seq:
+      value *= len(cls.base_ids)
+      value += cls.base_ids[base]
+    return value
+
+  @classmethod
+  def __sequences__(cls: Any, items: List[Any]) -> Optional[List[Any]]:
+    # Joins the records into one buffer and returns it, along with where each sequence line
+    # starts and ends. Returns None if a record isn't exactly four lines.
+    content: bytes = b"\n".join(map(lambda item: item.view() if isinstance(item, RecordView) else item, items))
+    buffer = np.frombuffer(content, dtype=np.uint8)
+    newlines = np.flatnonzero(buffer == ord("\n"))
+    if len(newlines) != 4 * len(items) - 1:
+      return None
+    return [buffer, newlines[0::4] + 1, newlines[1::4]]
+
   @classmethod
   def get_identifier_value(cls: Any, item: bytes, identifier: Identifiers) -> float:
     lines = item.decode("utf-8").strip().split("\n")
@@ -42,17 +67,45 @@ class Iterator(iterator.Iterator[Identifiers]):
       print(lines)
     assert(len(lines) == 4)
     seq = lines[1]
-    identifier = seq[0:7]
-
-    for i in range(len(seq)-cls.signature_length+1):
-      window = seq[i:i+7]
-      if window < identifier:
-        identifier = window
 
-    identifier_value = 0
-    for i in range(cls.signature_length):
-      identifier_value *= len(cls.base_ids)
-      identifier_value += cls.base_ids[seq[i]]
+    if identifier == Identifiers.minimizer:
+      # Smallest k-mer code, which orders k-mers the same way as comparing them as strings
+      k: int = cls.minimizer_length
+      return min(map(lambda i: cls.__encode__(seq[i:i+k]), range(len(seq) - k + 1)), default=len(cls.base_ids) ** k)
 
+    assert(len(seq) >= cls.signature_length)
+    identifier_value = cls.__encode__(seq[:cls.signature_length])
     assert(identifier_value >= 0)
     return identifier_value
+
+  @classmethod
+  def get_record_values(cls: Any, items: List[Any], identifier: Identifiers) -> List[float]:
+    if len(items) == 0:
+      return []
+    sequences = cls.__sequences__(items)
+    if sequences is None:
+      return super().get_record_values(items, identifier)
+    [buffer, starts, ends] = sequences
+
+    if identifier == Identifiers.minimizer:
+      # Rolling codes for the k-mer starting at every byte, where only k-mers inside a sequence line count
+      k: int = cls.minimizer_length
+      bases = cls.base_table[buffer]
+      powers = len(cls.base_ids) ** np.arange(k - 1, -1, -1, dtype=np.int64)
+      codes = np.full(len(bases), len(cls.base_ids) ** k, dtype=np.int64)
+      if len(bases) >= k:
+        codes[:len(bases) - k + 1] = np.lib.stride_tricks.sliding_window_view(bases, k) @ powers
+      inside = np.zeros(len(bases) + 1, dtype=np.int64)
+      has_kmers = ends - starts >= k
+      np.add.at(inside, starts[has_kmers], 1)
+      np.add.at(inside, ends[has_kmers] - k + 1, -1)
+      codes[np.cumsum(inside[:-1]) == 0] = len(cls.base_ids) ** k
+      return np.minimum.reduceat(codes, starts).astype(np.float64).tolist()
+
+    if np.any(ends - starts < cls.signature_length):
+      raise Exception("fastq::get_record_values: Sequence shorter than the signature")
+    prefixes = cls.base_table[buffer[starts[:, None] + np.arange(cls.signature_length)]]
+    if np.any(prefixes == len(cls.base_ids)):
+      raise Exception("fastq::get_record_values: Unknown base")
+    powers = len(cls.base_ids) ** np.arange(cls.signature_length - 1, -1, -1, dtype=np.int64)
+    return (prefixes @ powers).astype(np.float64).tolist()
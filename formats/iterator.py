@@ -13,14 +13,25 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import boto3
 import heapq
+import multiprocessing
+import mmap
+import operator
 import os
 import re
+import struct
+import time
 import util
-from database.database import Entry
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from database.database import Database, Entry
 from enum import Enum
-from typing import Any, BinaryIO, ClassVar, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar
+from itertools import chain, compress, repeat
+from multiprocessing.connection import Connection
+from typing import Any, BinaryIO, ClassVar, Dict, Generic, Iterable, List, Optional, Tuple, TypeVar, Union
 
 
 T = TypeVar("T")
@@ -47,11 +58,112 @@ class Delimiter:
       self.item_regex = re.compile(self.item_token)
       self.offset_regex = re.compile(self.offset_token)
     self.position = position
+    # Start tokens only count at the beginning of a line
+    self.separator = b"\n" + self.item_token if position == DelimiterPosition.start else self.item_token
+    self.separator_regex = re.compile(re.escape(self.separator))
+
+  def __keep__(self, content: bytes, piece_starts: array, piece_ends: array) -> List[bool]:
+    # Blank pieces aren't records. Pieces rarely start with whitespace, so only those are stripped.
+    firsts: List[int] = list(map(content.__getitem__, piece_starts[:-1]))
+    firsts.append(content[piece_starts[-1]] if piece_starts[-1] < len(content) else 0)
+    keep: List[bool] = list(map(operator.and_, map(operator.lt, piece_starts, piece_ends), map((32).__lt__, firsts)))
+    for i in compress(range(len(keep)), map(operator.not_, keep)):
+      keep[i] = len(content[piece_starts[i]:piece_ends[i]].strip()) > 0
+    return keep
+
+  def spans(self, content: bytes) -> Tuple[array, array]:
+    # Returns the start and end (exclusive) offsets of the non-blank records in content.
+    # Offsets come from the separator matches, so no record is copied.
+    if self.regex is not None:
+      matches: List[Tuple[int, int]] = list(map(re.Match.span, self.regex.finditer(content)))
+      return (array("q", map(operator.itemgetter(0), matches)), array("q", map(operator.itemgetter(1), matches)))
+
+    n: int = len(self.separator)
+    positions = array("q", map(re.Match.start, self.separator_regex.finditer(content)))
+    piece_starts = array("q", [0])
+    piece_starts.extend(map(n.__add__, positions))
+    piece_ends = array("q", positions)
+    piece_ends.append(len(content))
+    if self.position == DelimiterPosition.inbetween:
+      [starts, ends] = [piece_starts, piece_ends]
+    elif self.position == DelimiterPosition.end:
+      starts = piece_starts
+      ends = piece_starts[1:]
+      ends.append(len(content))
+    else:
+      # The record begins at the token, after the new line that separates it from the previous one
+      starts = array("q", [0])
+      starts.extend(map((n - len(self.item_token)).__add__, positions))
+      ends = starts[1:]
+      ends.append(len(content))
+      if content.startswith(self.item_token):
+        piece_starts[0] = len(self.item_token)
+    keep: List[bool] = self.__keep__(content, piece_starts, piece_ends)
+    if all(keep):
+      return (starts, ends)
+    return (array("q", compress(starts, keep)), array("q", compress(ends, keep)))
+
+  def views(self, content: bytes) -> List["RecordView"]:
+    # Same records as spans, but as views over content. Unlike split, records are
+    # returned exactly as they appear in content.
+    [starts, ends] = self.spans(content)
+    return list(map(RecordView, repeat(memoryview(content)), starts, ends))
+
+  def split(self, content: bytes) -> List[bytes]:
+    # Same records as spans, but as bytes
+    if self.regex is not None:
+      if self.regex.groups == 0:
+        return self.regex.findall(content)
+      return list(map(lambda m: m.group(0), self.regex.finditer(content)))
+    if self.position == DelimiterPosition.inbetween:
+      return [piece for piece in content.split(self.item_token) if piece.strip()]
+    if self.position == DelimiterPosition.end:
+      return [piece + self.item_token for piece in content.split(self.item_token) if piece.strip()]
+    [starts, ends] = self.spans(content)
+    return self.records(content, starts, ends)
+
+  def records(self, content: bytes, starts: array, ends: array) -> List[bytes]:
+    # Records as bytes from the offsets returned by spans, the same ones split returns
+    items: List[bytes] = list(map(lambda i: content[starts[i]:ends[i]], range(len(starts))))
+    if self.regex is None and len(items) > 0:
+      if self.position == DelimiterPosition.start and not items[0].startswith(self.item_token):
+        items[0] = self.item_token + items[0]
+      elif self.position == DelimiterPosition.end and not items[-1].endswith(self.item_token):
+        items[-1] += self.item_token
+    return items
+
+
+class RecordView:
+  # A record as offsets into a shared buffer, so splitting a chunk doesn't copy its records
+  __slots__ = ["buffer", "end", "start"]
+
+  def __init__(self, buffer: memoryview, start: int, end: int):
+    self.buffer = buffer
+    self.end = end
+    self.start = start
+
+  def __bytes__(self) -> bytes:
+    return self.buffer[self.start:self.end].tobytes()
+
+  def __eq__(self, other):
+    return bytes(self) == bytes(other)
+
+  def __len__(self) -> int:
+    return self.end - self.start
+
+  def __repr__(self):
+    return repr(bytes(self))
+
+  def view(self) -> memoryview:
+    return self.buffer[self.start:self.end]
 
 
 class OffsetBounds:
-  def __init__(self, start_index: int, end_index: int):
-    assert(start_index < end_index)
+  def __init__(self, start_index: int, end_index: int, aligned: bool = False):
+    # Bounds are inclusive, so a record can be a single byte
+    assert(start_index <= end_index)
+    # Aligned bounds already start and end on record boundaries
+    self.aligned = aligned
     self.start_index = start_index
     self.end_index = end_index
 
@@ -63,62 +175,334 @@ class OffsetBounds:
 
 
 class Options:
-  def __init__(self, has_header: bool):
+  def __init__(self, has_header: bool, offset_index: bool = False, binary: bool = False):
+    # Whether records have a fixed width instead of being separated by delimiters
+    self.binary = binary
     self.has_header = has_header
+    # Whether the format parses its own table of record offsets, which load_index can seed
+    self.offset_index = offset_index
+
+
+class RecordIndex:
+  # Blocks start on record boundaries roughly every index_block_size bytes.
+  # For each block we store its byte offset, record count and optionally the
+  # minimum and maximum identifier value of its records.
+  header: ClassVar[struct.Struct] = struct.Struct("<4sQIH")
+  magic: ClassVar[bytes] = b"RIX1"
+
+  def __init__(self, content_length: int, offsets: List[int], counts: List[int], identifier: Optional[str] = None, minimums: Optional[List[float]] = None, maximums: Optional[List[float]] = None):
+    self.content_length = content_length
+    self.counts = array("q", counts)
+    self.identifier = identifier
+    self.maximums = array("d", maximums) if maximums is not None else None
+    self.minimums = array("d", minimums) if minimums is not None else None
+    self.offsets = array("q", offsets)
+
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> "RecordIndex":
+    [magic, content_length, num_blocks, identifier_length] = cls.header.unpack_from(content)
+    assert(magic == cls.magic)
+    offset: int = cls.header.size
+    identifier: Optional[str] = None
+    if identifier_length > 0:
+      identifier = content[offset:offset + identifier_length].decode("utf-8")
+      offset += identifier_length
+    arrays: List[array] = []
+    for typecode in ["q", "q", "d", "d"][:4 if identifier is not None else 2]:
+      a = array(typecode)
+      a.frombytes(content[offset:offset + num_blocks * a.itemsize])
+      offset += num_blocks * a.itemsize
+      arrays.append(a)
+    if identifier is not None:
+      return RecordIndex(content_length, arrays[0], arrays[1], identifier, arrays[2], arrays[3])
+    return RecordIndex(content_length, arrays[0], arrays[1])
+
+  def align(self, offset: int) -> int:
+    # Returns the first block boundary at or after offset
+    index: int = bisect.bisect_left(self.offsets, offset)
+    if index == len(self.offsets):
+      return self.content_length
+    return self.offsets[index]
+
+  def blocks(self) -> List[OffsetBounds]:
+    ends: List[int] = list(self.offsets[1:]) + [self.content_length]
+    return list(map(lambda i: OffsetBounds(self.offsets[i], ends[i] - 1, True), range(len(self.offsets))))
+
+  def count(self) -> int:
+    return sum(self.counts)
+
+  def to_bytes(self) -> bytes:
+    identifier: bytes = str.encode(self.identifier) if self.identifier is not None else b""
+    content: bytes = self.header.pack(self.magic, self.content_length, len(self.offsets), len(identifier))
+    content += identifier + self.offsets.tobytes() + self.counts.tobytes()
+    if self.identifier is not None:
+      content += self.minimums.tobytes() + self.maximums.tobytes()
+    return content
+
+
+class IndexCache:
+  # Parsed indices by key and content length, so iterators over the same object in a process
+  # share them. The least recently used index is dropped once there are max_size of them.
+  def __init__(self, max_size: int = 16):
+    self.indices: "OrderedDict[Tuple[str, int], Any]" = OrderedDict()
+    self.max_size = max_size
+
+  def clear(self):
+    self.indices.clear()
+
+  def get(self, key: str, content_length: int) -> Optional[Any]:
+    index: Optional[Any] = self.indices.get((key, content_length))
+    if index is not None:
+      self.indices.move_to_end((key, content_length))
+    return index
+
+  def put(self, key: str, index: Any):
+    self.indices[(key, index.content_length)] = index
+    self.indices.move_to_end((key, index.content_length))
+    while len(self.indices) > self.max_size:
+      self.indices.popitem(last=False)
+
+
+class Zone:
+  # Minimum, maximum and count of an identifier over the records of an object.
+  # Zones are stored in object metadata so stages can skip objects without reading them.
+  def __init__(self, identifier: str, minimum: float, maximum: float, count: int):
+    self.count = count
+    self.identifier = identifier
+    self.maximum = float(maximum)
+    self.minimum = float(minimum)
+
+  @classmethod
+  def from_metadata(cls: Any, metadata: Dict[str, str], identifier: Any) -> Optional["Zone"]:
+    if "zone_identifier" not in metadata or metadata["zone_identifier"] != identifier_name(identifier):
+      return None
+    return Zone(metadata["zone_identifier"], float(metadata["zone_min"]), float(metadata["zone_max"]), int(metadata["zone_count"]))
+
+  def to_metadata(self) -> Dict[str, str]:
+    return {
+      "zone_count": str(self.count),
+      "zone_identifier": self.identifier,
+      "zone_max": str(self.maximum),
+      "zone_min": str(self.minimum),
+    }
+
+
+class Prefetcher:
+  # Keeps the next ranges of an entry in flight on a background thread, so fetching a chunk
+  # overlaps with parsing the previous one. Entry resources and caches aren't thread safe, so
+  # every read, including ones we didn't predict, goes through the same thread.
+  def __init__(self, entry: Entry, depth: int):
+    self.depth = depth
+    self.entry = entry
+    self.executor = ThreadPoolExecutor(max_workers=1)
+    self.futures: "OrderedDict[Tuple[int, int], Future]" = OrderedDict()
+
+  def __fetch__(self, start_index: int, end_index: int) -> Tuple[bytes, float]:
+    start: float = time.time()
+    content: bytes = self.entry.get_range(start_index, end_index)
+    return (content, time.time() - start)
+
+  def cancel(self):
+    for future in self.futures.values():
+      future.cancel()
+    self.futures.clear()
+
+  def close(self):
+    # Waits for a read that already started, so the entry is never read from two threads
+    self.cancel()
+    self.executor.shutdown(wait=True)
+
+  def get(self, start_index: int, end_index: int) -> Tuple[bytes, float]:
+    # Returns the content and how long the fetch took
+    future: Optional[Future] = self.futures.pop((start_index, end_index), None)
+    prefetched: bool = future is not None
+    if not prefetched:
+      # The iterator didn't go where we expected, so the ranges in flight are stale
+      self.cancel()
+      future = self.executor.submit(self.__fetch__, start_index, end_index)
+    start: float = time.time()
+    [content, duration] = future.result()
+    stall_time: float = time.time() - start
+    statistics = self.entry.statistics
+    statistics.prefetch_stall_time += stall_time
+    if prefetched:
+      statistics.prefetch_count += 1
+      statistics.prefetch_saved_time += max(duration - stall_time, 0.0)
+    return (content, duration)
+
+  def read(self, start_index: int, end_index: int) -> bytes:
+    # Reads a range we don't want to keep in flight, after the reads already queued
+    return self.executor.submit(self.entry.get_range, start_index, end_index).result()
+
+  def schedule(self, ranges: List[Tuple[int, int]]):
+    # At most depth chunks are buffered, so memory stays bounded
+    for r in ranges[:self.depth]:
+      if r not in self.futures and len(self.futures) < self.depth:
+        self.futures[r] = self.executor.submit(self.__fetch__, r[0], r[1])
+
+
+class ChunkSizer:
+  # Picks read sizes so requests take about target_time. Small requests are dominated by
+  # latency, so their throughput is low and the size keeps doubling until the request time
+  # reaches the target. Sizes shrink when there isn't enough memory left for a chunk.
+  memory_factor: ClassVar[int] = 4
+
+  def __init__(self, size: int, minimum: int, maximum: int, target_time: float):
+    self.maximum = maximum
+    self.minimum = minimum
+    self.size = size
+    self.target_time = target_time
+    self.throughput: Optional[float] = None
+
+  def available_memory(self) -> Optional[int]:
+    # Lambda reports its memory limit in the environment. Elsewhere we don't limit the size.
+    if "AWS_LAMBDA_FUNCTION_MEMORY_SIZE" not in os.environ:
+      return None
+    limit: int = int(os.environ["AWS_LAMBDA_FUNCTION_MEMORY_SIZE"]) * 1024 * 1024
+    with open("/proc/self/statm") as f:
+      used: int = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    return limit - used
+
+  def observe(self, size: int, duration: float) -> int:
+    if size > 0 and duration > 0:
+      throughput: float = size / duration
+      self.throughput = throughput if self.throughput is None else (self.throughput + throughput) / 2
+      target: float = self.throughput * self.target_time
+      self.size = int(min(max(target, self.size / 2), self.size * 2))
+    # The chunk, the remainder in front of it and the parsed records all need to fit
+    available: Optional[int] = self.available_memory()
+    if available is not None:
+      self.size = min(self.size, available // self.memory_factor)
+    self.size = min(max(self.size, self.minimum), self.maximum)
+    return self.size
+
+
+def available_cpus() -> int:
+  # Lambda gives functions with more memory more vCPUs
+  if hasattr(os, "sched_getaffinity"):
+    return len(os.sched_getaffinity(0))
+  return os.cpu_count() or 1
+
+
+def __parse_values__(cls: Any, content: bytes, starts: array, ends: array, identifier: Any, connection: Connection):
+  # Runs in a forked worker, which inherits one part of a chunk and its record offsets from
+  # the parent, so only the values are sent back
+  try:
+    items: List[RecordView] = list(map(RecordView, repeat(memoryview(content)), starts, ends))
+    connection.send_bytes(array("d", cls.get_record_values(items, identifier)).tobytes())
+  except Exception:
+    # Closing without values makes the parent parse the chunk, so the error is raised there
+    pass
+  finally:
+    connection.close()
+
+
+def identifier_name(identifier: Any) -> str:
+  # Identifiers are enums for most formats, but some stages pass the raw name through
+  if isinstance(identifier, Enum):
+    return identifier.name
+  return str(identifier)
 
 
 class Iterator(Generic[T]):
   adjust_chunk_size: ClassVar[int] = 1000
+  index_block_size: ClassVar[int] = 64*1000
+  merge_batch_size: ClassVar[int] = 1000
+  min_parallel_size: ClassVar[int] = 1000*1000
   next_index: int = -1
+  max_read_chunk_size: ClassVar[int] = 64*1000*1000
+  min_read_chunk_size: ClassVar[int] = 64*1000
   options: ClassVar[Options]
+  parse_workers: int = 1
+  prefetch_depth: int = 0
   read_chunk_size: ClassVar[int] = 1*1000*1000
   delimiter: Delimiter
   identifiers: T
+  # Formats that use sidecars while iterating keep loaded ones here
+  indices: ClassVar[Optional[IndexCache]] = None
 
   def __init__(self, cls: Any, entry: Entry, offset_bounds: Optional[OffsetBounds]):
     self.cls = cls
     self.item_count = None
     self.entry = entry
     self.offset_bounds = offset_bounds
+    self.chunk_sizer: Optional[ChunkSizer] = None
     self.offsets: List[int] = []
+    self.prefetcher: Optional[Prefetcher] = None
+    self.record_views = False
     self.remainder: bytes = b''
     self.__setup__()
 
-  def __adjust__(self, end_index: int, token) -> int:
-    content: bytes = self.entry.get_range(max(end_index - self.adjust_chunk_size, 0), end_index)
+  def __adjust__(self, end_index: int, token) -> Optional[int]:
+    # Records can be longer than the window, so keep doubling it until it has a delimiter.
+    # Returns None if there's no delimiter between the start of the entry and end_index.
+    window: int = self.adjust_chunk_size
+    while True:
+      content: bytes = self.entry.get_range(max(end_index - window, 0), end_index)
+      matches = list(token.finditer(content))
+      if len(matches) > 0 or end_index - window <= 0:
+        break
+      window *= 2
+    self.__record_adjust__(window)
+    if len(matches) == 0:
+      return None
     last_byte: int = len(content) - 1
-    index = list(token.finditer(content))[-1].span()[0] + len(self.delimiter.offset_token) - 1
+    index: int = matches[-1].span()[0] + len(self.delimiter.offset_token) - 1
     offset_index: int = last_byte - index
     assert(offset_index >= 0)
     return offset_index
 
   def __adjust_header__(self):
-    content: bytes = self.entry.get_range(self.start_index + 1, self.start_index + 1 + self.adjust_chunk_size)
-    index = list(self.delimiter.offset_regex.finditer(content))[0].span()[0] + 1
-    self.start_index += index
+    window: int = self.adjust_chunk_size
+    while True:
+      content: bytes = self.entry.get_range(self.start_index + 1, self.start_index + 1 + window)
+      m = self.delimiter.offset_regex.search(content)
+      if m is not None or self.start_index + 1 + window >= self.entry.content_length():
+        break
+      window *= 2
+    self.__record_adjust__(window)
+    assert(m is not None)
+    self.start_index += m.span()[0] + 1
+
+  def __record_adjust__(self, window: int):
+    statistics = self.entry.statistics
+    statistics.adjust_chunk_size = max(statistics.adjust_chunk_size, window)
 
   def __setup__(self):
     if self.offset_bounds:
       self.start_index = self.offset_bounds.start_index
       self.end_index = min(self.offset_bounds.end_index, self.entry.content_length() - 1)
       if self.start_index != 0:
-        self.start_index -= self.__adjust__(self.start_index, self.delimiter.offset_regex)
-        if self.delimiter.position != DelimiterPosition.start:
-          # Don't include delimiter
-          self.start_index += 1
+        if not self.offset_bounds.aligned:
+          offset: Optional[int] = self.__adjust__(self.start_index, self.delimiter.offset_regex)
+          if offset is None:
+            # Without a delimiter, the record starts at the beginning of the entry
+            self.start_index = 0
+          else:
+            self.start_index -= offset
+            if self.delimiter.position != DelimiterPosition.start:
+              # Don't include delimiter
+              self.start_index += 1
       elif self.options.has_header:
         self.__adjust_header__()
-      if self.end_index != (self.entry.content_length() - 1):
-        self.end_index -= self.__adjust__(self.end_index, self.delimiter.offset_regex)
-        if self.delimiter.position == DelimiterPosition.start:
-          self.end_index -= 1
+      if self.end_index != (self.entry.content_length() - 1) and not self.offset_bounds.aligned:
+        # End right before where the next split starts, which is found from the byte after this one
+        offset = self.__adjust__(self.end_index + 1, self.delimiter.offset_regex)
+        if offset is None:
+          self.end_index = -1
+        else:
+          self.end_index += 1 - offset
+          if self.delimiter.position == DelimiterPosition.start:
+            self.end_index -= 1
     else:
       self.start_index = 0
       self.end_index = self.entry.content_length() - 1
       if self.options.has_header:
         self.__adjust_header__()
 
-    assert(self.start_index <= self.end_index)
+    if self.end_index < self.start_index:
+      # No record ends in the split, so the next split reads it and this one is empty
+      self.end_index = self.start_index - 1
     self.content_length = self.end_index - self.start_index
     self.offsets = [self.next_index]
 
@@ -127,42 +511,152 @@ class Iterator(Generic[T]):
     metadata: Dict[str, str] = {}
 
     if util.is_set(extra, "sort"):
-      items = []
-      for i in range(len(entries)):
-        it = cls(entries[i], None)
-        sub_items = it.get(it.get_start_index(), it.get_end_index())
-        items += list(map(lambda item: (it.get_identifier_value(item, extra["identifier"]), item), sub_items))
-      items = sorted(items, key=lambda i: i[0])
-      items = list(map(lambda i: i[1], items))
-      content, metadata = cls.from_array(items, f, extra)
-      f.write(content)
+      identifier = extra["identifier"]
+      entries = list(filter(lambda entry: entry.content_length() > 0, entries))
+      zones: List[Optional[Zone]] = list(map(lambda entry: Zone.from_metadata(entry.get_metadata(), identifier), entries))
+      order: Optional[List[int]] = cls.__disjoint_order__(zones)
+      if order is not None:
+        # Entries don't overlap, so merging them is the same as appending them in order
+        cls.__concatenate__(list(map(lambda i: entries[i], order)), f)
+        zone = Zone(zones[order[0]].identifier, zones[order[0]].minimum, zones[order[-1]].maximum, sum(map(lambda zone: zone.count, zones)))
+        return zone.to_metadata()
+
+      # Each entry is already sorted, so merge the entries a chunk at a time
+      streams = list(map(lambda entry: cls(entry, None).iterate(), entries))
+      merged = heapq.merge(*streams, key=lambda item: cls.get_identifier_value(item, identifier))
+      items: List[Any] = []
+      count: int = 0
+      first: List[Any] = []
+      # The last batch can be empty when the count is a multiple of the batch size
+      last: List[Any] = []
+      for item in merged:
+        items.append(item)
+        if len(items) == cls.merge_batch_size:
+          if count == 0:
+            first = items[:1]
+          last = items[-1:]
+          metadata = cls.__write_items__(items, f, extra, count)
+          count += len(items)
+          items = []
+      if count == 0:
+        first = items[:1]
+      if len(items) > 0:
+        last = items[-1:]
+      if len(items) > 0 or count == 0:
+        metadata = cls.__write_items__(items, f, extra, count)
+      count += len(items)
+      zone = cls.create_zone(first + last, identifier, True)
+      zone.count = count
+      metadata = {**metadata, **zone.to_metadata()}
     else:
-      count = 0
-      for i in range(len(entries)):
-        entry = entries[i]
-        if entry.content_length() == 0:
-          continue
-        if count > 0 and cls.delimiter.position == DelimiterPosition.inbetween:
-          f.seek(-1 * len(cls.delimiter.item_token), os.SEEK_END)
-          end: str = f.read(len(cls.delimiter.item_token))
-          if end != cls.delimiter.item_token:
-            f.write(cls.delimiter.item_token)
-        if cls.options.has_header and count > 0:
-          lines = entry.get_content().split(cls.delimiter.item_token)[1:]
-          content = cls.delimiter.item_token.join(lines)
-          f.write(content)
-        else:
-          # TODO: There seems to be a bug where if I do entry.download(f), it's not guaranteed
-          # the entire file will write at the end. I need to figure out why because downloading,
-          # loading into memory and then writing to disk is slower.
-          f.write(entry.get_content())
-        count += 1
+      cls.__concatenate__(entries, f)
 
     return metadata
 
+  @classmethod
+  def __concatenate__(cls: Any, entries: List[Entry], f: BinaryIO):
+    count: int = 0
+    for i in range(len(entries)):
+      entry = entries[i]
+      if entry.content_length() == 0:
+        continue
+      if count > 0 and cls.delimiter.position == DelimiterPosition.inbetween:
+        f.seek(-1 * len(cls.delimiter.item_token), os.SEEK_END)
+        end: str = f.read(len(cls.delimiter.item_token))
+        if end != cls.delimiter.item_token:
+          f.write(cls.delimiter.item_token)
+      if cls.options.has_header and count > 0:
+        lines = entry.get_content().split(cls.delimiter.item_token)[1:]
+        content = cls.delimiter.item_token.join(lines)
+        f.write(content)
+      else:
+        # TODO: There seems to be a bug where if I do entry.download(f), it's not guaranteed
+        # the entire file will write at the end. I need to figure out why because downloading,
+        # loading into memory and then writing to disk is slower.
+        f.write(entry.get_content())
+      count += 1
+
+  @classmethod
+  def __disjoint_order__(cls: Any, zones: List[Optional[Zone]]) -> Optional[List[int]]:
+    # Returns the order to append the entries in if their zones don't overlap.
+    # Merging keeps ties in entry order, so touching zones must already be in that order.
+    if cls.options.has_header or len(zones) == 0 or None in zones:
+      return None
+    order: List[int] = sorted(range(len(zones)), key=lambda i: (zones[i].minimum, i))
+    for i in range(1, len(order)):
+      [a, b] = [order[i - 1], order[i]]
+      if zones[a].maximum > zones[b].minimum or (zones[a].maximum == zones[b].minimum and a > b):
+        return None
+    return order
+
+  @classmethod
+  def __write_items__(cls: Any, items: List[Any], f: BinaryIO, extra: Dict[str, Any], count: int) -> Dict[str, str]:
+    if count > 0 and cls.delimiter.position == DelimiterPosition.inbetween:
+      f.write(cls.delimiter.item_token)
+    [_, metadata] = cls.from_array(items, f, extra)
+    return metadata
+
+  @classmethod
+  def __next_record__(cls: Any, content: bytes, position: int) -> int:
+    # Returns the start of the first record at or after position
+    if position == 0 and not cls.options.has_header:
+      return 0
+    if cls.delimiter.regex is not None:
+      m = cls.delimiter.regex.search(content, position)
+      return m.start() if m is not None else len(content)
+    if cls.delimiter.position == DelimiterPosition.start:
+      m = cls.delimiter.item_regex.search(content, position)
+      return m.start() if m is not None else len(content)
+    token: bytes = cls.delimiter.item_token
+    index: int = content.find(token, max(position - len(token), 0))
+    return index + len(token) if index != -1 else len(content)
+
+  @classmethod
+  def create_index(cls: Any, content: bytes, identifier: Optional[Any] = None) -> Optional[RecordIndex]:
+    offsets: List[int] = []
+    counts: List[int] = []
+    minimums: List[float] = []
+    maximums: List[float] = []
+    start: int = cls.__next_record__(content, 0)
+    while start < len(content):
+      end: int = cls.__next_record__(content, start + cls.index_block_size)
+      items: List[Any] = list(cls.to_array(content[start:end]))
+      offsets.append(start)
+      counts.append(len(items))
+      if identifier is not None:
+        values: List[float] = cls.get_record_values(items, identifier)
+        minimums.append(min(values) if len(values) > 0 else 0.0)
+        maximums.append(max(values) if len(values) > 0 else 0.0)
+      start = end
+
+    if identifier is None:
+      return RecordIndex(len(content), offsets, counts)
+    return RecordIndex(len(content), offsets, counts, identifier_name(identifier), minimums, maximums)
+
+  @classmethod
+  def create_zone(cls: Any, items: List[Any], identifier: Any, is_sorted: bool = False) -> Zone:
+    if len(items) == 0:
+      return Zone(identifier_name(identifier), float("inf"), float("-inf"), 0)
+    if is_sorted:
+      values: List[float] = [cls.get_record_value(items[0], identifier), cls.get_record_value(items[-1], identifier)]
+    else:
+      values = cls.get_record_values(items, identifier)
+    return Zone(identifier_name(identifier), min(values), max(values), len(items))
+
   @classmethod
   def from_array(cls: Any, items: List[Any], f: Optional[BinaryIO], extra: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
     metadata: Dict[str, str] = {}
+    if len(items) > 0 and isinstance(items[0], RecordView):
+      if f:
+        # Write the views straight from their buffers, so the output is never built in memory
+        views: Iterable[memoryview] = map(RecordView.view, items)
+        if cls.delimiter.position == DelimiterPosition.inbetween:
+          f.write(next(views))
+          views = chain.from_iterable(zip(repeat(cls.delimiter.item_token), views))
+        f.writelines(views)
+        return (b"", metadata)
+      items = list(map(RecordView.view, items))
+
     if cls.delimiter.position == DelimiterPosition.inbetween:
       content = cls.delimiter.item_token.join(items)
     else:
@@ -174,25 +668,126 @@ class Iterator(Generic[T]):
 
   @classmethod
   def to_array(cls: Any, content: bytes) -> Iterable[Any]:
-    token = cls.delimiter.item_regex
-    if cls.delimiter.regex is not None:
-      items = map(lambda item: item[0], re.findall(cls.delimiter.regex, content))
-    else:
-      items: Iterable[bytes] = filter(lambda item: len(item.strip()) > 0, re.split(token, content))
-      if cls.delimiter.position == DelimiterPosition.start:
-        items = map(lambda item: cls.delimiter.item_token + item, items)
-      elif cls.delimiter.position == DelimiterPosition.end:
-        items = map(lambda item: item + cls.delimiter.item_token, items)
-    return items
+    return cls.delimiter.split(content)
+
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> Any:
+    # Inverse of to_bytes
+    return content
+
+  @classmethod
+  def sum_bound(cls: Any, zone: Zone) -> Optional[float]:
+    # Upper bound on sum() for an object with the given zone, or None if unknown
+    return None
 
   @classmethod
   def get_identifier_value(cls: Any, item: bytes, identifier: T) -> float:
     raise Exception("Not Implemented")
 
-  def get(self, start_byte: int, end_byte: int) -> Iterable[Any]:
-    content: bytes = self.entry.get_range(start_byte, end_byte)
+  @classmethod
+  def get_record_value(cls: Any, item: Any, identifier: T) -> float:
+    # Formats parse bytes, so views are only copied for as long as it takes to read the identifier
+    if isinstance(item, RecordView):
+      item = bytes(item)
+    return cls.get_identifier_value(item, identifier)
+
+  @classmethod
+  def load_index(cls: Any, key: str, content: bytes) -> Any:
+    # Parses a sidecar written from create_index
+    return RecordIndex.from_bytes(content)
+
+  @classmethod
+  def get_record_values(cls: Any, items: List[Any], identifier: T) -> List[float]:
+    # Identifier values for many records at once, which formats can override with a vectorized version
+    return list(map(lambda item: cls.get_record_value(item, identifier), items))
+
+  @classmethod
+  def supports_batches(cls: Any) -> bool:
+    # Formats that merge sorted entries with __write_items__ can write a file a batch at a time
+    return cls.combine.__func__ is Iterator.combine.__func__
+
+  @classmethod
+  def supports_views(cls: Any) -> bool:
+    # Views only work for formats whose records are the bytes between delimiters
+    return cls.to_array.__func__ is Iterator.to_array.__func__
+
+  @classmethod
+  def to_bytes(cls: Any, item: Any) -> bytes:
+    # Serializes a single item returned by to_array, so it can be spilled to disk
+    return item
+
+  def __items__(self, content: bytes) -> Iterable[Any]:
+    if self.record_views:
+      return self.delimiter.views(content)
     return self.to_array(content)
 
+  def __parallel_values__(self, content: bytes, starts: array, ends: array, identifier: T) -> Optional[List[float]]:
+    # Splits the records into parts of the same size and finds the values of each part in a forked
+    # process. Forked workers inherit the chunk instead of needing shared memory, which Lambda doesn't have.
+    if len(starts) == 0:
+      # Nothing to split, so the chunk is parsed here
+      return None
+    bounds: List[int] = list(map(lambda i: len(starts) * i // self.parse_workers, range(self.parse_workers + 1)))
+    context = multiprocessing.get_context("fork")
+    workers: List[Tuple[Any, Connection]] = []
+    try:
+      for i in filter(lambda i: bounds[i] < bounds[i + 1], range(self.parse_workers)):
+        [receiver, sender] = context.Pipe(False)
+        args = (type(self), content, starts[bounds[i]:bounds[i + 1]], ends[bounds[i]:bounds[i + 1]], identifier, sender)
+        process = context.Process(target=__parse_values__, args=args, daemon=True)
+        workers.append((process, receiver))
+        process.start()
+        sender.close()
+      values = array("d")
+      for [_, receiver] in workers:
+        values.frombytes(receiver.recv_bytes())
+    except EOFError:
+      # A worker failed, so the chunk is parsed here, which raises the same error
+      return None
+    finally:
+      for [process, receiver] in workers:
+        receiver.close()
+        process.join()
+    return values.tolist()
+
+  def get(self, start_byte: int, end_byte: int) -> Iterable[Any]:
+    return self.__items__(self.__get_range__(start_byte, end_byte))
+
+  def get_values(self, start_byte: int, end_byte: int, identifier: T) -> Tuple[List[Any], List[float]]:
+    # Like get, but also returns the identifier value of each item
+    return self.items_values(self.__get_range__(start_byte, end_byte), identifier)
+
+  def items_values(self, content: bytes, identifier: T) -> Tuple[List[Any], List[float]]:
+    # The items in content and their identifier values. With parse_workers, the values of large
+    # chunks are found in worker processes. The records are only found once, here, so the items
+    # are made from the same offsets the workers used.
+    if self.parse_workers > 1 and len(content) >= self.min_parallel_size and self.supports_views():
+      [starts, ends] = self.delimiter.spans(content)
+      values: Optional[List[float]] = self.__parallel_values__(content, starts, ends, identifier)
+      if values is not None:
+        if self.record_views:
+          return (list(map(RecordView, repeat(memoryview(content)), starts, ends)), values)
+        return (self.delimiter.records(content, starts, ends), values)
+    items: List[Any] = list(self.__items__(content))
+    return (items, self.get_record_values(items, identifier))
+
+  def set_read_options(self, params: Dict[str, Any]):
+    # Read tuning shared by the stages that loop over next()
+    if "parse_workers" in params:
+      # Zero uses a worker per available CPU
+      self.parse_workers = params["parse_workers"] if params["parse_workers"] > 0 else available_cpus()
+    if "prefetch" in params:
+      self.prefetch_depth = params["prefetch"]
+    if "target_request_time" in params:
+      maximum: int = params["max_read_chunk_size"] if "max_read_chunk_size" in params else self.max_read_chunk_size
+      self.chunk_sizer = ChunkSizer(self.read_chunk_size, self.min_read_chunk_size, maximum, params["target_request_time"])
+
+  def close(self):
+    # Cancels any prefetched reads, for callers that stop before the last chunk
+    if self.prefetcher is not None:
+      self.prefetcher.close()
+      self.prefetcher = None
+
   def get_extra(self) -> Dict[str, Any]:
     return {}
 
@@ -211,13 +806,68 @@ class Iterator(Generic[T]):
   def get_offset_start_index(self) -> int:
     return self.start_index
 
+  def __get_range__(self, start_index: int, end_index: int) -> bytes:
+    # Reads outside of the chunks, such as in transform, go through the prefetch thread while it's running
+    if start_index > end_index:
+      return b""
+    if self.prefetcher is not None:
+      return self.prefetcher.read(start_index, end_index)
+    return self.entry.get_range(start_index, end_index)
+
+  def __read__(self, start_index: int, end_index: int) -> bytes:
+    if self.prefetch_depth > 0 and self.prefetcher is None:
+      self.prefetcher = Prefetcher(self.entry, self.prefetch_depth)
+    if self.prefetcher is not None:
+      [content, duration] = self.prefetcher.get(start_index, end_index)
+    else:
+      start: float = time.time()
+      content = self.entry.get_range(start_index, end_index)
+      duration = time.time() - start
+    self.entry.statistics.read_chunk_sizes.append(len(content))
+    if self.chunk_sizer is not None:
+      self.read_chunk_size = self.chunk_sizer.observe(len(content), duration)
+    return content
+
+  def __upcoming__(self) -> List[Tuple[int, int]]:
+    # The ranges the next calls will read. Chunks end read_chunk_size bytes after they start
+    # and the next chunk starts right after. Views reread partial records and adaptive sizing
+    # changes the size after every read, so in those cases only the next range is known.
+    ranges: List[Tuple[int, int]] = []
+    start_index: int = self.next_index
+    end_index: int = -1
+    while len(ranges) < self.prefetch_depth and end_index != self.get_offset_end_index():
+      end_index = min(start_index + self.read_chunk_size, self.get_offset_end_index())
+      ranges.append((start_index, end_index))
+      start_index = min(end_index + 1, self.get_offset_end_index())
+    return ranges[:1] if self.record_views or self.chunk_sizer is not None else ranges
+
+  def iterate(self) -> Iterable[Any]:
+    more: bool = True
+    while more:
+      [items, _, more] = self.next()
+      for item in items:
+        yield item
+
   def next(self) -> Tuple[Iterable[Any], Optional[OffsetBounds], bool]:
+    [stream, offset_bounds, more] = self.__next_stream__()
+    return (self.__items__(stream), offset_bounds, more)
+
+  def next_values(self, identifier: T) -> Tuple[List[Any], List[float], Optional[OffsetBounds], bool]:
+    # Like next, but also returns the identifier value of each item
+    [stream, offset_bounds, more] = self.__next_stream__()
+    [items, values] = self.items_values(stream, identifier)
+    return (items, values, offset_bounds, more)
+
+  def __next_stream__(self) -> Tuple[bytes, Optional[OffsetBounds], bool]:
+    # Reads the next chunk, trimmed to whole records
+    if self.get_offset_end_index() < self.get_offset_start_index():
+      return (b"", None, False)
     if self.next_index == -1:
       self.next_index = self.get_offset_start_index()
     next_start_index: int = self.next_index
     next_end_index: int = min(next_start_index + self.read_chunk_size, self.get_offset_end_index())
     more: bool = True
-    stream: bytes = self.entry.get_range(next_start_index, next_end_index)
+    stream: bytes = self.__read__(next_start_index, next_end_index)
     stream = self.remainder + stream
     if next_end_index == self.get_offset_end_index():
       next_start_index -= len(self.remainder)
@@ -225,15 +875,17 @@ class Iterator(Generic[T]):
       more = False
     else:
       if self.delimiter.regex:
-        it = list(self.delimiter.regex.finditer(stream))
-        index = it[-1].span()[1] + 1
+        last = None
+        for last in self.delimiter.regex.finditer(stream):
+          pass
+        index = last.span()[1] + 1
         next_start_index -= len(self.remainder)
         self.remainder = stream[index:]
         stream = stream[:index]
         next_end_index -= len(self.remainder)
       else:
         token = self.delimiter.offset_token
-        index: int = stream.rindex(token) if token in stream else -1
+        index: int = stream.rfind(token)
         if index != -1:
           if self.delimiter.position == DelimiterPosition.inbetween:
             index += len(self.delimiter.offset_token)
@@ -246,13 +898,57 @@ class Iterator(Generic[T]):
           next_end_index -= len(self.remainder)
           stream = b''
     self.next_index = min(next_end_index + len(self.remainder) + 1, self.get_offset_end_index())
+    if self.record_views and len(stream) > 0 and len(self.remainder) > 0:
+      # Read the partial record again with the next chunk, so the chunk isn't copied to put it in front.
+      # If the chunk has no complete record, we keep the remainder so the next chunk can finish it.
+      self.next_index = next_end_index + 1
+      self.remainder = b''
+    if self.prefetcher is not None:
+      if more:
+        self.prefetcher.schedule(self.__upcoming__())
+      else:
+        self.close()
     offset_bounds: Optional[OffsetBounds]
     if len(stream) == 0:
       offset_bounds = None
     else:
       offset_bounds = OffsetBounds(next_start_index, next_end_index)
     [stream, offset_bounds] = self.transform(stream, offset_bounds)
-    return (self.to_array(stream), offset_bounds, more)
+    return (stream, offset_bounds, more)
 
   def transform(self, stream: bytes, offset_bounds: Optional[OffsetBounds]) -> Tuple[bytes, Optional[OffsetBounds]]:
     return (stream, offset_bounds)
+
+
+def index_key(key: str) -> str:
+  return "index/" + key
+
+
+def load_index(database: Database, table_name: str, key: str, iterator_class: Optional[Any] = None) -> Optional[Any]:
+  # Returns None if there's no sidecar, or if it was written for an object that has since been replaced
+  entry: Optional[Entry] = database.get_entry(table_name, key)
+  if entry is None or not database.contains(table_name, index_key(key)):
+    return None
+  content: bytes = database.read(table_name, index_key(key))
+  index: Optional[Any]
+  if iterator_class is not None:
+    index = iterator_class.load_index(key, content)
+  else:
+    index = RecordIndex.from_bytes(content)
+  if index is None or index.content_length != entry.content_length():
+    return None
+  if iterator_class is not None and iterator_class.indices is not None:
+    iterator_class.indices.put(key, index)
+  return index
+
+
+def write_index(database: Database, table_name: str, key: str, iterator_class: Any, content: Union[bytes, BinaryIO], identifier: Optional[Any] = None):
+  # Sidecar objects live under their own prefix so they never show up when listing a stage.
+  # Files are scanned through a memory map, so outputs are paged in instead of read into memory.
+  if isinstance(content, bytes) or os.fstat(content.fileno()).st_size == 0:
+    index: Optional[RecordIndex] = iterator_class.create_index(content if isinstance(content, bytes) else b"", identifier)
+  else:
+    with mmap.mmap(content.fileno(), 0, access=mmap.ACCESS_READ) as m:
+      index = iterator_class.create_index(m, identifier)
+  if index is not None:
+    database.write(table_name, index_key(key), index.to_bytes(), {}, False)
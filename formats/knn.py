@@ -13,7 +13,7 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
-import heapq
+import numpy as np
 import util
 from database.database import Entry
 from formats import iterator
@@ -59,6 +59,34 @@ def __neighbors_to_bytes__(n: Neighbors) -> bytes:
   return point + b',' + b','.join(neighbors)
 
 
+def __neighbor_arrays__(content: bytes, point_ids: Dict[bytes, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # Returns the point id, distance and class of every neighbor in the content.
+  # Points we haven't seen yet are given the next id.
+  lines: List[bytes] = list(filter(lambda line: len(line.strip()) > 0, content.split(b"\n")))
+  separators: List[int] = list(map(lambda line: line.find(b","), lines))
+  line_ids = np.zeros(len(lines), dtype=np.int64)
+  for i in range(len(lines)):
+    point: bytes = lines[i][:separators[i]] if separators[i] != -1 else lines[i]
+    assert(len(point.strip()) > 0)
+    line_ids[i] = point_ids.setdefault(point, len(point_ids))
+  counts = np.array(list(map(lambda line: line.count(b","), lines)), dtype=np.int64)
+  neighbors: bytes = b",".join(map(lambda i: lines[i][separators[i] + 1:], np.flatnonzero(counts)))
+  values = np.fromstring(neighbors.replace(b" ", b",").decode("utf-8"), sep=",") if len(neighbors) > 0 else np.zeros(0)
+  values = values.reshape(-1, 2)
+  return (np.repeat(line_ids, counts), values[:, 0], values[:, 1].astype(np.int64))
+
+
+def __top_k__(ids: np.ndarray, distances: np.ndarray, classifications: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+  # Keeps the k closest neighbors of each point, sorted by point and then distance.
+  # The sort is stable, so ties go to the neighbor seen first.
+  order = np.lexsort((distances, ids))
+  ids = ids[order]
+  starts = np.flatnonzero(np.concatenate(([True], ids[1:] != ids[:-1])))
+  ranks = np.arange(len(ids)) - np.repeat(starts, np.diff(np.append(starts, len(ids))))
+  keep = order[ranks < k]
+  return (ids[ranks < k], distances[keep], classifications[keep])
+
+
 class Iterator(new_line.Iterator):
   identifiers = None
 
@@ -73,6 +101,10 @@ class Iterator(new_line.Iterator):
       f.write(content)
     return (content, {})
 
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> Neighbors:
+    return __neighbors_from_bytes__(content)
+
   @classmethod
   def get_identifier_value(cls: Any, item: str, identifier: None) -> float:
     # I don't think an identifier makes sense for knn. However, this may change
@@ -80,6 +112,10 @@ class Iterator(new_line.Iterator):
     [x, y] = item.split(",")[0].split(" ")
     return float(x + "." + y)
 
+  @classmethod
+  def to_bytes(cls: Any, item: Neighbors) -> bytes:
+    return __neighbors_to_bytes__(item)
+
   @classmethod
   def to_array(cls: Any, content: bytes) -> Iterable[Neighbors]:
     items = filter(lambda item: len(item.strip()) > 0, content.split(cls.delimiter.item_token))
@@ -90,29 +126,27 @@ class Iterator(new_line.Iterator):
     if not util.is_set(extra, "sort"):
       return new_line.Iterator.combine(entries, f, extra)
 
-    top_scores = {}
+    # Each entry is reduced into the running top k as soon as it's parsed, so memory is bounded
+    # by the number of points times k plus one entry.
+    point_ids: Dict[bytes, int] = {}
+    ids = np.zeros(0, dtype=np.int64)
+    distances = np.zeros(0, dtype=np.float64)
+    classifications = np.zeros(0, dtype=np.int64)
     for entry in entries:
-      items = cls.to_array(entry.get_content())
-      for item in items:
-        [s, neighbors] = item
-        if s not in top_scores:
-          top_scores[s] = list(map(lambda n: (-1 * n[0], n[1]), neighbors))
-          heapq.heapify(top_scores[s])
-        else:
-          for neighbor in neighbors:
-            [score, classification] = neighbor
-            if len(top_scores[s]) < extra["k"] or -1*score > top_scores[s][0][0]:
-              heapq.heappush(top_scores[s], (-1*score, classification))
-            if len(top_scores[s]) > extra["k"]:
-              heapq.heappop(top_scores[s])
-
-    keys = list(top_scores.keys())
-    for i in range(len(keys)):
+      [entry_ids, entry_distances, entry_classifications] = __neighbor_arrays__(entry.get_content(), point_ids)
+      ids = np.concatenate([ids, entry_ids])
+      distances = np.concatenate([distances, entry_distances])
+      classifications = np.concatenate([classifications, entry_classifications])
+      [ids, distances, classifications] = __top_k__(ids, distances, classifications, extra["k"])
+
+    # Points are written in the order they first appear, with their neighbors farthest first
+    points: List[bytes] = list(point_ids.keys())
+    neighbors: List[bytes] = list(map(b"%f %d".__mod__, zip(distances[::-1].tolist(), classifications[::-1].tolist())))
+    ids = ids[::-1]
+    ends = np.searchsorted(-ids, -np.arange(len(points)), side="right")
+    starts = np.searchsorted(-ids, -np.arange(len(points)), side="left")
+    for i in range(len(points)):
       if i > 0:
         f.write(b'\n')
-      s = keys[i]
-      line = s
-      for [score, c] in top_scores[s]:
-        line += str.encode(",{0:f} {1:d}".format(-1 * score, c))
-      f.write(line)
+      f.write(b",".join([points[i]] + neighbors[starts[i]:ends[i]]))
     return {}
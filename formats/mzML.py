@@ -13,93 +13,193 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import base64
+import bisect
 import boto3
 import hashlib
+import io
 import re
+import struct
 import util
-import xml.etree.ElementTree as ET
+import zlib
+from array import array
 from enum import Enum
 from database.database import Entry
 from formats import iterator
-from formats.iterator import Delimiter, DelimiterPosition, OffsetBounds, Options
+from formats.iterator import Delimiter, DelimiterPosition, IndexCache, OffsetBounds, Options
 from typing import Any, BinaryIO, ClassVar, Dict, Iterable, List, Optional, Pattern, Tuple
 
 
 class Identifiers(Enum):
   mass = 0
   tic = 1
+  peaks = 2
+  precursor = 3
+
+
+class OffsetIndex:
+  # The spectrum offsets listed in the <indexList> of an mzML file, along with the byte
+  # position of each <offset> entry, so ranges of either are found by binary search.
+  header: ClassVar[struct.Struct] = struct.Struct("<4sQQQI")
+  identifier: ClassVar[Optional[str]] = None
+  magic: ClassVar[bytes] = b"MZX1"
+
+  def __init__(self, content_length: int, index_list_offset: int, offsets: List[int], positions: List[int], end: int):
+    self.content_length = content_length
+    # Position right after the last <offset> entry
+    self.end = end
+    self.index_list_offset = index_list_offset
+    self.offsets = array("q", offsets)
+    self.positions = array("q", positions)
+
+  @classmethod
+  def from_bytes(cls: Any, content: bytes) -> "OffsetIndex":
+    [magic, content_length, index_list_offset, end, num_offsets] = cls.header.unpack_from(content)
+    assert(magic == cls.magic)
+    arrays: List[array] = []
+    offset: int = cls.header.size
+    for i in range(2):
+      a = array("q")
+      a.frombytes(content[offset:offset + num_offsets * a.itemsize])
+      offset += num_offsets * a.itemsize
+      arrays.append(a)
+    return OffsetIndex(content_length, index_list_offset, arrays[0], arrays[1], end)
+
+  def align(self, offset: int) -> int:
+    # Returns the first spectrum boundary at or after offset
+    index: int = bisect.bisect_left(self.offsets, offset)
+    if index == len(self.offsets):
+      return self.content_length
+    return self.offsets[index]
+
+  def to_bytes(self) -> bytes:
+    content: bytes = self.header.pack(self.magic, self.content_length, self.index_list_offset, self.end, len(self.offsets))
+    return content + self.offsets.tobytes() + self.positions.tobytes()
+
+
+class Writer:
+  # Streams an mzML file out piece by piece. Offsets come from a byte counter and the
+  # checksum is updated as pieces are written, so output is never held in memory.
+  def __init__(self, f: BinaryIO):
+    self.checksum = hashlib.sha1()
+    self.f = f
+    self.offset = 0
+
+  def write(self, content: bytes):
+    self.f.write(content)
+    self.checksum.update(content)
+    self.offset += len(content)
 
 
 class Iterator(iterator.Iterator[Identifiers]):
+  array_dtypes: ClassVar[Dict[bytes, str]] = {
+    b'name="32-bit float"': "<f4",
+    b'name="64-bit float"': "<f8",
+    b'name="32-bit integer"': "<i4",
+    b'name="64-bit integer"': "<i8",
+  }
+  array_length_regex: ClassVar[Pattern[bytes]] = re.compile(rb'(\s)defaultArrayLength="([0-9]+)"')
+  binary_array_regex: ClassVar[Pattern[bytes]] = re.compile(rb"<binaryDataArray\s")
   chromatogram_end_index: ClassVar[int]
   chromatogram_list_close_tag: ClassVar[str] = "</chromotogramList>"
   chromatogram_offset_regex: ClassVar[Pattern[str]] = re.compile('<offset idRef="TIC">([0-9]+)</offset>')
   chromatogram_start_index: ClassVar[int]
   delimiter: Delimiter = Delimiter("</spectrum>\n", "</offset>\n", DelimiterPosition.end)
+  encoded_length_regex: ClassVar[Pattern[bytes]] = re.compile(rb'(\s)encodedLength="[0-9]*"')
   footer_end_index: ClassVar[int]
   footer_start_index: ClassVar[int]
   header_end_index: ClassVar[int]
   header_start_index: ClassVar[int]
+  id_attribute_regex: ClassVar[Pattern[bytes]] = re.compile(rb'\sid="([^"]*)"')
   id_regex: ClassVar[Pattern[str]] = re.compile(".*scan=([0-9]+).*")
   identifiers: Identifiers
+  index_attribute_regex: ClassVar[Pattern[bytes]] = re.compile(rb'(\s)index="[0-9]*"')
   index_list_offset: ClassVar[int]
   index_list_offset_regex: ClassVar[Pattern[str]] = re.compile("<indexListOffset>([0-9]+)</indexListOffset>")
-  offset_regex: ClassVar[Pattern[str]] = re.compile("<offset[^>]*scan=[^>]*>([0-9]+)</offset>")
+  indices: ClassVar[IndexCache] = IndexCache()
   offset_end_index: int
+  offset_index: OffsetIndex
+  offset_regex: ClassVar[Pattern[bytes]] = re.compile(b"<offset[^>]*scan=[^>]*>([0-9]+)</offset>")
   offset_start_index: int
-  options: ClassVar[Options] = Options(has_header=True)
+  intensity_array_name: ClassVar[bytes] = b'name="intensity array"'
+  mz_array_name: ClassVar[bytes] = b'name="m/z array"'
+  options: ClassVar[Options] = Options(has_header=True, offset_index=True)
+  spectrum_close_tag: ClassVar[bytes] = b"</spectrum>"
   spectrum_list_close_tag: ClassVar[str] = "</spectrumList>"
   spectrum_list_count_regex: ClassVar[Pattern[str]] = re.compile(r'<spectrumList [\s\S]*count="([0-9]+)"')
+  spectrum_regex: ClassVar[Pattern[bytes]] = re.compile(rb"<spectrum\s")
   num_spectra: int = -1
-  xml_namespace: ClassVar[str] = "http://psi.hupo.org/ms/mzml"
+  value_regex: ClassVar[Pattern[bytes]] = re.compile(rb'\svalue="([^"]*)"')
 
   def __init__(self, obj: Any, offset_bounds: Optional[OffsetBounds] = None):
     iterator.Iterator.__init__(self, Iterator, obj, offset_bounds)
-    ET.register_namespace("", self.xml_namespace)
     self.__setup__()
 
   @classmethod
-  def __add_content__(cls: Any, content: str, f: BinaryIO) -> str:
-    f.write(str.encode(content))
-    return content
-
-  @classmethod
-  def __add_footer__(cls: Any, f: BinaryIO, content: str, offsets: List[Tuple[int, int]], metadata: Dict[str, str]):
-    content += cls.__add_content__("</spectrumList>", f)
-    metadata["footer_start_index"] = str(len(content))
-    content += cls.__add_content__("</run></mzML>\n", f)
-    list_offset = len(content)
+  def __add_footer__(cls: Any, writer: Writer, offsets: List[Tuple[str, int]], metadata: Dict[str, str]):
+    writer.write(b"</spectrumList>")
+    metadata["footer_start_index"] = str(writer.offset)
+    writer.write(b"</run></mzML>\n")
+    list_offset: int = writer.offset
     metadata["index_list_offset"] = str(list_offset)
-    content += cls.__add_content__('<indexList count="1">\n', f)
-    content += cls.__add_content__('<index name="spectrum">\n', f)
+    writer.write(b'<indexList count="1">\n<index name="spectrum">\n')
     for o in offsets:
-      content += cls.__add_content__('<offset idRef="controllerType=0 controllerNumber=1 scan={0:s}">{1:d}</offset>\n'.format(o[0], o[1]), f)
-    content += cls.__add_content__("</index>\n", f)
-    content += cls.__add_content__("</indexList>\n", f)
-    content += cls.__add_content__("<indexListOffset>{0:d}</indexListOffset>\n".format(list_offset), f)
-    content += cls.__add_content__("<fileChecksum>", f)
-    content += cls.__add_content__(str(hashlib.sha1(content.encode("utf-8")).hexdigest()), f)
-    content += cls.__add_content__("</fileChecksum>\n</indexedmzML>", f)
-    metadata["footer_end_index"] = str(len(content))
+      writer.write(str.encode('<offset idRef="controllerType=0 controllerNumber=1 scan={0:s}">{1:d}</offset>\n'.format(o[0], o[1])))
+    writer.write(str.encode("</index>\n</indexList>\n<indexListOffset>{0:d}</indexListOffset>\n<fileChecksum>".format(list_offset)))
+    # The checksum covers everything up to and including the opening tag
+    writer.write(str.encode(writer.checksum.hexdigest()))
+    writer.write(b"</fileChecksum>\n</indexedmzML>")
+    metadata["footer_end_index"] = str(writer.offset)
     metadata["num_spectra"] = str(len(offsets))
 
   @classmethod
-  def __create_header__(cls: Any, f: BinaryIO, header: str, count: int, metadata: Dict[str, str]) -> str:
-    header = re.sub(cls.spectrum_list_count_regex, '<spectrumList count="{0:d}"'.format(count), header)
+  def __add_spectrum__(cls: Any, writer: Writer, item: bytes, index: int):
+    # The index attribute is the only part of a spectrum that changes when it's written
+    tag_end: int = item.find(b">")
+    writer.write(cls.index_attribute_regex.sub(str.encode('\\1index="{0:d}"'.format(index)), item[:tag_end], 1))
+    writer.write(memoryview(item)[tag_end:])
+    writer.write(b"\n")
+
+  @classmethod
+  def __array_format__(cls: Any, content: bytes) -> Tuple[str, bool]:
+    # The dtype and compression of a binaryDataArray, from the cvParams before its <binary>
+    dtypes: List[str] = [dtype for [name, dtype] in cls.array_dtypes.items() if name in content]
+    assert(len(dtypes) == 1)
+    return (dtypes[0], b'name="zlib compression"' in content)
+
+  @classmethod
+  def __binary_arrays__(cls: Any, item: bytes) -> Iterable[Tuple[int, int, int]]:
+    # Yields where each <binaryDataArray> starts and where the base64 text of its <binary> starts and ends
+    m = cls.binary_array_regex.search(item)
+    while m is not None:
+      binary_start: int = item.index(b"<binary>", m.start()) + len(b"<binary>")
+      binary_end: int = item.index(b"</binary>", binary_start)
+      yield (m.start(), binary_start, binary_end)
+      m = cls.binary_array_regex.search(item, binary_end)
+
+  @classmethod
+  def __create_header__(cls: Any, writer: Writer, header: str, count: int, metadata: Dict[str, str]):
+    content: bytes = str.encode(re.sub(cls.spectrum_list_count_regex, '<spectrumList count="{0:d}"'.format(count), header))
     metadata["header_start_index"] = str(0)
-    metadata["header_end_index"] = str(len(header) - 1)
+    metadata["header_end_index"] = str(len(content) - 1)
     metadata["chromatogram_start_index"] = "-1"
     metadata["chromatogram_end_index"] = "-1"
     metadata["count"] = str(count)
-
-    content = cls.__add_content__(header, f)
-    return content
+    writer.write(content)
 
   @classmethod
-  def __cv_param__(cls: Any, item: Any, name: str) -> Optional[float]:
-    for cv_param in item.iter("cvParam"):
-      if cv_param.get("name") == name:
-        return float(cv_param.get("value"))
+  def __cv_param__(cls: Any, item: bytes, name: str) -> Optional[float]:
+    # Searches the raw spectrum for the first cvParam with the name, so spectra are never parsed
+    attribute: bytes = str.encode(' name="{0:s}"'.format(name))
+    index: int = item.find(attribute)
+    while index != -1:
+      tag_start: int = item.rfind(b"<", 0, index)
+      tag_end: int = item.find(b">", index)
+      if item.startswith(b"<cvParam", tag_start):
+        m = cls.value_regex.search(item, tag_start, tag_end)
+        if m is not None:
+          return float(m.group(1))
+      index = item.find(attribute, tag_end)
     return None
 
   def __get_header_offset__(self):
@@ -109,12 +209,8 @@ class Iterator(iterator.Iterator[Identifiers]):
       self.header_end_index = int(metadata["header_end_index"])
     else:
       self.header_start_index = 0
-      start_byte: int = max(0, self.index_list_offset - self.read_chunk_size)
-      end_byte: int = min(self.index_list_offset + self.read_chunk_size, self.entry.content_length())
-      stream: str = self.entry.get_range(start_byte, end_byte).decode("utf-8")
-      offset_matches: List[Any] = list(self.offset_regex.finditer(stream))
-      assert(len(offset_matches) > 0)
-      self.header_end_index = int(offset_matches[0].group(1)) - 1
+      assert(len(self.offset_index.offsets) > 0)
+      self.header_end_index = self.offset_index.offsets[0] - 1
 
   def __get_footer_offset__(self):
     metadata: Dict[str, str] = self.entry.get_metadata()
@@ -155,21 +251,66 @@ class Iterator(iterator.Iterator[Identifiers]):
 
   def __get_metadata__(self):
     self.__get_index_list_offset__()
+    self.__get_offset_index__()
     self.__get_header_offset__()
     self.header = self.entry.get_range(self.header_start_index, self.header_end_index).decode("utf-8")
     self.__get_footer_offset__()
 
-  def __get_offsets__(self, start_byte: int, end_byte: int, remainder: str=""):
-    stream = self.entry.get_range(start_byte, end_byte).decode("utf-8")
-    stream = remainder + stream
-    offset_regex = list(self.offset_regex.finditer(stream))
-    offsets = list(map(lambda r: int(r.group(1)), offset_regex))
-    if len(offset_regex) > 0:
-      regex_offset = offset_regex[-1].span(0)[1]
-      stream = stream[regex_offset:]
-      remainder = stream
+  def __get_offset_index__(self):
+    # Iterators over the same object in a process (pivot sampling, top blocks) only parse the index list once
+    index: Optional[OffsetIndex] = Iterator.indices.get(self.entry.key, self.entry.content_length())
+    if index is not None and index.index_list_offset == self.index_list_offset:
+      self.offset_index = index
+    else:
+      self.offset_index = self.__read_offset_index__()
+      Iterator.indices.put(self.entry.key, self.offset_index)
 
-    return [offsets, remainder]
+  @classmethod
+  def __parse_offsets__(cls: Any, stream: bytes, start_byte: int, offsets: List[int], positions: List[int]) -> int:
+    # Appends the <offset> entries in the stream and returns where the last one ends
+    end: int = 0
+    for m in cls.offset_regex.finditer(stream):
+      offsets.append(int(m.group(1)))
+      positions.append(start_byte + m.start())
+      end = m.end()
+    return end
+
+  def __read_offset_index__(self) -> OffsetIndex:
+    # Reads the index list in one pass
+    offsets: List[int] = []
+    positions: List[int] = []
+    content_length: int = self.entry.content_length()
+    start_byte: int = self.index_list_offset
+    remainder: bytes = b""
+    end: int = -1
+    while start_byte < content_length:
+      end_byte: int = min(start_byte + self.read_chunk_size, content_length - 1)
+      stream: bytes = remainder + self.entry.get_range(start_byte, end_byte)
+      stream_start: int = start_byte - len(remainder)
+      stream_end: int = self.__parse_offsets__(stream, stream_start, offsets, positions)
+      if stream_end > 0:
+        end = stream_start + stream_end
+      remainder = stream[stream_end:]
+      start_byte = end_byte + 1
+    return OffsetIndex(content_length, self.index_list_offset, offsets, positions, end)
+
+  @classmethod
+  def __spectra__(cls: Any, content: bytes) -> Iterable[bytes]:
+    # Yields each <spectrum>...</spectrum> span as is
+    m = cls.spectrum_regex.search(content)
+    while m is not None:
+      end: int = content.find(cls.spectrum_close_tag, m.start())
+      if end == -1:
+        return
+      end += len(cls.spectrum_close_tag)
+      yield content[m.start():end]
+      m = cls.spectrum_regex.search(content, end)
+
+  @classmethod
+  def __spectrum_id__(cls: Any, item: bytes) -> str:
+    m = cls.id_attribute_regex.search(item, 0, item.find(b">"))
+    assert(m is not None)
+    return m.group(1).decode("utf-8")
 
   def __setup__(self):
     self.__get_metadata__()
@@ -177,72 +318,38 @@ class Iterator(iterator.Iterator[Identifiers]):
     self.__set_offset_indices__()
 
   def __set_offset_indices__(self):
-    self.offset_start_index = None
-    self.offset_end_index = None
-
-    start_byte: int = 0
+    offsets: array = self.offset_index.offsets
+    positions: array = self.offset_index.positions
     if self.offset_bounds:
-      start_byte = self.index_list_offset
+      self.offset_start_index = None
+      index: int = bisect.bisect_left(offsets, self.spectra_start_index)
+      if index < len(offsets) and offsets[index] == self.spectra_start_index:
+        self.offset_start_index = positions[index]
     else:
-      start_byte: int = max(0, self.footer_end_index - self.read_chunk_size)
       self.offset_start_index = self.index_list_offset
 
-    end_byte: int = min(self.footer_end_index, start_byte + self.read_chunk_size)
-    remainder: str = ""
-    last_match = None
-    index: Optional[int] = None
-    while start_byte < self.footer_end_index:
-      stream: str = self.entry.get_range(start_byte, end_byte).decode("utf-8")
-      stream = remainder + stream
-      offset_matches = list(self.offset_regex.finditer(stream))
-      index = start_byte - len(remainder)
-      for m in offset_matches:
-        offset: int = int(m.group(1))
-        if self.offset_start_index is None and offset == self.spectra_start_index:
-          self.offset_start_index = index + m.span(0)[0]
-        if self.offset_end_index is None and int(m.group(1)) > self.spectra_end_index:
-          self.offset_end_index = index + m.span(0)[0] - 1
-
-      if len(offset_matches) > 0:
-        remainder = stream[offset_matches[-1].span()[1] + 1:]
-        last_match = offset_matches[-1]
-      else:
-        remainder = stream
-      start_byte = end_byte + 1
-      end_byte = min(self.footer_end_index, start_byte + self.read_chunk_size)
-
-    if self.offset_end_index is None:
-      self.offset_end_index = index + last_match.span(0)[1]
+    index = bisect.bisect_right(offsets, self.spectra_end_index)
+    if index < len(offsets):
+      self.offset_end_index = positions[index] - 1
+    else:
+      self.offset_end_index = self.offset_index.end
 
   def __spectra_offsets__(self):
     if self.offset_bounds:
       self.spectra_start_index = max(self.offset_bounds.start_index, self.header_end_index + 1)
       self.spectra_end_index = min(self.offset_bounds.end_index, self.footer_start_index - 1)
 
-      start_byte: int = self.footer_start_index
-      remainder: str = ""
-      included_offsets = []
-      before_offset: int = self.header_end_index
-      after_offset: int = self.footer_start_index - 1
-
       # Determine the set of spectra offsets in the offset range
-      while start_byte < self.footer_end_index:
-        end_byte: int = min(start_byte + self.read_chunk_size, self.footer_end_index)
-        [offsets, remainder] = self.__get_offsets__(start_byte, end_byte, remainder)
-        for offset in offsets:
-          if self.spectra_start_index <= offset and offset <= self.spectra_end_index:
-            included_offsets.append(offset)
-          elif offset < self.spectra_start_index:
-            before_offset = max(before_offset, offset)
-          else:
-            assert(offset > self.spectra_end_index)
-            after_offset = min(after_offset, offset)
-        start_byte = end_byte + 1
-
-      if len(included_offsets) == 0:
+      offsets: array = self.offset_index.offsets
+      start: int = bisect.bisect_left(offsets, self.spectra_start_index)
+      end: int = bisect.bisect_right(offsets, self.spectra_end_index)
+      before_offset: int = max(self.header_end_index, offsets[start - 1]) if start > 0 else self.header_end_index
+      after_offset: int = min(self.footer_start_index - 1, offsets[end]) if end < len(offsets) else self.footer_start_index - 1
+
+      if start == end:
         self.spectra_start_index = before_offset
       else:
-        self.spectra_start_index = included_offsets[0]
+        self.spectra_start_index = offsets[start]
       self.spectra_end_index = after_offset - 1
     else:
       self.spectra_start_index = self.header_end_index + 1
@@ -253,74 +360,110 @@ class Iterator(iterator.Iterator[Identifiers]):
     metadata: Dict[str, str] = {}
     iterators = []
     count = 0
-    header: str = ""
     for entry in entries:
       iterator = Iterator(entry)
       iterators.append(iterator)
       count += iterator.get_item_count()
 
     assert(len(iterators) > 0)
-    header = iterators[0].header
-
-    content: str = cls.__create_header__(f, header, count, metadata)
-    offset = len(content)
-    offsets = []
+    writer = Writer(f)
+    cls.__create_header__(writer, iterators[0].header, count, metadata)
+    offsets: List[Tuple[str, int]] = []
     index = 0
-    metadata["spectra_start_index"] = str(offset)
+    metadata["spectra_start_index"] = str(writer.offset)
 
     for iterator in iterators:
-      more = True
-      while more:
-        [spectra, _, more] = iterator.next()
-        spectra_content: str = ""
-        for xml in spectra:
-          xml.set("index", str(index))
-          offsets.append((xml.get("id"), offset))
-          spectrum = ET.tostring(xml).decode()
-          offset += len(spectrum)
-          spectra_content += spectrum
-          index += 1
-        content += cls.__add_content__(spectra_content, f)
-
-    metadata["spectra_end_index"] = str(offset)
-
-    cls.__add_footer__(f, content, offsets, metadata)
+      for item in iterator.iterate():
+        offsets.append((cls.__spectrum_id__(item), writer.offset))
+        cls.__add_spectrum__(writer, item, index)
+        index += 1
+
+    metadata["spectra_end_index"] = str(writer.offset)
+    cls.__add_footer__(writer, offsets, metadata)
     return metadata
 
   @classmethod
-  def from_array(cls: Any, items: List[Any], f: Optional[BinaryIO], extra: Dict[str, Any]) -> Tuple[str, Dict[str, str]]:
+  def decode_array(cls: Any, content: bytes, dtype: str, compressed: bool) -> Any:
+    # numpy is only needed by the stages that look at peaks, so it isn't imported with the format
+    import numpy as np
+    content = base64.b64decode(content)
+    if compressed:
+      content = zlib.decompress(content)
+    return np.frombuffer(content, dtype=dtype)
+
+  @classmethod
+  def encode_array(cls: Any, values: Any, dtype: str, compressed: bool) -> bytes:
+    import numpy as np
+    content: bytes = np.ascontiguousarray(values, dtype=dtype).tobytes()
+    if compressed:
+      content = zlib.compress(content)
+    return base64.b64encode(content)
+
+  @classmethod
+  def from_array(cls: Any, items: List[Any], f: Optional[BinaryIO], extra: Dict[str, Any]) -> Tuple[bytes, Dict[str, str]]:
     metadata: Dict[str, str] = {}
-    content: str = cls.__create_header__(f, extra["header"], len(items), metadata)
-    offset = len(content)
-    offsets = []
+    # Without a file the output is built in memory and returned
+    writer = Writer(f if f else io.BytesIO())
+    cls.__create_header__(writer, extra["header"], len(items), metadata)
+    offsets: List[Tuple[str, int]] = []
 
     count = 0
-    for xml in items:
-      xml.set("index", str(count))
-      m = cls.id_regex.match(xml.get("id"))
+    for item in items:
+      m = cls.id_regex.match(cls.__spectrum_id__(item))
       assert(m is not None)
-      offsets.append((m.group(1), offset))
-      spectrum = ET.tostring(xml).decode()
-      offset += len(spectrum)
-      content += cls.__add_content__(spectrum, f)
+      offsets.append((m.group(1), writer.offset))
+      cls.__add_spectrum__(writer, item, count)
       count += 1
 
-    cls.__add_footer__(f, content, offsets, metadata)
-    return (content, metadata)
+    cls.__add_footer__(writer, offsets, metadata)
+    return (b"" if f else writer.f.getvalue(), metadata)
+
+  @classmethod
+  def create_index(cls: Any, content: bytes, identifier: Optional[Identifiers] = None) -> Optional[OffsetIndex]:
+    # mzML files carry their own offset index, so the sidecar only saves parsing it
+    start: int = content.rfind(b"<indexListOffset>")
+    if start == -1:
+      return None
+    start += len(b"<indexListOffset>")
+    index_list_offset: int = int(content[start:content.find(b"<", start)])
+    offsets: List[int] = []
+    positions: List[int] = []
+    end: int = cls.__parse_offsets__(content[index_list_offset:], index_list_offset, offsets, positions)
+    return OffsetIndex(len(content), index_list_offset, offsets, positions, index_list_offset + end)
+
+  @classmethod
+  def load_index(cls: Any, key: str, content: bytes) -> OffsetIndex:
+    return OffsetIndex.from_bytes(content)
 
   def get_extra(self) -> Dict[str, Any]:
     return {"header": self.header}
 
   @classmethod
-  def get_identifier_value(cls: Any, item: str, identifier: Identifiers) -> float:
+  def get_identifier_value(cls: Any, item: bytes, identifier: Identifiers) -> float:
     value: Optional[float] = None
     if identifier == Identifiers.mass:
       value = cls.__cv_param__(item, "base peak m/z")
+    elif identifier == Identifiers.peaks:
+      m = cls.array_length_regex.search(item, 0, item.find(b">"))
+      value = float(m.group(2)) if m is not None else None
+    elif identifier == Identifiers.precursor:
+      value = cls.__cv_param__(item, "selected ion m/z")
     else:
       value = cls.__cv_param__(item, "total ion current")
     assert(value is not None)
     return value
 
+  @classmethod
+  def get_peaks(cls: Any, item: bytes) -> Tuple[Any, Any]:
+    # Decodes the m/z and intensity arrays of a spectrum into numpy arrays
+    arrays: Dict[bytes, Any] = {}
+    for [start, binary_start, binary_end] in cls.__binary_arrays__(item):
+      header: bytes = item[start:binary_start]
+      for name in [cls.mz_array_name, cls.intensity_array_name]:
+        if name in header:
+          arrays[name] = cls.decode_array(item[binary_start:binary_end], *cls.__array_format__(header))
+    return (arrays[cls.mz_array_name], arrays[cls.intensity_array_name])
+
   def get_item_count(self) -> int:
     if self.num_spectra != -1:
       return self.num_spectra
@@ -349,9 +492,29 @@ class Iterator(iterator.Iterator[Identifiers]):
 
   @classmethod
   def to_array(cls: Any, content: bytes) -> Iterable[Any]:
-    content = "<data>" + content.decode("utf-8") + "</data>"
-    root = ET.fromstring(content)
-    return filter(lambda item: cls.__cv_param__(item, "ms level") == 2, root.iter("spectrum"))
+    return filter(lambda item: cls.__cv_param__(item, "ms level") == 2, cls.__spectra__(content))
+
+  @classmethod
+  def set_peaks(cls: Any, item: bytes, mz: Any, intensity: Any) -> bytes:
+    # Returns the spectrum with new m/z and intensity arrays, encoded with the precision and
+    # compression of the arrays they replace
+    pieces: List[bytes] = []
+    last: int = 0
+    for [start, binary_start, binary_end] in cls.__binary_arrays__(item):
+      header: bytes = item[start:binary_start]
+      values: Any = None
+      if cls.mz_array_name in header:
+        values = mz
+      elif cls.intensity_array_name in header:
+        values = intensity
+      if values is not None:
+        content: bytes = cls.encode_array(values, *cls.__array_format__(header))
+        pieces += [item[last:start], cls.encoded_length_regex.sub(str.encode('\\1encodedLength="{0:d}"'.format(len(content))), header, 1), content]
+        last = binary_end
+    pieces.append(item[last:])
+    item = b"".join(pieces)
+    tag_end: int = item.find(b">")
+    return cls.array_length_regex.sub(str.encode('\\1defaultArrayLength="{0:d}"'.format(len(mz))), item[:tag_end], 1) + item[tag_end:]
 
   def transform(self, stream: bytes, offset_bounds: Optional[OffsetBounds]) -> Tuple[bytes, Optional[OffsetBounds]]:
     start_index: int
@@ -360,18 +523,19 @@ class Iterator(iterator.Iterator[Identifiers]):
       start_index = self.spectra_start_index
       end_index = self.spectra_end_index
     else:
-      s: str = stream.decode("utf-8")
-      offsets: List[int] = list(map(lambda r: int(r.group(1)), self.offset_regex.finditer(s)))
-      assert(len(offsets) > 0)
-      s = self.entry.get_range(offset_bounds.end_index, offset_bounds.end_index + self.read_chunk_size).decode("utf-8")
-      next_offsets: List[int] = list(map(lambda r: int(r.group(1)), self.offset_regex.finditer(s)))
-      offset_bounds.start_index = offsets[0]
-      if len(next_offsets) > 0:
-        offset_bounds.end_index = next_offsets[0] - 1
+      # The stream holds the <offset> entries, which map to the spectra through the offset table
+      offsets: array = self.offset_index.offsets
+      positions: array = self.offset_index.positions
+      start: int = bisect.bisect_left(positions, offset_bounds.start_index)
+      end: int = bisect.bisect_left(positions, offset_bounds.end_index)
+      assert(start < end)
+      offset_bounds.start_index = offsets[start]
+      if end < len(offsets):
+        offset_bounds.end_index = offsets[end] - 1
       else:
         offset_bounds.end_index = self.spectra_end_index
       start_index = offset_bounds.start_index
       end_index = offset_bounds.end_index
     assert(start_index <= end_index)
-    stream = self.entry.get_range(start_index, end_index)
+    stream = self.__get_range__(start_index, end_index)
     return (stream, OffsetBounds(start_index, end_index))
@@ -13,68 +13,185 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import bisect
 import boto3
+import math
 import util
 from formats import iterator
 from database.database import Entry
 from formats.iterator import Delimiter, DelimiterPosition, OffsetBounds, Options
-from typing import Any, BinaryIO, ClassVar, Dict, List, Optional
+from typing import Any, BinaryIO, ClassVar, Dict, List, Optional, Tuple
+
+
+class Bucket:
+  # Covers the values in [start, end). A bucket with start == end is a point
+  # bucket and only covers start. Heavy hitters get their own point buckets.
+  def __init__(self, start: float, end: float, count: float):
+    self.count = count
+    self.end = end
+    self.start = start
+
+  def is_point(self) -> bool:
+    return self.start == self.end
 
 
 class Iterator(iterator.Iterator[None]):
   delimiter: Delimiter = Delimiter(item_token="\n\n", offset_token="\n\n", position=DelimiterPosition.inbetween)
   identifiers: None
-  increment: ClassVar[int] = 25  # TODO: Unhardcode
 
   def __init__(self, entry: Any, offset_bounds: Optional[OffsetBounds] = None):
     iterator.Iterator.__init__(self, Iterator, entry, offset_bounds)
 
   @classmethod
   def combine(cls: Any, entries: List[Entry], f: BinaryIO, extra: Dict[str, Any]) -> Dict[str, str]:
-    pivots = set()
+    buckets: List[Bucket] = []
     file_key: Optional[str] = None
     for entry in entries:
-      content: str = entry.get_content().decode("utf-8")
-      [file_bucket, file_key, pivot_content] = content.split("\n")
-      pivot_content: str = pivot_content.strip()
-      if len(pivot_content) > 0:
-        new_pivots = set(list(map(lambda p: float(p), pivot_content.split("\t"))))
-        pivots = pivots.union(new_pivots)
+      [file_bucket, file_key, pivots, counts] = parse(entry.get_content().decode("utf-8"))
+      buckets += get_buckets(pivots, counts)
     assert(file_key is not None)
 
-    pivots = list(pivots)
-    pivots.sort()
-    super_pivots: List[int] = []
-    num_bins = extra["num_pivot_bins"] # TODO: Figure out what to do if we want to hardcode this
-    #num_bins = int((len(pivots) + cls.increment) / cls.increment)
-    increment = float(len(pivots)) / num_bins
-
-    i: int = 0
-    while i < len(pivots):
-      x: int = min(round(i), len(pivots) - 1)
-      super_pivots.append(pivots[x])
-      i += increment
-
-    if super_pivots[-1] != pivots[-1]:
-      super_pivots.append(pivots[-1])
-    spivots: List[str] = list(map(lambda p: str(p), super_pivots))
-    content: str = "{0:s}\n{1:s}\n{2:s}".format(file_bucket, file_key, "\t".join(spivots))
-    f.write(str.encode(content))
+    [pivots, counts] = balance(create_histogram(buckets), extra["num_pivot_bins"])
+    f.write(str.encode(to_content(file_bucket, file_key, pivots, counts)))
     return {}
 
 
+def balance(cells: List[Bucket], num_bins: int) -> Tuple[List[float], List[float]]:
+  # Cuts the histogram into bins with roughly the same predicted count.
+  # Range cells are split by value. Point cells that would overflow a bin are
+  # split into several point bins, and sort deals their records round robin.
+  if len(cells) == 0:
+    return ([], [])
+  target: float = max(sum(map(lambda cell: cell.count, cells)) / num_bins, 1.0)
+  pivots: List[float] = [cells[0].start]
+  counts: List[float] = []
+  current: float = 0.0
+  for cell in cells:
+    if cell.is_point():
+      if cell.count <= target:
+        current += cell.count
+        continue
+      if pivots[-1] != cell.start:
+        pivots.append(cell.start)
+        counts.append(current)
+      parts: int = int(math.ceil(cell.count / target))
+      pivots += [cell.start] * parts
+      counts += [cell.count / parts] * parts
+      current = 0.0
+    else:
+      start: float = cell.start
+      remaining: float = cell.count
+      while current + remaining > target and len(counts) < num_bins - 1:
+        cut: float = start + (cell.end - start) * (target - current) / remaining
+        if cut <= pivots[-1] or cut >= cell.end:
+          break
+        pivots.append(cut)
+        counts.append(target)
+        remaining -= target - current
+        start = cut
+        current = 0.0
+      current += remaining
+  if pivots[-1] != cells[-1].end or len(counts) == 0:
+    pivots.append(cells[-1].end)
+    counts.append(current)
+  else:
+    counts[-1] += current
+  return (pivots, counts)
+
+
+def create_buckets(values: List[float], num_bins: int, scale: float = 1.0) -> Tuple[List[float], List[float]]:
+  # Quantile buckets over the sorted values. A value that fills a whole bin gets a point bucket,
+  # so the combine can see heavy hitters instead of spreading them over a range.
+  if len(values) == 0:
+    return ([], [])
+  n: int = len(values)
+  boundaries: List[float] = list(map(lambda i: values[int(i * n / num_bins)], range(num_bins)))
+  pivots: List[float] = []
+  for boundary in boundaries:
+    if len(pivots) > 0 and pivots[-1] == boundary:
+      continue
+    pivots.append(boundary)
+    if bisect.bisect_right(values, boundary) - bisect.bisect_left(values, boundary) > n / num_bins:
+      pivots.append(boundary)
+
+  max_identifier: float = float(values[-1] + 1)
+  if pivots[-1] == values[-1] and (len(pivots) == 1 or pivots[-2] != pivots[-1]):
+    pivots[-1] = max_identifier
+  else:
+    pivots.append(max_identifier)
+
+  counts: List[float] = []
+  for i in range(len(pivots) - 1):
+    [start, end] = [pivots[i], pivots[i + 1]]
+    if start == end:
+      count: int = bisect.bisect_right(values, start) - bisect.bisect_left(values, start)
+    else:
+      count = bisect.bisect_left(values, end) - bisect.bisect_left(values, start)
+      if i > 0 and pivots[i - 1] == start:
+        count = bisect.bisect_left(values, end) - bisect.bisect_right(values, start)
+    counts.append(count * scale)
+  return (pivots, counts)
+
+
+def create_histogram(buckets: List[Bucket]) -> List[Bucket]:
+  # Merges buckets from many files into cells over all the boundaries.
+  # Range buckets are assumed to be uniform, so each adds a constant density over its range.
+  boundaries: List[float] = sorted(set(map(lambda bucket: bucket.start, buckets)).union(map(lambda bucket: bucket.end, buckets)))
+  points: Dict[float, float] = {}
+  deltas: List[float] = [0.0] * len(boundaries)
+  for bucket in buckets:
+    if bucket.is_point():
+      points[bucket.start] = points.get(bucket.start, 0.0) + bucket.count
+    else:
+      density: float = bucket.count / (bucket.end - bucket.start)
+      deltas[bisect.bisect_left(boundaries, bucket.start)] += density
+      deltas[bisect.bisect_left(boundaries, bucket.end)] -= density
+
+  cells: List[Bucket] = []
+  density = 0.0
+  for i in range(len(boundaries)):
+    if boundaries[i] in points:
+      cells.append(Bucket(boundaries[i], boundaries[i], points[boundaries[i]]))
+    density += deltas[i]
+    if i < len(boundaries) - 1:
+      cells.append(Bucket(boundaries[i], boundaries[i + 1], density * (boundaries[i + 1] - boundaries[i])))
+  return cells
+
+
+def get_buckets(pivots: List[float], counts: List[float]) -> List[Bucket]:
+  return list(map(lambda i: Bucket(pivots[i], pivots[i + 1], counts[i]), range(len(pivots) - 1)))
+
+
 def get_pivot_ranges(bucket_name, key, params={}):
   ranges = []
 
   content: str = params["database"].get_entry(bucket_name, key).get_content().decode("utf-8")
-  [file_bucket, file_key, pivot_content] = content.split("\n")
-  pivots = list(map(lambda p: float(p), pivot_content.split("\t")))
+  [file_bucket, file_key, pivots, _] = parse(content)
 
   for i in range(len(pivots) - 1):
-    end_range = int(pivots[i + 1])
+    # Ranges with the same start and end are parts of a heavy hitter
     ranges.append({
-      "range": [int(pivots[i]), end_range],
+      "range": [pivots[i], pivots[i + 1]],
       "bin": i + 1,
     })
 
   return file_bucket, file_key, ranges
+
+
+def parse(content: str) -> Tuple[str, str, List[float], List[float]]:
+  # Pivot files have the input bucket, input key, pivots and, optionally, the count of each bucket
+  lines: List[str] = content.split("\n")
+  [file_bucket, file_key, pivot_content] = lines[:3]
+  pivot_content = pivot_content.strip()
+  pivots: List[float] = list(map(lambda p: float(p), pivot_content.split("\t"))) if len(pivot_content) > 0 else []
+  if len(lines) > 3 and len(lines[3].strip()) > 0:
+    counts: List[float] = list(map(lambda c: float(c), lines[3].strip().split("\t")))
+  else:
+    counts = [1.0] * max(len(pivots) - 1, 0)
+  return (file_bucket, file_key, pivots, counts)
+
+
+def to_content(file_bucket: str, file_key: str, pivots: List[float], counts: List[float]) -> str:
+  spivots: str = "\t".join(list(map(lambda p: str(p), pivots)))
+  scounts: str = "\t".join(list(map(lambda c: str(int(round(c))), counts)))
+  return "{0:s}\n{1:s}\n{2:s}\n{3:s}".format(file_bucket, file_key, spivots, scounts)
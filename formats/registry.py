@@ -0,0 +1,100 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib
+import importlib.util
+import os
+import re
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+IMPORT_REGEXES = [re.compile(r"import ([a-zA-Z\_\.]+)"), re.compile(r"from ([a-zA-Z\_\.]+) import (.*)")]
+folder: str = os.path.dirname(os.path.abspath(__file__)) + "/"
+# Modules in the folder that aren't formats
+excluded: Set[str] = set(["__init__", "iterator", "registry"])
+
+
+class Format:
+  # A format module and what stages can do with it, so they don't need to inspect the module
+  def __init__(self, name: str, module: Any):
+    self.name = name
+    self.module = module
+    self.iterator: Any = getattr(module, "Iterator")
+    identifiers: Any = getattr(module, "Identifiers", None)
+    self.identifiers: Dict[str, Any] = dict(identifiers.__members__) if identifiers is not None and issubclass(identifiers, Enum) else {}
+    self.binary: bool = self.iterator.options.binary
+    self.has_header: bool = self.iterator.options.has_header
+    self.offset_index: bool = self.iterator.options.offset_index
+    self.views: bool = self.iterator.supports_views()
+
+  def identifier(self, name: str) -> Any:
+    if name not in self.identifiers:
+      raise Exception("registry::Format: Unknown identifier", self.name, name)
+    return self.identifiers[name]
+
+
+formats: Dict[str, Optional[Format]] = {}
+scanned: Dict[Tuple[str, str], Set[str]] = {}
+
+
+def find(name: str) -> Optional[Format]:
+  # Returns None if there's no format with the name. Modules are imported once per process.
+  if name not in formats:
+    if name in excluded or importlib.util.find_spec("formats." + name) is None:
+      formats[name] = None
+    else:
+      formats[name] = Format(name, importlib.import_module("formats." + name))
+  return formats[name]
+
+
+def get(name: str) -> Format:
+  f: Optional[Format] = find(name)
+  if f is None:
+    raise Exception("registry::get: Unknown format", name)
+  return f
+
+
+def scan_imports(path: str, path_folder: str) -> Set[str]:
+  # Finds the modules a file imports, following imports of other files in the folder.
+  # Files aren't imported, so pipelines can be compiled without the libraries the formats use.
+  if (path, path_folder) not in scanned:
+    imports: Set[str] = set()
+    with open(path, "r") as f:
+      for line in f.readlines():
+        for regex in IMPORT_REGEXES:
+          m = regex.match(line)
+          if m:
+            # TODO: Figure out if there's a better way to handle imports
+            # Currently have to special case things like from formats import new_line
+            name: str = m.group(1).split(".")[0]
+            if name == "formats":
+              name = m.group(2)
+            imports.add(name)
+            dependency: str = path_folder + name + ".py"
+            if os.path.isfile(dependency) and dependency != path:
+              imports = imports.union(scan_imports(dependency, path_folder))
+            break
+    scanned[(path, path_folder)] = imports
+  return scanned[(path, path_folder)]
+
+
+def names() -> List[str]:
+  return sorted(map(lambda file: file[:-3], filter(lambda file: file.endswith(".py") and file[:-3] not in excluded, os.listdir(folder))))
+
+
+def sources() -> Dict[str, Set[str]]:
+  # The modules each format imports
+  return dict(map(lambda name: (name, scan_imports(folder + name + ".py", folder)), names()))
@@ -13,14 +13,80 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
+import numpy as np
 from formats import new_line
-from formats.iterator import OffsetBounds, Options
-from typing import Any, ClassVar, Generic, List, Optional, TypeVar
+from formats.iterator import OffsetBounds, Options, RecordView
+from typing import Any, ClassVar, Generic, List, Optional, Tuple, TypeVar
 
 
 T = TypeVar("T")
 
 
+class Columns:
+  # Where each field of a chunk of lines starts and ends, found with one pass over the bytes,
+  # so a column can be parsed in bulk without splitting every line.
+  max_fixed_width: ClassVar[int] = 64
+
+  def __init__(self, content: bytes, item_delimiter: str):
+    if len(content) > 0 and not content.endswith(b"\n"):
+      content += b"\n"
+    self.buffer = np.frombuffer(content, dtype=np.uint8)
+    self.separators = np.flatnonzero((self.buffer == ord(item_delimiter)) | (self.buffer == ord("\n")))
+    newlines = self.buffer[self.separators] == ord("\n")
+    line_ends = self.separators[newlines]
+    self.line_starts = np.concatenate(([0], line_ends[:-1] + 1)).astype(np.int64)
+    # Row of each separator and which field of the row it ends
+    self.rows = np.cumsum(newlines) - newlines
+    first_separators = np.concatenate(([0], np.flatnonzero(newlines)[:-1] + 1)).astype(np.int64)
+    self.fields = np.arange(len(self.separators)) - first_separators[self.rows]
+    # Blank lines aren't records
+    self.lines = np.flatnonzero(line_ends > self.line_starts)
+    self.line_ends = line_ends
+
+  def __bounds__(self, index: int) -> Tuple[Any, Any]:
+    positions = np.flatnonzero(self.fields == index)
+    positions = positions[self.line_ends[self.rows[positions]] > self.line_starts[self.rows[positions]]]
+    if len(positions) != len(self.lines):
+      raise Exception("tsv::Columns: Lines without column", index)
+    ends = self.separators[positions]
+    if index == 0:
+      starts = self.line_starts[self.lines]
+    else:
+      starts = self.separators[positions - 1] + 1
+    return (starts, ends)
+
+  def __len__(self) -> int:
+    return len(self.lines)
+
+  def column(self, index: int, dtype: Any = np.float64) -> Any:
+    # Parses a column with one numpy cast instead of a float() per line
+    return self.strings(index).astype(dtype)
+
+  def count(self, index: int, maximum: float) -> int:
+    # Number of lines whose value in the column is at most maximum
+    return int(np.count_nonzero(self.column(index) <= maximum))
+
+  def filter(self, mask: Any) -> List[bytes]:
+    # The lines selected by a boolean mask over the rows
+    lines = self.lines[mask]
+    return list(map(lambda i: self.buffer[self.line_starts[i]:self.line_ends[i]].tobytes(), lines))
+
+  def strings(self, index: int) -> Any:
+    # The fields of a column as a fixed width bytes array. Every field is padded to the longest,
+    # so if a field is long the column is an array of bytes objects instead.
+    [starts, ends] = self.__bounds__(index)
+    lengths = ends - starts
+    width: int = max(1, int(np.max(lengths))) if len(starts) > 0 else 1
+    if width > self.max_fixed_width:
+      return np.array(list(map(lambda i: self.buffer[starts[i]:ends[i]].tobytes(), range(len(starts)))), dtype=object)
+    # Copy one character of every field at a time, so the only temporaries are per row
+    characters = np.zeros((len(starts), width), dtype=np.uint8)
+    for i in range(width):
+      rows = np.flatnonzero(lengths > i)
+      characters[rows, i] = self.buffer[starts[rows] + i]
+    return characters.view("S{0:d}".format(width)).ravel()
+
+
 class Iterator(Generic[T], new_line.Iterator[T]):
   identifiers: T
   item_delimiter: ClassVar[str] = "\t"
@@ -29,6 +95,15 @@ class Iterator(Generic[T], new_line.Iterator[T]):
   def __init__(self, obj: Any, offset_bounds: Optional[OffsetBounds] = None):
     new_line.Iterator.__init__(self, obj, offset_bounds)
 
+  @classmethod
+  def column_index(cls: Any, identifier: T) -> int:
+    # The column that holds an identifier
+    return identifier.value
+
+  @classmethod
+  def to_columns(cls: Any, content: bytes) -> Columns:
+    return Columns(content, cls.item_delimiter)
+
   @classmethod
   def to_tsv_array(cls: Any, items: List[str]) -> List[List[str]]:
     tsv_items: List[List[str]] = list(map(lambda item: item.split(cls.item_delimiter), items))
@@ -37,3 +112,15 @@ class Iterator(Generic[T], new_line.Iterator[T]):
   @classmethod
   def get_identifier_value(cls: Any, item: str, identifier: T) -> float:
     raise Exception("Not Implemented")
+
+  @classmethod
+  def get_record_values(cls: Any, items: List[Any], identifier: T) -> List[float]:
+    columns: Columns = cls.to_columns(b"\n".join(map(lambda item: item.view() if isinstance(item, RecordView) else item, items)))
+    if len(columns) != len(items):
+      return super().get_record_values(items, identifier)
+    return columns.column(cls.column_index(identifier)).tolist()
+
+  def next_columns(self) -> Tuple[Columns, Optional[OffsetBounds], bool]:
+    # Like next, but the chunk is returned as columns instead of records
+    [stream, offset_bounds, more] = self.__next_stream__()
+    return (self.to_columns(stream), offset_bounds, more)
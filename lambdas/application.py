@@ -15,7 +15,8 @@
 
 import importlib
 import util
-from formats.iterator import OffsetBounds
+from formats import registry
+from formats.iterator import OffsetBounds, write_index
 from typing import Any, Dict, List
 
 
@@ -27,9 +28,8 @@ def run_application(database, bucket_name: str, key: str, input_format: Dict[str
     database.download(bucket_name, key, temp_file)
   else:
     obj = database.get_entry(bucket_name, key)
-    format_lib = importlib.import_module("formats." + params["input_format"])
-    iterator_class = getattr(format_lib, "Iterator")
-    iterator = iterator_class(obj, OffsetBounds(offsets[0], offsets[1]))
+    iterator_class = registry.get(params["input_format"]).iterator
+    iterator = iterator_class(obj, OffsetBounds(offsets[0], offsets[1], util.is_set(params, "aligned")))
     items = iterator.get(iterator.get_start_index(), iterator.get_end_index())
     with open(temp_file, "wb+") as f:
       items = list(items)
@@ -52,6 +52,9 @@ def run_application(database, bucket_name: str, key: str, input_format: Dict[str
 
     with open(output_file, "rb") as f:
       database.put(params["bucket"], new_key, f, {})
+      ext = new_key.split(".")[-1]
+      if util.is_set(params, "record_index") and registry.find(ext) is not None:
+        write_index(database, params["bucket"], new_key, registry.get(ext).iterator, f)
   return True
 
 
@@ -13,10 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
-import importlib
 import os
 import util
 from database.database import Database, Entry
+from formats import registry
+from formats.iterator import write_index
 from typing import Any, Dict, List
 
 
@@ -33,8 +34,7 @@ def combine(database: Database, table_name, key, input_format, output_format, of
     msg = msg.format(input_format["timestamp"], input_format["nonce"], input_format["bin"], input_format["file_id"])
     print(msg)
 
-    format_lib = importlib.import_module("formats." + params["output_format"])
-    iterator_class = getattr(format_lib, "Iterator")
+    iterator_class = registry.get(params["output_format"]).iterator
     temp_name = "/tmp/{0:s}".format(file_name)
     # Make this deterministic and combine in the same order
     keys.sort()
@@ -50,6 +50,8 @@ def combine(database: Database, table_name, key, input_format, output_format, of
     if not found:
       with open(temp_name, "rb") as f:
         database.put(params["bucket"], file_name, f, metadata, True)
+        if util.is_set(params, "record_index"):
+          write_index(database, params["bucket"], file_name, iterator_class, f, params["identifier"] if util.is_set(params, "sort") else None)
     os.remove(temp_name)
     return True
   else:
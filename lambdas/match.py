@@ -13,10 +13,11 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
-import importlib
 import util
 from database.database import Database
-from typing import Any, Dict, List, Tuple
+from formats import registry
+from formats.iterator import Zone
+from typing import Any, Dict, List, Optional, Tuple
 
 def find_match(database, bucket_name: str, key: str, input_format: Dict[str, Any], output_format: Dict[str, Any], offsets: List[int], params: Dict[str, Any]):
   [combine, last, keys] = util.combine_instance(bucket_name, key, params)
@@ -24,15 +25,24 @@ def find_match(database, bucket_name: str, key: str, input_format: Dict[str, Any
     print("Finding match")
     best_match = None
     match_score = 0
-    format_lib = importlib.import_module("formats." + params["input_format"])
-    iterator_class = getattr(format_lib, "Iterator")
+    format_lib = registry.get(params["input_format"])
+    iterator_class = format_lib.iterator
 
+    identifier = format_lib.identifier(params["identifier"])
     keys.sort()
     with open(util.LOG_NAME, "a+") as f:
       for key in keys:
         entry = database.get_entry(bucket_name, key)
+        # Skip objects whose zone shows they can't beat the current best match
+        zone: Optional[Zone] = Zone.from_metadata(entry.get_metadata(), identifier)
+        bound: Optional[float] = iterator_class.sum_bound(zone) if zone is not None else None
+        if bound is not None and bound <= match_score:
+          print("key {0:s} skipped".format(key))
+          continue
+
         it = iterator_class(entry, None)
-        score: float = it.sum(format_lib.Identifiers[params["identifier"]])
+        it.set_read_options(params)
+        score: float = it.sum(identifier)
 
         print("key {0:s} score {1:d}".format(key, score))
         f.write("key {0:s} score {1:d}\n".format(key, score))
@@ -14,52 +14,87 @@
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
 import boto3
-import importlib
+import math
+import random
 import util
 from database.database import Database, Entry
-from formats.iterator import OffsetBounds
-from typing import Any, Dict, List
+from formats import pivot, registry
+from formats.iterator import OffsetBounds, load_index
+from typing import Any, Dict, List, Optional, Tuple
 
 
-def create_pivots(d: Database, format_lib: Any, iterator_class: Any, items: List[Any], params: Dict[str, Any]) -> List[float]:
-  if len(items) == 0:
-    return []
+SAMPLE_WINDOW_SIZE = 1024*1024
 
-  pivots: List[float] = map(lambda item: iterator_class.get_identifier_value(item, format_lib.Identifiers[params["identifier"]]), items)
-  pivots = list(set(list(pivots)))
-  pivots.sort()
 
-  max_identifier: float = float(pivots[-1] + 1)
-  # TODO: Competition between parameters and key parameters. Need to fix
-  num_bins = params["num_pivot_bins"]
-  increment = int(len(items) / num_bins)
-  pivots = pivots[0::increment]
-  if pivots[-1] == max_identifier - 1:
-    pivots[-1] = max_identifier
-  else:
-    pivots.append(max_identifier)
-  return pivots
+def get_rank_error(num_samples: int, confidence: float = 0.95) -> float:
+  # Dvoretzky-Kiefer-Wolfowitz bound on how far a sampled quantile's rank can be from the true rank.
+  # Records within a window aren't independent, so this is a guide rather than a guarantee.
+  return math.sqrt(math.log(2.0 / (1.0 - confidence)) / (2.0 * num_samples))
+
+
+def sample_items(entry: Entry, iterator_class: Any, start_index: int, end_index: int, params: Dict[str, Any]) -> Optional[List[Any]]:
+  # Reads one window from each of pivot_samples equal strata of the range.
+  # The iterator aligns each window to record boundaries.
+  window_size: int = params["pivot_window_size"] if "pivot_window_size" in params else SAMPLE_WINDOW_SIZE
+  num_samples: int = params["pivot_samples"]
+  length: int = end_index - start_index + 1
+  if num_samples * window_size >= length:
+    return None
+
+  stratum_size: int = length // num_samples
+  # Seed with the key so re-executions pick the same pivots
+  generator = random.Random(entry.key)
+  items: List[Any] = []
+  for i in range(num_samples):
+    window_start: int = start_index + i * stratum_size + generator.randint(0, stratum_size - window_size)
+    it = iterator_class(entry, OffsetBounds(window_start, window_start + window_size - 1))
+    items += list(it.get(it.get_start_index(), it.get_end_index()))
+  return items
 
 
 def handle_pivots(database: Database, bucket_name, key, input_format, output_format, offsets, params):
   entry: Entry = database.get_entry(bucket_name, key)
 
-  format_lib = importlib.import_module("formats." + params["input_format"])
-  iterator_class = getattr(format_lib, "Iterator")
+  format_lib = registry.get(params["input_format"])
+  iterator_class = format_lib.iterator
+  if util.is_set(params, "record_index") and format_lib.offset_index:
+    # Reuse the offset table persisted with the object instead of parsing it again
+    load_index(database, bucket_name, key, iterator_class)
   if len(offsets) > 0:
-    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1]))
+    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1], util.is_set(params, "aligned")))
   else:
     it = iterator_class(entry, None)
+  it.set_read_options(params)
+
+  metadata: Dict[str, str] = {}
+  sampled_items: Optional[List[Any]] = None
+  if "pivot_samples" in params:
+    sampled_items = sample_items(entry, iterator_class, it.get_start_index(), it.get_end_index(), params)
+
+  identifier = format_lib.identifier(params["identifier"])
+  values: List[float]
+  # Scales sampled counts up to the whole range
+  scale: float = 1.0
+  if sampled_items is not None and len(sampled_items) > 0:
+    items: List[Any] = sampled_items
+    window_size: int = params["pivot_window_size"] if "pivot_window_size" in params else SAMPLE_WINDOW_SIZE
+    scale = float(it.get_end_index() - it.get_start_index() + 1) / (params["pivot_samples"] * window_size)
+    metadata["pivot_samples"] = str(len(items))
+    metadata["pivot_rank_error"] = str(get_rank_error(len(items)))
+    print("Sampled {0:d} records. Pivot rank error {1:s}".format(len(items), metadata["pivot_rank_error"]))
+    values = iterator_class.get_record_values(items, identifier)
+  else:
+    [items, values] = it.get_values(it.get_start_index(), it.get_end_index(), identifier)
 
-  items = it.get(it.get_start_index(), it.get_end_index())
-  pivots: List[float] = create_pivots(database, format_lib, iterator_class, list(items), params)
+  values = sorted(values)
+  # TODO: Competition between parameters and key parameters. Need to fix
+  [pivots, counts] = pivot.create_buckets(values, params["num_pivot_bins"], scale)
 
   output_format["ext"] = "pivot"
   pivot_key = util.file_name(output_format)
 
-  spivots = "\t".join(list(map(lambda p: str(p), pivots)))
-  content = str.encode("{0:s}\n{1:s}\n{2:s}".format(bucket_name, key, spivots))
-  database.write(params["bucket"], pivot_key, content, {}, True)
+  content = str.encode(pivot.to_content(bucket_name, key, pivots, counts))
+  database.write(params["bucket"], pivot_key, content, metadata, True)
   return True
 
 
@@ -13,56 +13,257 @@
 # You should have received a copy of the GNU General Public License
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
-import importlib
+import heapq
+import os
+import struct
+import tempfile
 import util
 from database.database import Database
-from formats.iterator import OffsetBounds
-from typing import Any, Dict, List, Tuple
+from formats import registry
+from formats.iterator import OffsetBounds, load_index, write_index
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+# Spilled runs are a sequence of (identifier, length) headers, each followed by the serialized item
+RUN_RECORD = struct.Struct("<dI")
+
+
+class Binner:
+  # Assigns sorted identifier values to bins. Bins with the same start and end are
+  # parts of a heavy hitter, and records with that value are dealt round robin
+  # between the parts, using their order as a tie-breaking secondary key.
+  def __init__(self, bin_ranges: List[Dict[str, Any]]):
+    self.bin_index = 0
+    self.bin_ranges = bin_ranges
+    self.tie_count = 0
+
+  def __contains__(self, value: float) -> bool:
+    [start, end] = self.bin_ranges[self.bin_index]["range"]
+    if start == end:
+      return value <= end
+    return value < end
+
+  def __parts__(self) -> int:
+    parts: int = 1
+    while self.bin_index + parts < len(self.bin_ranges) and self.bin_ranges[self.bin_index + parts]["range"] == self.bin_ranges[self.bin_index]["range"]:
+      parts += 1
+    return parts
+
+  def assign(self, value: float) -> int:
+    # Sampled pivots may not cover the extremes, so those values go to the outer bins
+    while value not in self and self.bin_index < len(self.bin_ranges) - 1:
+      self.bin_index += 1
+      self.tie_count = 0
+    [start, end] = self.bin_ranges[self.bin_index]["range"]
+    if start != end:
+      return self.bin_index
+    part: int = self.tie_count % self.__parts__()
+    self.tie_count += 1
+    return self.bin_index + part
 
 
 def bin_input(sorted_input: List[Tuple[float, Any]], bin_ranges: List[Dict[str, int]]) -> List[Any]:
-  bin_index = 0
+  binner = Binner(bin_ranges)
   binned_input = list(map(lambda r: [], bin_ranges))
-  count = 0
   for sinput in sorted_input:
-    identifier = sinput[0]
-    bin = None
-    while bin is None:
-      bin_range = bin_ranges[bin_index]["range"]
-      if bin_range[0] <= identifier and identifier < bin_range[1]:
-        bin = bin_index
-      else:
-        bin_index += 1
-    binned_input[bin_index].append(sinput[1])
-    count += 1
+    binned_input[binner.assign(sinput[0])].append(sinput[1])
   return binned_input
 
 
-def write_binned_input(database: Database, binned_input: List[Any], bin_ranges: List[Dict[str, int]], extra: Dict[str, Any], output_format, iterator_class, params):
+def write_binned_input(database: Database, binned_input: List[Any], bin_ranges: List[Dict[str, int]], extra: Dict[str, Any], output_format, iterator_class, identifier, params):
   for i in range(len(binned_input)):
     [content, metadata] = iterator_class.from_array(binned_input[i], None, extra)
+    metadata = {**metadata, **iterator_class.create_zone(binned_input[i], identifier, True).to_metadata()}
     output_format["bin"] = bin_ranges[i]["bin"]
     output_format["num_bins"] = len(bin_ranges)
     bin_key = util.file_name(output_format)
     database.write(params["bucket"], bin_key, content, metadata, True)
+    if util.is_set(params, "record_index"):
+      write_index(database, params["bucket"], bin_key, iterator_class, content, identifier)
+
+
+def write_run(items: List[Tuple[float, bytes]], file_name: str):
+  items.sort(key=lambda item: item[0])
+  with open(file_name, "wb+") as f:
+    for [identifier, content] in items:
+      f.write(RUN_RECORD.pack(identifier, len(content)))
+      f.write(content)
+
+
+def read_run(file_name: str) -> Iterable[Tuple[float, bytes]]:
+  with open(file_name, "rb") as f:
+    header: bytes = f.read(RUN_RECORD.size)
+    while len(header) > 0:
+      [identifier, length] = RUN_RECORD.unpack(header)
+      yield (identifier, f.read(length))
+      header = f.read(RUN_RECORD.size)
+
+
+def temp_file(prefix: str) -> str:
+  # Sorts can run at the same time on one host, so every spill file gets its own name
+  [fd, file_name] = tempfile.mkstemp(prefix=prefix)
+  os.close(fd)
+  return file_name
+
+
+def create_runs(it: Any, iterator_class: Any, identifier: Any, memory_budget: int, run_names: List[str]):
+  # Names are added before the runs are written, so the caller can remove them if this fails
+  items: List[Tuple[float, bytes]] = []
+  size: int = 0
+  more: bool = True
+  while more:
+    [chunk, values, _, more] = it.next_values(identifier)
+    for i in range(len(chunk)):
+      # Keep the serialized item so parsed items (such as XML trees) can be freed
+      content: bytes = iterator_class.to_bytes(chunk[i])
+      items.append((float(values[i]), content))
+      size += len(content) + RUN_RECORD.size
+      if size >= memory_budget:
+        run_names.append(temp_file("sort-run-"))
+        write_run(items, run_names[-1])
+        items = []
+        size = 0
+
+  if len(items) > 0 or len(run_names) == 0:
+    run_names.append(temp_file("sort-run-"))
+    write_run(items, run_names[-1])
+
+
+class BinWriter:
+  # Writes the records of a bin to a temp file in batches of merge_batch_size, like combine
+  # does, and uploads the file once the bin is closed. Formats that can't be written in
+  # batches keep the records of the bin until then.
+  def __init__(self, database: Database, bin_range: Dict[str, Any], num_bins: int, extra: Dict[str, Any], output_format, iterator_class, identifier, params):
+    output_format["bin"] = bin_range["bin"]
+    output_format["num_bins"] = num_bins
+    self.bin_key = util.file_name(output_format)
+    self.count = 0
+    self.database = database
+    self.extra = extra
+    self.first: List[Any] = []
+    self.identifier = identifier
+    self.items: List[Any] = []
+    self.iterator_class = iterator_class
+    self.last: List[Any] = []
+    self.metadata: Dict[str, str] = {}
+    self.params = params
+    self.temp_name = temp_file("sort-bin-")
+    self.f = open(self.temp_name, "wb+")
+
+  def __write__(self):
+    if self.count == 0:
+      self.first = self.items[:1]
+    if len(self.items) > 0:
+      self.last = self.items[-1:]
+    self.metadata = {**self.metadata, **self.iterator_class.__write_items__(self.items, self.f, self.extra, self.count)}
+    self.count += len(self.items)
+    self.items = []
+
+  def add(self, item: Any):
+    self.items.append(item)
+    if len(self.items) == self.iterator_class.merge_batch_size and self.iterator_class.supports_batches():
+      self.__write__()
+
+  def close(self):
+    try:
+      if len(self.items) > 0 or self.count == 0:
+        self.__write__()
+      self.f.close()
+      zone = self.iterator_class.create_zone(self.first + self.last, self.identifier, True)
+      zone.count = self.count
+      metadata = {**self.metadata, **zone.to_metadata()}
+      with open(self.temp_name, "rb") as f:
+        self.database.put(self.params["bucket"], self.bin_key, f, metadata, True)
+        if util.is_set(self.params, "record_index"):
+          write_index(self.database, self.params["bucket"], self.bin_key, self.iterator_class, f, self.identifier)
+    finally:
+      self.remove()
+
+  def remove(self):
+    self.f.close()
+    if os.path.exists(self.temp_name):
+      os.remove(self.temp_name)
+
+
+def write_bin(database: Database, items: List[Any], bin_range: Dict[str, Any], num_bins: int, extra: Dict[str, Any], output_format, iterator_class, identifier, params):
+  writer = BinWriter(database, bin_range, num_bins, extra, output_format, iterator_class, identifier, params)
+  try:
+    for item in items:
+      writer.add(item)
+    writer.close()
+  finally:
+    writer.remove()
+
+
+def external_sort(database: Database, it: Any, iterator_class: Any, identifier: Any, bin_ranges: List[Dict[str, Any]], extra: Dict[str, Any], output_format, params):
+  # Sort runs that fit in the memory budget, spill them to disk and then merge the runs.
+  # Merged records are streamed into the file of their bin, which is uploaded as soon as
+  # the merge moves past it.
+  run_names: List[str] = []
+  writers: Dict[int, BinWriter] = {}
+  try:
+    create_runs(it, iterator_class, identifier, params["memory_budget"], run_names)
+    merged = heapq.merge(*map(lambda run_name: read_run(run_name), run_names), key=lambda record: record[0])
+    binner = Binner(bin_ranges)
+
+    def writer(index: int) -> BinWriter:
+      if index not in writers:
+        writers[index] = BinWriter(database, bin_ranges[index], len(bin_ranges), extra, output_format, iterator_class, identifier, params)
+      return writers[index]
+
+    bin_index: int = 0
+    for [value, content] in merged:
+      index: int = binner.assign(value)
+      while bin_index < binner.bin_index:
+        writer(bin_index).close()
+        writers.pop(bin_index)
+        bin_index += 1
+      writer(index).add(iterator_class.from_bytes(content))
+
+    while bin_index < len(bin_ranges):
+      writer(bin_index).close()
+      writers.pop(bin_index)
+      bin_index += 1
+  finally:
+    for writer in writers.values():
+      writer.remove()
+    for run_name in run_names:
+      os.remove(run_name)
 
 
 def handle_sort(database: Database, table_name: str, key: str, input_format: Dict[str, Any], output_format: Dict[str, Any], offsets: List[int], params: Dict[str, Any]):
   entry = database.get_entry(table_name, key)
   assert("ext" in output_format)
-  format_lib = importlib.import_module("formats." + params["input_format"])
-  iterator_class = getattr(format_lib, "Iterator")
+  format_lib = registry.get(params["input_format"])
+  iterator_class = format_lib.iterator
+  if util.is_set(params, "record_index") and format_lib.offset_index:
+    # Reuse the offset table persisted with the object instead of parsing it again
+    load_index(database, table_name, key, iterator_class)
   if len(offsets) > 0:
-    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1]))
+    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1], util.is_set(params, "aligned")))
   else:
     it = iterator_class(entry, None)
   extra = it.get_extra()
-  items = it.get(it.get_start_index(), it.get_end_index())
-  items = list(map(lambda item: (it.get_identifier_value(item, format_lib.Identifiers[params["identifier"]]), item), items))
+  identifier = format_lib.identifier(params["identifier"])
+  it.set_read_options(params)
+  if "memory_budget" in params:
+    external_sort(database, it, iterator_class, identifier, params["pivots"], extra, dict(output_format), params)
+    return True
+
+  # Views keep the records in the chunk that was read, instead of a copy of each one
+  it.record_views = util.is_set(params, "record_views") and format_lib.views
+  [items, values] = it.get_values(it.get_start_index(), it.get_end_index(), identifier)
+  items = list(zip(values, items))
   sorted_items = sorted(items, key=lambda k: k[0])
   bin_ranges = params["pivots"]
   binned_input = bin_input(sorted_items, bin_ranges)
-  write_binned_input(database, binned_input, bin_ranges, extra, dict(output_format), iterator_class, params)
+  if it.record_views:
+    # Stream the bins from the views through files, so the sorted output is never in memory next to the chunk
+    output_format = dict(output_format)
+    for i in range(len(bin_ranges)):
+      write_bin(database, binned_input[i], bin_ranges[i], len(bin_ranges), extra, output_format, iterator_class, identifier, params)
+  else:
+    write_binned_input(database, binned_input, bin_ranges, extra, dict(output_format), iterator_class, identifier, params)
   return True
 
 
@@ -14,10 +14,11 @@
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
 import boto3
-from formats import pivot
+from formats import pivot, registry
 import threading
 import util
 from database.database import Database
+from formats.iterator import RecordIndex, load_index
 from typing import Any, Dict, List, Optional
 
 
@@ -45,16 +46,38 @@ def split_file(database: Database, bucket_name: str, key: str, input_format: Dic
   #num_files = 10
   num_files = int((content_length + split_size - 1) / split_size)
 
+  # With a record index, splits start on record boundaries so the iterators don't need to adjust
+  index: Optional[RecordIndex] = None
+  if util.is_set(params, "record_index") and content_length > 0:
+    # Formats with their own offset tables (mzML) store those instead of a RecordIndex
+    format_lib: Optional[registry.Format] = registry.find(output_format["ext"])
+    iterator_class: Optional[Any] = format_lib.iterator if format_lib is not None else None
+    index = load_index(database, input_bucket, input_key, iterator_class)
+  if index is not None:
+    starts: List[int] = [0]
+    for i in range(1, num_files):
+      start: int = index.align(i * split_size)
+      if starts[-1] < start and start < content_length:
+        starts.append(start)
+    starts.append(content_length)
+    num_files = len(starts) - 1
+
   threads = []
   token = "{0:f}-{1:d}".format(output_format["timestamp"], output_format["nonce"])
   while file_id <= num_files:
-    offsets = [(file_id - 1) * split_size, min(content_length, (file_id) * split_size) - 1]
+    if index is not None:
+      offsets = [starts[file_id - 1], starts[file_id] - 1]
+    else:
+      offsets = [(file_id - 1) * split_size, min(content_length, (file_id) * split_size) - 1]
     extra_params = {**output_format, **{
       "file_id": file_id,
       "num_files": num_files,
       "offsets": offsets,
     }}
 
+    if index is not None:
+      extra_params["aligned"] = True
+
     if util.is_set(params, "ranges"):
       extra_params["pivots"] = ranges
 
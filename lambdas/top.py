@@ -14,10 +14,11 @@
 # along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
 
 import heapq
-import importlib
 import util
 from database.database import Database
-from typing import Any, Dict, List
+from formats import registry
+from formats.iterator import OffsetBounds, RecordIndex, Zone, identifier_name, load_index, write_index
+from typing import Any, Dict, List, Optional
 
 
 class Element:
@@ -29,34 +30,58 @@ class Element:
     return [self.identifier, self.value] < [other.identifier, other.value]
 
 
+def add_items(top: List[Element], it: Any, params: Dict[str, Any]):
+  it.set_read_options(params)
+  more = True
+  while more:
+    [items, values, _, more] = it.next_values(params["identifier"])
+
+    for [item, score] in zip(items, values):
+      heapq.heappush(top, Element(score, item))
+      if len(top) > params["number"]:
+        heapq.heappop(top)
+
+
 def find_top(d: Database, table: str, key: str, input_format: Dict[str, Any], output_format: Dict[str, Any], offsets: List[int], params: Dict[str, Any]):
   entry = d.get_entry(table, key)
-  format_lib = importlib.import_module("formats." + params["input_format"])
-  iterator_class = getattr(format_lib, "Iterator")
+  format_lib = registry.get(params["input_format"])
+  iterator_class = format_lib.iterator
+  if util.is_set(params, "record_index") and format_lib.offset_index:
+    # Reuse the offset table persisted with the object instead of parsing it again
+    load_index(d, table, key, iterator_class)
   if len(offsets) > 0:
-    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1]))
+    it = iterator_class(entry, OffsetBounds(offsets[0], offsets[1], util.is_set(params, "aligned")))
   else:
     it = iterator_class(entry, None)
 
-  top = []
-  more = True
-  while more:
-    [items, _, more] = it.next()
+  index: Optional[RecordIndex] = None
+  if util.is_set(params, "record_index") and len(offsets) == 0 and not format_lib.offset_index:
+    index = load_index(d, table, key)
 
-    for item in items:
-      score: float = it.get_identifier_value(item, params["identifier"])
-      heapq.heappush(top, Element(score, item))
-      if len(top) > params["number"]:
-        heapq.heappop(top)
+  top: List[Element] = []
+  if index is not None and index.identifier == identifier_name(params["identifier"]):
+    # Visit the blocks with the largest values first and stop once no block can make the top
+    blocks: List[OffsetBounds] = index.blocks()
+    for i in sorted(range(len(blocks)), key=lambda i: -index.maximums[i]):
+      if len(top) == params["number"] and index.maximums[i] < top[0].identifier:
+        break
+      add_items(top, iterator_class(entry, blocks[i]), params)
+  else:
+    add_items(top, it, params)
 
   file_name = util.file_name(output_format)
   temp_name = "/tmp/{0:s}".format(file_name)
   items = list(map(lambda t: t.value, top))
   with open(temp_name, "wb+") as f:
     [content, metadata] = iterator_class.from_array(items, f, it.get_extra())
+  scores: List[float] = list(map(lambda t: t.identifier, top))
+  if len(scores) > 0:
+    metadata = {**metadata, **Zone(identifier_name(params["identifier"]), min(scores), max(scores), len(scores)).to_metadata()}
 
   with open(temp_name, "rb") as f:
     d.put(table, file_name, f, metadata)
+    if util.is_set(params, "record_index"):
+      write_index(d, table, file_name, iterator_class, f, params["identifier"])
 
 
 def main(*argv):
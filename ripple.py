@@ -17,7 +17,7 @@ import importlib
 import inspect
 import json
 import os
-import re
+from formats import registry
 from setup.lambda_setup import LambdaSetup
 from setup.openwhisk_setup import OpenWhiskSetup
 import sys
@@ -26,7 +26,6 @@ currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentfram
 from typing import Any, Dict, Optional
 
 
-IMPORT_REGEXES = [re.compile(r"import ([a-zA-Z\_\.]+)"), re.compile(r"from ([a-zA-Z\_\.]+) import (.*)")]
 SUPPORTED_LIBRARIES = set(["PIL", "numpy", "sklearn"])
 
 
@@ -99,6 +98,7 @@ class Pipeline:
     self.pipeline = []
     self.table = table
     self.timeout = timeout
+    self.format_imports = {}
     self.formats = self.__get_formats__()
 
   def input(self, format):
@@ -125,6 +125,9 @@ class Pipeline:
 
     for format in list(formats):
       formats = formats.union(self.formats[format])
+    # Formats that use libraries such as numpy need their layers too
+    for format in formats:
+      imports = imports.union(self.format_imports[format])
     self.functions[name]["formats"] = list(formats)
     self.functions[name]["imports"] = list(imports)
 
@@ -133,41 +136,17 @@ class Pipeline:
     self.pipeline.append(dict(pipeline_params))
 
   def __get_formats__(self):
-    folder = "{0:s}/formats/".format(currentdir)
+    # The registry scans the format sources once per process
+    sources = registry.sources()
+    files = set(sources.keys())
     formats = {}
-    files =  set()
-    for file in os.listdir(folder):
-      if file.endswith(".py"):
-        format = file.split(".")[0]
-        files.add(format)
-    files.remove("iterator")
-
     for file in files:
-      path = folder + file + ".py"
-      imports  = self.__get_imports__(path, folder)
-      formats[file] = imports.intersection(files)
-
+      formats[file] = sources[file].intersection(files)
+      self.format_imports[file] = sources[file].intersection(SUPPORTED_LIBRARIES)
     return formats
 
   def __get_imports__(self, path, folder):
-    imports = set()
-    with open(path, "r") as f:
-      lines = f.readlines()
-      for line in lines:
-        for regex in IMPORT_REGEXES:
-          m = regex.match(line)
-          if m:
-            # TODO: Figure out if there's a better way to handle imports
-            # Currently have to special case things like from formats import new_line
-            format = m.group(1).split(".")[0]
-            if format == "formats":
-              format = m.group(2)
-            imports.add(format)
-            dep = folder + format + ".py"
-            if os.path.isfile(dep):
-              imports = imports.union(self.__get_imports__(dep, folder))
-            break
-    return imports
+    return registry.scan_imports(path, folder)
 
   def combine(self, output_format, params={}, config={}):
     name = "combine-{0:s}-files".format(output_format)
@@ -14,6 +14,7 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 import database
 import upload
+from database import connections
 import util
 
 
@@ -74,7 +75,7 @@ class Queue(threading.Thread):
 
   def __setup_connections__(self):
     self.s3 = boto3.resource("s3")
-    self.client = boto3.client("s3")
+    self.client = connections.client("s3")
 
   def __fetch_objects__(self, file_name):
     while True:
@@ -219,7 +220,7 @@ class Invoker(threading.Thread):
 
   def __setup_connections__(self):
     self.s3 = boto3.resource("s3")
-    self.client = boto3.client("lambda", region_name=self.region)
+    self.client = connections.client("lambda", region=self.region)
 
   def run(self):
     while self.__running__():
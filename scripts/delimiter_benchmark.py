@@ -0,0 +1,93 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the MB/s of splitting a chunk into records with the regex based
+# to_array versus the delimiter scanner.
+
+import argparse
+import inspect
+import os
+import random
+import re
+import sys
+import time
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from formats import blast, fasta, fastq, new_line
+from formats.iterator import DelimiterPosition
+
+
+def regex_to_array(cls, content):
+  # The to_array implementation before the scanner
+  if cls.delimiter.regex is not None:
+    return list(map(lambda item: item[0], re.findall(b"(@([^\n]*\n){3}[^\n]*)", content)))
+  items = filter(lambda item: len(item.strip()) > 0, re.split(cls.delimiter.item_regex, content))
+  if cls.delimiter.position == DelimiterPosition.start:
+    items = map(lambda item: cls.delimiter.item_token + item, items)
+  elif cls.delimiter.position == DelimiterPosition.end:
+    items = map(lambda item: item + cls.delimiter.item_token, items)
+  return list(items)
+
+
+def sequence(generator, length):
+  return "".join(map(lambda i: generator.choice("ACGT"), range(length)))
+
+
+def generate(name, size):
+  generator = random.Random(0)
+  records = []
+  length = 0
+  while length < size:
+    i = len(records)
+    if name == "new_line":
+      record = "{0:d}\t{1:s}\t{2:f}\n".format(i, sequence(generator, 20), generator.random())
+    elif name == "fasta":
+      record = ">sequence{0:d} description\n{1:s}\n".format(i, "\n".join(map(lambda j: sequence(generator, 60), range(4))))
+    elif name == "fastq":
+      record = "@read{0:d}\n{1:s}\n+\n{2:s}\n".format(i, sequence(generator, 100), "I" * 100)
+    else:
+      record = "target_name: {0:d}\nquery_name: {1:d}\noptimal_alignment_score: {2:d} suboptimal_alignment_score: {3:d}\n\n".format(i, generator.randint(0, 100), generator.randint(0, 1000), generator.randint(0, 100))
+    records.append(record)
+    length += len(record)
+  return str.encode("".join(records))
+
+
+def measure(f, content, repeat):
+  start = time.time()
+  for i in range(repeat):
+    items = f(content)
+  duration = (time.time() - start) / repeat
+  return [len(items), len(content) / duration / (1000 * 1000)]
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--size", type=int, default=10*1000*1000, help="Number of bytes per input")
+  parser.add_argument("--repeat", type=int, default=5, help="Number of runs to average")
+  args = parser.parse_args()
+
+  print("format\trecords\tregex MB/s\tscanner MB/s\tspans MB/s")
+  for [name, cls] in [["new_line", new_line.Iterator], ["fasta", fasta.Iterator], ["fastq", fastq.Iterator], ["blast", blast.Iterator]]:
+    content = generate(name, args.size)
+    [count, before] = measure(lambda c: regex_to_array(cls, c), content, args.repeat)
+    [scanned, after] = measure(lambda c: list(cls.to_array(c)), content, args.repeat)
+    [_, spans] = measure(lambda c: cls.delimiter.spans(c)[0], content, args.repeat)
+    assert(count == scanned)
+    print("{0:s}\t{1:d}\t{2:.0f}\t{3:.0f}\t{4:.0f}".format(name, count, before, after, spans))
+
+
+if __name__ == "__main__":
+  main()
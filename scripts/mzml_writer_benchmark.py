@@ -0,0 +1,158 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+# Measures the time and peak memory of combining mzML files with the streaming
+# writer versus building the output as one string, and checks both produce the
+# same bytes.
+
+import argparse
+import base64
+import hashlib
+import inspect
+import multiprocessing
+import os
+import random
+import re
+import resource
+import shutil
+import sys
+import time
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from database.local import LocalDatabase
+from formats import mzML
+
+
+def add(content, f):
+  f.write(str.encode(content))
+  return content
+
+
+def concat_combine(entries, f):
+  # The combine implementation before the streaming writer
+  cls = mzML.Iterator
+  iterators = list(map(lambda entry: mzML.Iterator(entry), entries))
+  count = sum(map(lambda iterator: iterator.get_item_count(), iterators))
+  content = add(re.sub(cls.spectrum_list_count_regex, '<spectrumList count="{0:d}"'.format(count), iterators[0].header), f)
+  offset = len(content)
+  offsets = []
+  index = 0
+  for iterator in iterators:
+    more = True
+    while more:
+      [spectra, _, more] = iterator.next()
+      spectra_content = ""
+      for item in spectra:
+        offsets.append((cls.__spectrum_id__(item), offset))
+        tag_end = item.find(b">")
+        spectrum = (cls.index_attribute_regex.sub(str.encode('\\1index="{0:d}"'.format(index)), item[:tag_end], 1) + item[tag_end:] + b"\n").decode("utf-8")
+        offset += len(spectrum)
+        spectra_content += spectrum
+        index += 1
+      content += add(spectra_content, f)
+
+  content += add("</spectrumList>", f)
+  content += add("</run></mzML>\n", f)
+  list_offset = len(content)
+  content += add('<indexList count="1">\n', f)
+  content += add('<index name="spectrum">\n', f)
+  for o in offsets:
+    content += add('<offset idRef="controllerType=0 controllerNumber=1 scan={0:s}">{1:d}</offset>\n'.format(o[0], o[1]), f)
+  content += add("</index>\n", f)
+  content += add("</indexList>\n", f)
+  content += add("<indexListOffset>{0:d}</indexListOffset>\n".format(list_offset), f)
+  content += add("<fileChecksum>", f)
+  content += add(str(hashlib.sha1(content.encode("utf-8")).hexdigest()), f)
+  content += add("</fileChecksum>\n</indexedmzML>", f)
+
+
+def stream_combine(entries, f):
+  mzML.Iterator.combine(entries, f, {})
+
+
+def generate(size, generator):
+  header = '<?xml version="1.0" encoding="utf-8"?>\n<indexedmzML>\n  <mzML>\n    <run id="run_id">\n      <spectrumList count="{0:d}">\n'
+  spectra = []
+  length = len(header)
+  while length < size:
+    i = len(spectra)
+    peaks = base64.b64encode(generator.randbytes(1500)).decode("utf-8")
+    spectrum = '        <spectrum id="controllerType=0 controllerNumber=1 scan={0:d}" index="{0:d}">\n          <cvParam name="ms level" value="2"/>\n          <cvParam name="base peak m/z" value="{1:f}"/>\n          <binary>{2:s}</binary>\n        </spectrum>\n'.format(i, generator.random() * 1000, peaks)
+    spectra.append(spectrum)
+    length += len(spectrum)
+
+  header = header.format(len(spectra))
+  offsets = []
+  length = len(header)
+  for spectrum in spectra:
+    offsets.append(length)
+    length += len(spectrum)
+  footer = "      </spectrumList>\n    </run>\n  </mzML>\n"
+  index_list_offset = length + len(footer)
+  index = '  <indexList count="1">\n    <index name="spectrum">\n'
+  index += "".join(map(lambda i: '      <offset idRef="controllerType=0 controllerNumber=1 scan={0:d}">{1:d}</offset>\n'.format(i, offsets[i]), range(len(spectra))))
+  index += "    </index>\n  </indexList>\n  <indexListOffset>{0:d}</indexListOffset>\n</indexedmzML>\n".format(index_list_offset)
+  return str.encode(header + "".join(spectra) + footer + index)
+
+
+def measure(combine, root, output, queue):
+  database = LocalDatabase({}, root)
+  entries = database.get_entries("input")
+  start = time.time()
+  with open(output, "wb+") as f:
+    combine(entries, f)
+  duration = time.time() - start
+  memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  checksum = hashlib.sha1()
+  with open(output, "rb") as f:
+    for block in iter(lambda: f.read(1000*1000), b""):
+      checksum.update(block)
+  queue.put([duration, memory, checksum.hexdigest()])
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--size", type=int, default=1000*1000*1000, help="Number of bytes to combine")
+  parser.add_argument("--files", type=int, default=10, help="Number of files to combine")
+  parser.add_argument("--root", type=str, default="/tmp/mzml_benchmark", help="Folder for the input and output")
+  args = parser.parse_args()
+
+  if os.path.isdir(args.root):
+    shutil.rmtree(args.root)
+  database = LocalDatabase({}, args.root)
+  database.create_table("input")
+  generator = random.Random(0)
+  for i in range(args.files):
+    database.write("input", "0/123.4-13/1/{0:d}-1-{1:d}-test.mzML".format(i + 1, args.files), generate(args.size // args.files, generator), {}, False)
+
+  print("writer\tseconds\tMB/s\tmax RSS MB")
+  checksums = []
+  for [name, combine] in [["stream", stream_combine], ["concat", concat_combine]]:
+    # Each writer runs in a fresh process so the peak memory isn't shared
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=measure, args=(combine, args.root, os.path.join(args.root, name + ".mzML"), queue))
+    process.start()
+    [duration, memory, checksum] = queue.get()
+    process.join()
+    checksums.append(checksum)
+    print("{0:s}\t{1:.1f}\t{2:.0f}\t{3:.0f}".format(name, duration, args.size / duration / (1000 * 1000), memory))
+  assert(checksums[0] == checksums[1])
+  shutil.rmtree(args.root)
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,109 @@
+# This file is part of Ripple.
+
+# Ripple is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# Ripple is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with Ripple.  If not, see <https://www.gnu.org/licenses/>.
+
+# Compares the max / mean bin size of the sort pipeline's bins on skewed identifiers,
+# using equal increments over unique pivots versus the weighted histogram.
+
+import argparse
+import inspect
+import os
+import random
+import sys
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+from formats import pivot
+from lambdas import sort
+
+
+def generate(num_files, num_items, skew, num_hot):
+  # Zipf-like identifiers, where a few hot values (repeated base peak m/z values) dominate
+  generator = random.Random(0)
+  hot = list(map(lambda i: round(generator.uniform(100, 2000), 2), range(num_hot)))
+  files = []
+  for i in range(num_files):
+    values = []
+    for j in range(num_items):
+      if generator.random() < skew:
+        values.append(hot[min(int(generator.paretovariate(1.0)) - 1, num_hot - 1)])
+      else:
+        values.append(round(generator.uniform(100, 2000), 2))
+    files.append(sorted(values))
+  return files
+
+
+def unique_pivots(values, num_bins):
+  pivots = sorted(set(values))
+  max_identifier = float(pivots[-1] + 1)
+  increment = max(int(len(values) / num_bins), 1)
+  pivots = pivots[0::increment]
+  if pivots[-1] == max_identifier - 1:
+    pivots[-1] = max_identifier
+  else:
+    pivots.append(max_identifier)
+  return pivots
+
+
+def unique_combine(files, num_bins):
+  pivots = sorted(set().union(*map(lambda values: unique_pivots(values, num_bins), files)))
+  increment = float(len(pivots)) / num_bins
+  super_pivots = []
+  i = 0
+  while i < len(pivots):
+    super_pivots.append(pivots[min(round(i), len(pivots) - 1)])
+    i += increment
+  if super_pivots[-1] != pivots[-1]:
+    super_pivots.append(pivots[-1])
+  return list(map(lambda p: int(p), super_pivots))
+
+
+def histogram_combine(files, num_bins):
+  buckets = []
+  for values in files:
+    [pivots, counts] = pivot.create_buckets(values, num_bins)
+    buckets += pivot.get_buckets(pivots, counts)
+  [pivots, counts] = pivot.balance(pivot.create_histogram(buckets), num_bins)
+  return pivots
+
+
+def get_ratio(files, pivots):
+  bin_ranges = list(map(lambda i: {"range": [pivots[i], pivots[i + 1]], "bin": i + 1}, range(len(pivots) - 1)))
+  sizes = [0] * len(bin_ranges)
+  for values in files:
+    binned_input = sort.bin_input(list(map(lambda value: (value, None), values)), bin_ranges)
+    for i in range(len(binned_input)):
+      sizes[i] += len(binned_input[i])
+  mean = float(sum(sizes)) / len(sizes)
+  return [len(sizes), max(sizes) / mean]
+
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument("--num_files", type=int, default=20, help="Number of split files")
+  parser.add_argument("--num_items", type=int, default=5000, help="Number of identifiers per file")
+  parser.add_argument("--num_bins", type=int, default=20, help="Number of sort bins")
+  parser.add_argument("--num_hot", type=int, default=5, help="Number of heavy hitter identifiers")
+  args = parser.parse_args()
+
+  print("skew\tmethod\tbins\tmax/mean")
+  for skew in [0.0, 0.2, 0.5, 0.8]:
+    files = generate(args.num_files, args.num_items, skew, args.num_hot)
+    for [name, combine] in [["unique", unique_combine], ["histogram", histogram_combine]]:
+      [num_bins, ratio] = get_ratio(files, combine(files, args.num_bins))
+      print("{0:.1f}\t{1:s}\t{2:d}\t{3:.2f}".format(skew, name, num_bins, ratio))
+
+
+if __name__ == "__main__":
+  main()
@@ -36,11 +36,7 @@ class Setup:
     for i in range(len(self.params["pipeline"])):
       pparams = self.params["pipeline"][i]
       if pparams["name"] == function_name:
-        p = {**self.params["functions"][function_name], **pparams}
-        for value in ["timeout", "num_bins", "bucket", "storage_class", "log", "scheduler"]:
-          if value in self.params:
-            p[value] = self.params[value]
-
+        p = util.stage_parameters(self.params, i)
         name = "{0:d}.json".format(i)
         json_path = "{0:s}/{1:s}".format(zip_directory, name)
         f = open(json_path, "w")
@@ -131,7 +127,7 @@ class Setup:
   def __zip_formats__(self, zip_directory, fparams):
     dest = zip_directory + "/formats"
     self.__make_directory__(zip_directory, "formats")
-    for file in ["../formats/iterator.py", "../formats/pivot.py"]:
+    for file in ["../formats/iterator.py", "../formats/pivot.py", "../formats/registry.py"]:
       self.__copy_file__(dest, file)
 
     if "formats" in fparams:
@@ -0,0 +1,200 @@
+import os
+import shutil
+import threading
+import unittest
+from database import connections, tracker
+from database.database import BlockCache, Statistics
+from database.local import LocalDatabase
+from formats import new_line
+from tutils import TestDatabase, TestEntry, TestTable
+
+
+class BlockCacheMethods(unittest.TestCase):
+  def test_get_range(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    content = "".join(list(map(lambda i: chr(ord("a") + (i % 26)), range(100))))
+    entry1: TestEntry = table1.add_entry("test.new_line", content)
+    entry1.cache = BlockCache(10, 30, read_ahead=0)
+
+    self.assertEqual(entry1.get_range(5, 24), str.encode(content[5:25]))
+    self.assertEqual(database.statistics.read_count, 1)
+
+    # Overlapping range is served from memory
+    self.assertEqual(entry1.get_range(12, 18), str.encode(content[12:19]))
+    self.assertEqual(database.statistics.read_count, 1)
+    self.assertEqual(database.statistics.cache_hit_count, 1)
+
+    # End index past the end of the content
+    self.assertEqual(entry1.get_range(95, 200), str.encode(content[95:]))
+    self.assertEqual(database.statistics.read_count, 2)
+
+    # Least recently used blocks are evicted
+    self.assertEqual(list(entry1.cache.blocks.keys()), [2, 1, 9])
+    self.assertTrue(entry1.cache.byte_count <= 30)
+
+  def test_read_ahead(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    content = "".join(list(map(lambda i: chr(ord("a") + (i % 26)), range(100))))
+    entry1: TestEntry = table1.add_entry("test.new_line", content)
+    entry1.cache = BlockCache(10, 100, read_ahead=2)
+
+    self.assertEqual(entry1.get_range(0, 9), str.encode(content[0:10]))
+    self.assertEqual(sorted(entry1.cache.blocks.keys()), [0, 1, 2])
+    self.assertEqual(entry1.get_range(10, 29), str.encode(content[10:30]))
+    self.assertEqual(database.statistics.read_count, 1)
+    self.assertEqual(entry1.get_range(30, 39), str.encode(content[30:40]))
+    self.assertEqual(database.statistics.read_count, 2)
+    self.assertEqual(sorted(entry1.cache.blocks.keys()), [0, 1, 2, 3, 4, 5])
+
+    # Random access doesn't read ahead
+    self.assertEqual(entry1.get_range(85, 89), str.encode(content[85:90]))
+    self.assertEqual(database.statistics.read_count, 3)
+    self.assertTrue(9 not in entry1.cache.blocks)
+
+
+class LocalDatabaseMethods(unittest.TestCase):
+  def setUp(self):
+    self.root = "/tmp/ripple_local"
+    if os.path.isdir(self.root):
+      shutil.rmtree(self.root)
+
+  def tearDown(self):
+    shutil.rmtree(self.root)
+
+  def test_write(self):
+    database = LocalDatabase({}, self.root)
+    database.create_table("table1")
+    database.write("table1", "0/b.new_line", b"D E F\n", {"count": "1"}, False)
+    database.write("table1", "0/a.new_line", b"A B C\na b c\n", {}, False)
+    database.write("table1", "1/c.new_line", b"", {}, False)
+    with open("/tmp/ripple_local_test", "wb+") as f:
+      f.write(b"G H I\n")
+    with open("/tmp/ripple_local_test", "rb") as f:
+      database.put("table1", "1/d.new_line", f, {}, False)
+    os.remove("/tmp/ripple_local_test")
+
+    entries = database.get_entries("table1")
+    self.assertEqual(list(map(lambda entry: entry.key, entries)), ["0/a.new_line", "0/b.new_line", "1/c.new_line", "1/d.new_line"])
+    entries = database.get_entries("table1", "0/")
+    self.assertEqual(list(map(lambda entry: entry.key, entries)), ["0/a.new_line", "0/b.new_line"])
+    self.assertEqual(database.get_folders("table1"), ["0", "1"])
+
+    entry = database.get_entry("table1", "0/b.new_line")
+    self.assertEqual(entry.get_metadata(), {"count": "1"})
+    self.assertEqual(entry.get_content(), b"D E F\n")
+    self.assertEqual(database.get_entry("table1", "1/c.new_line").get_content(), b"")
+    self.assertEqual(database.read("table1", "1/d.new_line"), b"G H I\n")
+    self.assertEqual(entries[0].get_range(6, 10), b"a b c")
+    self.assertEqual(bytes(entries[0].get_view(0, 4)), b"A B C")
+    self.assertIsNone(database.get_entry("table1", "0/c.new_line"))
+
+    # Listings see objects written by other processes
+    other = LocalDatabase({}, self.root)
+    self.assertEqual(len(other.get_entries("table1")), 4)
+    other.write("table1", "2/e.new_line", b"J K L\n", {}, False)
+    self.assertEqual(len(database.get_entries("table1")), 5)
+    self.assertEqual(database.get_folders("table1"), ["0", "1", "2"])
+
+  def test_iterator(self):
+    database = LocalDatabase({"block_size": 4}, self.root)
+    database.create_table("table1")
+    database.write("table1", "0/a.new_line", b"A B C\na b c\n1 2 3\n", {}, False)
+    entry = database.get_entry("table1", "0/a.new_line")
+    it = new_line.Iterator(entry, None)
+    [items, offset_bounds, more] = it.next()
+    self.assertEqual(list(items), [b"A B C", b"a b c", b"1 2 3"])
+    self.assertFalse(more)
+
+  def test_invoke(self):
+    database = LocalDatabase({"output_function": "sort"}, self.root)
+    database.create_table("table1")
+    database.write("table1", "0/a.new_line", b"A B C\n", {}, True)
+    self.assertEqual(len(database.payloads), 1)
+    self.assertEqual(database.payloads[0]["Records"][0]["s3"]["object"]["key"], "0/a.new_line")
+
+  def test_dispatch(self):
+    configuration = {
+      "bucket": "table1",
+      "functions": {
+        "combine": {"file": "combine_files", "output_format": "new_line"},
+        "split": {"file": "split_file"},
+      },
+      "log": "log",
+      "pipeline": [
+        {"name": "split", "output_function": "combine", "ranges": False, "split_size": 12},
+        {"name": "combine", "sort": False},
+      ],
+      "timeout": 60,
+    }
+
+    # Writing the input runs the split, and each split runs the combine
+    database = LocalDatabase({"local_pipeline": configuration, "output_function": "split"}, self.root)
+    database.create_table("table1")
+    database.create_table("log")
+    content = b"A B C\nD E F\nG H I\nJ K L\n"
+    database.write("table1", "0/123.400000-13/1-1/1-0.000000-1-suffix.new_line", content, {}, True)
+    entries = database.get_entries("table1", "2/")
+    self.assertEqual(len(entries), 1)
+    self.assertEqual(entries[0].get_content(), content)
+    self.assertEqual(len(database.get_entries("log", "0/")), 1)
+    self.assertEqual(len(database.get_entries("log", "1/")), 2)
+
+
+class ConnectionMethods(unittest.TestCase):
+  def test_client(self):
+    connections.clear()
+    statistics = Statistics()
+    client1 = connections.client("s3", region="us-west-2", stats=statistics)
+    client2 = connections.client("s3", region="us-west-2", stats=statistics)
+    client3 = connections.client("s3", region="us-west-2", stats=statistics, read_timeout=80)
+    self.assertIs(client1, client2)
+    self.assertIsNot(client1, client3)
+    self.assertEqual(client1.meta.config.max_pool_connections, connections.MAX_POOL_CONNECTIONS)
+    self.assertEqual(statistics.connection_create_count, 2)
+    self.assertEqual(statistics.connection_reuse_count, 1)
+    self.assertAlmostEqual(connections.statistics.reuse_rate(), 1.0 / 3)
+    connections.clear()
+
+
+class TrackerMethods(unittest.TestCase):
+  def register(self, completion_tracker: tracker.Tracker):
+    group = "1/123.400000-13/1-2"
+    keys = list(map(lambda i: "{0:s}/{1:d}-0.000000-3-suffix.new_line".format(group, i), range(1, 4)))
+    self.assertEqual(completion_tracker.register(group, keys[1], 3), (False, [keys[1]]))
+    self.assertEqual(completion_tracker.register(group, keys[1], 3), (False, [keys[1]]))
+    self.assertEqual(completion_tracker.register(group, keys[0], 3), (False, keys[:2]))
+    self.assertEqual(completion_tracker.register(group, keys[2], 3), (True, keys))
+    # Re-executions only complete the group for the winning file
+    self.assertEqual(completion_tracker.register(group, keys[0], 3), (False, keys))
+    self.assertEqual(completion_tracker.register(group, keys[2], 3), (True, keys))
+    # Other groups are independent
+    self.assertEqual(completion_tracker.register("1/123.400000-13/2-2", keys[0].replace("1-2", "2-2"), 3)[0], False)
+
+  def test_database(self):
+    database: TestDatabase = TestDatabase()
+    database.create_table("manifest")
+    self.register(tracker.create({"tracker": "database", "tracker_table": "manifest", "database": database}))
+
+  def test_sqlite(self):
+    path = "/tmp/ripple_tracker.db"
+    if os.path.isfile(path):
+      os.remove(path)
+    self.register(tracker.create({"tracker": "sqlite", "tracker_path": path}))
+
+    # Exactly one of many concurrent registrations completes the group
+    results = []
+    def register(i):
+      results.append(tracker.SQLiteTracker(path).register("group", str(i), 20)[0])
+    threads = list(map(lambda i: threading.Thread(target=register, args=(i,)), range(20)))
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual(results.count(True), 1)
+    os.remove(path)
+
+
+if __name__ == "__main__":
+  unittest.main()
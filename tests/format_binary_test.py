@@ -0,0 +1,112 @@
+import numpy as np
+import os
+import unittest
+from formats import binary
+from formats.iterator import OffsetBounds
+from tutils import TestEntry, write_file_index
+from typing import Optional
+
+
+class TestIterator(binary.Iterator):
+  def __init__(self, entry: TestEntry, offset_bounds: Optional[OffsetBounds], read_chunk_size: int):
+    self.read_chunk_size = read_chunk_size
+    binary.Iterator.__init__(self, entry, offset_bounds)
+
+
+def create_records(count: int) -> np.ndarray:
+  records = np.zeros(count, dtype=[("x", np.int64), ("features", np.float64, (3,))])
+  records["x"] = np.arange(count)
+  records["features"] = np.arange(3 * count).reshape(count, 3)
+  return records
+
+
+class IteratorMethods(unittest.TestCase):
+  def test_array(self):
+    records = create_records(10)
+    [content, _] = binary.Iterator.from_array(records, None, {})
+    self.assertEqual(len(content), 64 + 10 * 32)
+    self.assertTrue(np.array_equal(binary.Iterator.to_array(content), records))
+
+    [content, _] = binary.Iterator.from_array([], None, {"dtype": records.dtype})
+    self.assertEqual(len(binary.to_records(content)), 0)
+
+    with self.assertRaises(Exception):
+      binary.to_records(b"A\tB\tC\n" * 20)
+
+    # Single records can't be spilled, since reading them back needs the type
+    with self.assertRaises(Exception):
+      binary.Iterator.to_bytes(records[0])
+
+  def test_next(self):
+    records = create_records(10)
+    [content, _] = binary.Iterator.from_array(records, None, {})
+    entry = TestEntry("test.binary", content)
+
+    # Chunks are rounded down to whole records
+    it = TestIterator(entry, None, 100)
+    [items, offset_bounds, more] = it.next()
+    self.assertEqual(list(items["x"]), [0, 1, 2])
+    self.assertEqual(offset_bounds, OffsetBounds(64, 159))
+    self.assertTrue(more)
+    self.assertEqual(it.get_item_count(), 10)
+
+    # Each record belongs to the split it ends in
+    xs = []
+    for [start, end] in [[0, 100], [101, 170], [171, 300], [301, len(content) - 1]]:
+      it = TestIterator(entry, OffsetBounds(start, end), 50)
+      xs.append(list(map(lambda item: item["x"], it.iterate())))
+    self.assertEqual(xs, [[0], [1, 2], [3, 4, 5, 6], [7, 8, 9]])
+
+  def test_index(self):
+    records = create_records(10)
+    [content, _] = binary.Iterator.from_array(records, None, {})
+    binary.Iterator.index_block_size = 100
+    index = binary.Iterator.create_index(content)
+    binary.Iterator.index_block_size = 64*1000
+    self.assertEqual(list(index.offsets), [64, 160, 256, 352])
+    self.assertEqual(list(index.counts), [3, 3, 3, 1])
+    binary.Iterator.index_block_size = 100
+    self.assertEqual(write_file_index(binary.Iterator, content), index.to_bytes())
+    binary.Iterator.index_block_size = 64*1000
+
+    # Blocks of a single one byte record
+    records = np.arange(5, dtype=np.int8)
+    [content, _] = binary.Iterator.from_array(records, None, {})
+    binary.Iterator.index_block_size = 1
+    index = binary.Iterator.create_index(content)
+    binary.Iterator.index_block_size = 64*1000
+    entry = TestEntry("test.binary", content)
+    blocks = index.blocks()
+    self.assertEqual(blocks[0], OffsetBounds(64, 64))
+    self.assertEqual(list(map(lambda block: list(TestIterator(entry, block, 50).iterate()), blocks)), [[0], [1], [2], [3], [4]])
+
+  def test_combine(self):
+    records = create_records(10)
+    entries = [TestEntry("test1.binary", binary.Iterator.from_array(records[:4], None, {})[0]), TestEntry("test2.binary", binary.Iterator.from_array(records[4:], None, {})[0])]
+    temp_name = "/tmp/ripple_test"
+    with open(temp_name, "wb+") as f:
+      binary.Iterator.combine(entries, f, {})
+    self.assertTrue(np.array_equal(binary.memory_map(temp_name), records))
+    os.remove(temp_name)
+
+  def test_convert(self):
+    zeros = np.zeros(27, dtype=np.int64)
+    ones = np.ones(27, dtype=np.int64)
+    content = binary.convert(zeros.tobytes() + b" 1\r\n" + ones.tobytes() + b" 0", "classification")
+    records = binary.to_records(content)
+    self.assertEqual(list(records["classification"]), [1, 0])
+    self.assertTrue(np.array_equal(records["features"][1], ones))
+
+    content = binary.convert(b"1 2 " + ones.tobytes() + b"\n\n3 4 " + zeros.tobytes(), "pixel")
+    records = binary.to_records(content)
+    self.assertEqual(list(records["x"]), [1, 3])
+    self.assertTrue(np.array_equal(records["window"][0], ones))
+
+    content = binary.convert(b"1 2,0.100000 0,0.300000 1\n4 4,0.600000 2,0.660000 1", "knn")
+    records = binary.to_records(content)
+    self.assertEqual(records["point"].tolist(), [[1.0, 2.0], [4.0, 4.0]])
+    self.assertEqual(records["classifications"].tolist(), [[0, 1], [2, 1]])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,7 +1,7 @@
 import unittest
 from formats import fasta
-from formats.iterator import OffsetBounds
-from tutils import TestDatabase, TestEntry
+from formats.iterator import OffsetBounds, RecordIndex
+from tutils import TestDatabase, TestEntry, write_file_index
 from typing import Any, Optional
 
 
@@ -59,6 +59,106 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(offset_bounds, OffsetBounds(14, 20))
     self.assertFalse(more)
 
+  def test_empty_split(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test.fasta", ">A\tB\tC\nACGTACGTACGT\n>1\t2\t3\n")
+
+    # No record ends in the split, so it's empty instead of starting before the entry
+    for [start, end] in [[0, 9], [10, 15]]:
+      it = TestIterator(entry1, OffsetBounds(start, end), 4, 30)
+      self.assertEqual(it.get_start_index(), 0)
+      self.assertEqual(it.get_end_index(), -1)
+      [items, offset_bounds, more] = it.next()
+      self.assertEqual(list(items), [])
+      self.assertIsNone(offset_bounds)
+      self.assertFalse(more)
+
+    # The split after them reads the record instead
+    it = TestIterator(entry1, OffsetBounds(16, 27), 4, 30)
+    self.assertEqual(list(it.iterate()), [b">A\tB\tC\nACGTACGTACGT\n", b">1\t2\t3\n"])
+
+    # No delimiter before the split at all
+    entry2: TestEntry = table1.add_entry("test2.fasta", "ACGTACGT\n>1\t2\t3\n")
+    it = TestIterator(entry2, OffsetBounds(3, 6), 4, 30)
+    self.assertEqual([it.get_start_index(), it.get_end_index()], [0, -1])
+    self.assertEqual(list(it.iterate()), [])
+    it = TestIterator(entry2, OffsetBounds(7, 15), 4, 30)
+    self.assertEqual(it.get_start_index(), 0)
+    self.assertEqual(len(list(it.iterate())), 2)
+
+  def test_spans(self):
+    content: bytes = b"\n>A\tB\n>a>b\n\n>1\t2\n"
+    [starts, ends] = fasta.Iterator.delimiter.spans(content)
+    self.assertEqual(list(map(lambda i: content[starts[i]:ends[i]], range(len(starts)))), [b">A\tB\n", b">a>b\n\n", b">1\t2\n"])
+    self.assertEqual(list(fasta.Iterator.to_array(content)), [b">A\tB\n", b">a>b\n\n", b">1\t2\n"])
+
+    # Content before the first token is still returned as a record
+    self.assertEqual(list(fasta.Iterator.to_array(b"A\n>B\n")), [b">A\n", b">B\n"])
+
+  def test_index(self):
+    content = b">A first\nACGTA\nCG\n>B\nGG\n>C third\nTTTTT\nTTTTT\nTT\n"
+    index = fasta.Iterator.create_index(content)
+    self.assertEqual(write_file_index(fasta.Iterator, content), index.to_bytes())
+    self.assertEqual(index.to_bytes(), b"#48\nA\t7\t9\t5\t6\t0\nB\t2\t21\t2\t3\t18\nC\t12\t33\t5\t6\t24\n")
+    index = fasta.SequenceIndex.from_bytes(index.to_bytes())
+    self.assertEqual(index.find(b"B"), (18, 23))
+    self.assertIsNone(index.find(b"D"))
+
+    # Splits are balanced by residues, so C gets a split to itself
+    self.assertEqual(list(map(lambda i: index.align(i * 24), range(3))), [0, 24, 48])
+
+    # Sidecars in another layout are rebuilt instead of parsed
+    self.assertIsNone(fasta.SequenceIndex.from_bytes(RecordIndex(len(content), [0], [3]).to_bytes()))
+
+    # Bounds from the index match the ones found by reading around the split, so splits
+    # in processes with and without a cached index don't drop or repeat records
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test.fasta", content)
+    for splits in [[[0, 19], [20, 47]], [[0, 20], [21, 35], [36, 47]], [[0, 47]]]:
+      results = []
+      for cached in [False, True]:
+        fasta.Iterator.indices.clear()
+        if cached:
+          fasta.Iterator.indices.put(entry1.key, index)
+        bounds = []
+        items = []
+        for [start, end] in splits:
+          it = TestIterator(entry1, OffsetBounds(start, end), 30, 30)
+          bounds.append((it.get_start_index(), it.get_end_index()))
+          items += list(map(bytes, it.iterate()))
+        results.append((bounds, items))
+      self.assertEqual(results[0], results[1])
+      self.assertEqual(results[1][1], [b">A first\nACGTA\nCG\n", b">B\nGG\n", b">C third\nTTTTT\nTTTTT\nTT\n"])
+    self.assertEqual(index.bounds(0, 19), OffsetBounds(0, 17))
+    self.assertEqual(index.bounds(20, 47), OffsetBounds(18, 47))
+    fasta.Iterator.indices.clear()
+
+  def test_get_sequence(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    table1.add_entry("test.fasta", b">A first\nACGTA\nCG\n>B\nGG\n")
+
+    # The first lookup stores the index
+    self.assertEqual(fasta.get_sequence(database, "table1", "test.fasta", b"B"), b">B\nGG\n")
+    self.assertTrue(database.contains("table1", "index/test.fasta"))
+    fasta.Iterator.indices.clear()
+    self.assertEqual(fasta.get_sequence(database, "table1", "test.fasta", b"A"), b">A first\nACGTA\nCG\n")
+    self.assertIsNone(fasta.get_sequence(database, "table1", "test.fasta", b"C"))
+
+    # A sidecar written for an older version of the object is rebuilt
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    table1.add_entry("test.fasta", b">a\nACGT\n>b\nGGGG\n")
+    self.assertEqual(fasta.get_sequence(database, "table1", "test.fasta", b"a"), b">a\nACGT\n")
+    table1.add_entry("test.fasta", b">zz\nTTTTTTTT\n>a\nCCCC\n>b\nAAAA\n")
+    self.assertEqual(fasta.get_sequence(database, "table1", "test.fasta", b"a"), b">a\nCCCC\n")
+    index = fasta.SequenceIndex.from_bytes(database.read("table1", "index/test.fasta"))
+    self.assertEqual(index.content_length, database.get_entry("table1", "test.fasta").content_length())
+    self.assertIsNotNone(fasta.Iterator.indices.get("test.fasta", index.content_length))
+    fasta.Iterator.indices.clear()
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -1,8 +1,11 @@
+import multiprocessing
 import unittest
-from formats import fastq
+from array import array
+from formats import fastq, iterator
 from formats.iterator import OffsetBounds
+from unittest import mock
 from tutils import TestDatabase, TestEntry
-from typing import Any, Optional
+from typing import Any, List, Optional
 
 
 expected_items = [
@@ -61,6 +64,51 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(list(items), expected_items[2:])
     self.assertEqual(offset_bounds, OffsetBounds(178, 265))
 
+  def test_record_values(self):
+    for identifier in fastq.Identifiers:
+      values = list(map(lambda item: float(fastq.Iterator.get_identifier_value(item, identifier)), expected_items))
+      self.assertEqual(fastq.Iterator.get_record_values(expected_items, identifier), values)
+
+    # CCCCCTTA
+    self.assertEqual(fastq.Iterator.get_identifier_value(expected_items[0], fastq.Identifiers.signature), 97745)
+    # AAAAATC
+    self.assertEqual(fastq.Iterator.get_identifier_value(expected_items[2], fastq.Identifiers.minimizer), 21)
+
+  def test_parallel_values(self):
+    entry1: TestEntry = TestEntry("test.fastq", b"\n".join(expected_items * 20))
+    get_record_values = fastq.Iterator.get_record_values.__func__
+    parent_items: List[int] = []
+
+    def record_values(cls, items, identifier):
+      # Workers are forked, so only calls made in this process are recorded
+      parent_items.append(len(items))
+      return get_record_values(cls, items, identifier)
+
+    context = multiprocessing.get_context("fork")
+    for identifier in fastq.Identifiers:
+      for record_views in [False, True]:
+        it = TestIterator(entry1, None, 100, 100000)
+        it.min_parallel_size = 0
+        it.record_views = record_views
+        it.set_read_options({"parse_workers": 3})
+        with mock.patch.object(context, "Process", wraps=context.Process) as process, mock.patch.object(fastq.Iterator, "get_record_values", classmethod(record_values)):
+          [items, values, _, more] = it.next_values(identifier)
+        # The values came from the workers, and the chunk wasn't parsed again here
+        self.assertEqual(process.call_count, 3)
+        self.assertEqual(parent_items, [])
+        self.assertEqual(list(map(bytes, items)), expected_items * 20)
+        self.assertEqual(values, fastq.Iterator.get_record_values(expected_items * 20, identifier))
+
+    # Chunks without a record aren't split
+    self.assertIsNone(it.__parallel_values__(b"", array("q"), array("q"), fastq.Identifiers.signature))
+
+    # Errors in a worker are raised by parsing the chunk here
+    it = TestIterator(TestEntry("test.fastq", b"@A\nACG\n+\nFFF\n@B\nACG\n+\nFFF\n"), None, 100, 100000)
+    it.min_parallel_size = 0
+    it.set_read_options({"parse_workers": 2})
+    with self.assertRaises(Exception):
+      it.next_values(fastq.Identifiers.signature)
+
   def test_offsets(self):
     return
     database: TestDatabase = TestDatabase()
@@ -44,6 +44,20 @@ class IteratorMethods(unittest.TestCase):
                              "4.0 4.0 255 255 255,0.700000 0,0.660000 1,0.600000 2"
                              ])
 
+  def test_combine_top_k(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test1.knn", "1 2,0.500000 0,0.100000 1,0.900000 2\n3 4,0.200000 1")
+    entry2: TestEntry = table1.add_entry("test2.knn", "5 6,0.300000 2\n1 2,0.050000 3")
+    entry3: TestEntry = table1.add_entry("test3.knn", "3 4,0.100000 0,0.400000 2\n")
+    temp_name = "/tmp/ripple_test"
+    with open(temp_name, "wb+") as f:
+      knn.Iterator.combine([entry1, entry2, entry3], f, {"k": 2, "sort": True})
+
+    with open(temp_name) as f:
+      content: str = f.read()
+    self.assertEqual(content.split("\n"), ["1 2,0.100000 1,0.050000 3", "3 4,0.200000 1,0.100000 0", "5 6,0.300000 2"])
+
 
 if __name__ == "__main__":
   unittest.main()
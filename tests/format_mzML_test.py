@@ -1,8 +1,14 @@
+import base64
+import hashlib
+import numpy as np
+import threading
 import unittest
+import zlib
 import xml.etree.ElementTree as ET
 from formats import mzML
-from formats.iterator import OffsetBounds
-from tutils import TestDatabase, TestEntry, TestTable
+from formats.iterator import OffsetBounds, index_key, load_index
+from tutils import TestDatabase, TestEntry, TestTable, write_file_index
+from typing import List, Tuple
 
 
 INPUT = """<?xml version="1.0" encoding="utf-8"?>
@@ -81,6 +87,37 @@ CHROMATOGRAM_INPUT = """<?xml version="1.0" encoding="utf-8"?>
 </indexedmzML>
 """
 
+def create_spectrum(mz, intensity) -> bytes:
+  mz_binary = base64.b64encode(zlib.compress(np.array(mz, dtype="<f8").tobytes()))
+  intensity_binary = base64.b64encode(np.array(intensity, dtype="<f4").tobytes())
+  return str.encode("""<spectrum id="controllerType=0 controllerNumber=1 scan=5" index="4" defaultArrayLength="{0:d}">
+          <cvParam name="ms level" value="2"/>
+          <precursorList count="1">
+            <precursor>
+              <selectedIonList count="1">
+                <selectedIon>
+                  <cvParam name="selected ion m/z" value="445.12"/>
+                </selectedIon>
+              </selectedIonList>
+            </precursor>
+          </precursorList>
+          <binaryDataArrayList count="2">
+            <binaryDataArray encodedLength="{1:d}">
+              <cvParam name="64-bit float" value=""/>
+              <cvParam name="zlib compression" value=""/>
+              <cvParam name="m/z array" value=""/>
+              <binary>{2:s}</binary>
+            </binaryDataArray>
+            <binaryDataArray encodedLength="{3:d}">
+              <cvParam name="32-bit float" value=""/>
+              <cvParam name="no compression" value=""/>
+              <cvParam name="intensity array" value=""/>
+              <binary>{4:s}</binary>
+            </binaryDataArray>
+          </binaryDataArrayList>
+        </spectrum>""".format(len(mz), len(mz_binary), mz_binary.decode("utf-8"), len(intensity_binary), intensity_binary.decode("utf-8")))
+
+
 class IteratorMethods(unittest.TestCase):
   def test_metadata(self):
     database: TestDatabase = TestDatabase()
@@ -118,9 +155,34 @@ class IteratorMethods(unittest.TestCase):
     spectra = list(spectra)
     self.assertFalse(more)
     self.assertEqual(len(spectra), 3)
-    self.assertEqual(spectra[0].get("id"), "controllerType=0 controllerNumber=1 scan=1")
-    self.assertEqual(spectra[1].get("id"), "controllerType=0 controllerNumber=1 scan=2")
-    self.assertEqual(spectra[2].get("id"), "controllerType=0 controllerNumber=1 scan=4")
+    self.assertTrue(spectra[0].startswith(b'<spectrum id="controllerType=0 controllerNumber=1 scan=1"'))
+    self.assertTrue(spectra[1].startswith(b'<spectrum id="controllerType=0 controllerNumber=1 scan=2"'))
+    self.assertTrue(spectra[2].startswith(b'<spectrum id="controllerType=0 controllerNumber=1 scan=4"'))
+    self.assertTrue(spectra[2].endswith(b"</spectrum>"))
+
+  def test_from_array(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("0/123.4-13/1/1-1-1-test.mzML", INPUT)
+    it = mzML.Iterator(entry1)
+    [spectra, offset_bounds, more] = it.next()
+    spectra = list(spectra)
+    [content, metadata] = mzML.Iterator.from_array(spectra[::-1], None, it.get_extra())
+    self.assertEqual(metadata["num_spectra"], "3")
+
+    # Spectra are copied as is, except for the index attribute
+    start = content.index(b"<spectrum ")
+    expected = spectra[2].replace(b'index="3"', b'index="0"')
+    self.assertEqual(content[start:start + len(expected)], expected)
+    self.assertEqual(content.count(b'index="1"'), 1)
+    self.assertEqual(mzML.Iterator.get_identifier_value(content[start:], mzML.Identifiers.mass), 431.0)
+    self.assertIn(str.encode('scan=4">{0:d}</offset>'.format(start)), content)
+
+    # The checksum covers everything before it
+    end = content.index(b"</fileChecksum>")
+    checksum_start = end - 40
+    self.assertEqual(content[checksum_start:end], str.encode(hashlib.sha1(content[:checksum_start]).hexdigest()))
+    self.assertEqual(len(content), int(metadata["footer_end_index"]))
 
   def test_identifier(self):
     database: TestDatabase = TestDatabase()
@@ -135,6 +197,50 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(it.get_identifier_value(spectra[1], mzML.Identifiers.mass), 4.0)
     self.assertEqual(it.get_identifier_value(spectra[2], mzML.Identifiers.mass), 431.0)
 
+  def test_peaks(self):
+    spectrum = create_spectrum([100.5, 200.25, 300.125], [10.0, 30.0, 20.0])
+    [mz, intensity] = mzML.Iterator.get_peaks(spectrum)
+    self.assertEqual(mz.dtype, np.float64)
+    self.assertEqual(intensity.dtype, np.float32)
+    self.assertEqual(list(mz), [100.5, 200.25, 300.125])
+    self.assertEqual(list(intensity), [10.0, 30.0, 20.0])
+    self.assertEqual(mzML.Iterator.get_identifier_value(spectrum, mzML.Identifiers.peaks), 3.0)
+    self.assertEqual(mzML.Iterator.get_identifier_value(spectrum, mzML.Identifiers.precursor), 445.12)
+
+    # Keep the two most intense peaks
+    keep = np.sort(np.argsort(intensity)[-2:])
+    filtered = mzML.Iterator.set_peaks(spectrum, mz[keep], intensity[keep])
+    self.assertEqual(filtered, create_spectrum([200.25, 300.125], [30.0, 20.0]))
+    self.assertEqual(mzML.Iterator.get_identifier_value(filtered, mzML.Identifiers.peaks), 2.0)
+
+  def test_prefetch(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("0/123.4-13/1/1-1-1-test.mzML", INPUT)
+    expected = list(map(bytes, mzML.Iterator(entry1).iterate()))
+
+    # Reading the spectra for the offsets happens while the next offsets are in flight,
+    # so no read can run on this thread while the prefetcher is running
+    it = mzML.Iterator(entry1)
+    it.read_chunk_size = 200
+    it.prefetch_depth = 2
+    get_range = entry1.get_range
+    unsafe_reads: List[Tuple[int, int]] = []
+    def record(start_index: int, end_index: int) -> bytes:
+      if it.prefetcher is not None and threading.current_thread() is threading.main_thread():
+        unsafe_reads.append((start_index, end_index))
+      return get_range(start_index, end_index)
+    entry1.get_range = record
+    items: List[bytes] = []
+    more: bool = True
+    while more:
+      [spectra, _, more] = it.next()
+      items += list(map(bytes, spectra))
+    self.assertEqual(items, expected)
+    self.assertEqual(unsafe_reads, [])
+    self.assertGreater(database.statistics.prefetch_count, 0)
+    self.assertIsNone(it.prefetcher)
+
   def test_adjust(self):
     database: TestDatabase = TestDatabase()
     table1: TestTable = database.create_table("table1")
@@ -162,6 +268,34 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(offset_bounds.start_index, 123)
     self.assertEqual(offset_bounds.end_index, 320)
 
+  def test_offset_index(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("0/123.4-13/1/1-1-1-test.mzML", INPUT)
+    mzML.Iterator.indices.clear()
+    it = mzML.Iterator(entry1)
+    self.assertEqual(list(it.offset_index.offsets), [123, 321, 517, 737])
+    self.assertEqual(list(it.offset_index.positions), [1028, 1106, 1184, 1262])
+    self.assertEqual(it.offset_index.end, 1333)
+
+    # The sidecar matches the table parsed from the object
+    index = mzML.Iterator.create_index(entry1.get_content())
+    index = mzML.OffsetIndex.from_bytes(index.to_bytes())
+    self.assertEqual(index.offsets, it.offset_index.offsets)
+    self.assertEqual(index.positions, it.offset_index.positions)
+    self.assertEqual(index.end, it.offset_index.end)
+    self.assertEqual(index.align(124), 321)
+    self.assertEqual(write_file_index(mzML.Iterator, entry1.get_content()), index.to_bytes())
+
+    # Iterators use a loaded table instead of parsing the index list
+    mzML.Iterator.indices.clear()
+    table1.add_entry(index_key(entry1.key), index.to_bytes())
+    loaded = load_index(database, "table1", entry1.key, mzML.Iterator)
+    it = mzML.Iterator(entry1, OffsetBounds(120, 540))
+    self.assertIs(it.offset_index, loaded)
+    self.assertEqual(it.get_start_index(), 123)
+    self.assertEqual(it.get_end_index(), 736)
+
   def test_combine(self):
     metadata = {
       "header_start_index": "0",
@@ -191,12 +325,12 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(metadata["header_start_index"], "0")
     self.assertEqual(metadata["header_end_index"], "122")
     self.assertEqual(metadata["spectra_start_index"], "123")
-    self.assertEqual(metadata["spectra_end_index"], "1121")
+    self.assertEqual(metadata["spectra_end_index"], "1071")
     self.assertEqual(metadata["chromatogram_start_index"], "-1")
     self.assertEqual(metadata["chromatogram_end_index"], "-1")
-    self.assertEqual(metadata["index_list_offset"], "1150")
-    self.assertEqual(metadata["footer_start_index"], "1136")
-    self.assertEqual(metadata["footer_end_index"], "2020")
+    self.assertEqual(metadata["index_list_offset"], "1100")
+    self.assertEqual(metadata["footer_start_index"], "1086")
+    self.assertEqual(metadata["footer_end_index"], "1970")
 
 
 if __name__ == "__main__":
@@ -3,9 +3,9 @@ import os
 import sys
 import unittest
 from formats  import new_line
-from formats.iterator import OffsetBounds
-from tutils import TestDatabase, TestEntry, TestTable
-from typing import Any, Optional
+from formats.iterator import ChunkSizer, OffsetBounds, RecordIndex, RecordView, Zone
+from tutils import TestDatabase, TestEntry, TestTable, write_file_index
+from typing import Any, List, Optional, Tuple
 
 
 class TestIterator(new_line.Iterator):
@@ -15,6 +15,18 @@ class TestIterator(new_line.Iterator):
     new_line.Iterator.__init__(self, entry, offset_bounds)
 
 
+class SortIterator(new_line.Iterator):
+  merge_batch_size = 2
+  read_chunk_size = 5
+
+  def __init__(self, entry: TestEntry, offset_bounds: Optional[OffsetBounds] = None):
+    new_line.Iterator.__init__(self, entry, offset_bounds)
+
+  @classmethod
+  def get_identifier_value(cls, item: bytes, identifier: Any) -> float:
+    return float(item.split(b" ")[0])
+
+
 class IteratorMethods(unittest.TestCase):
   def test_adjust(self):
     database: TestDatabase = TestDatabase()
@@ -46,6 +58,18 @@ class IteratorMethods(unittest.TestCase):
     self.assertFalse(more)
     self.assertEqual(list(items), [b"d e f"])
 
+  def test_adjacent_splits(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test.new_line", "ab\ncd\nef\n")
+
+    # Every record is read once, including when the next split starts on a delimiter
+    for end in range(1, 7):
+      items: List[bytes] = []
+      for [start_index, end_index] in [[0, end], [end + 1, 8]]:
+        items += list(map(bytes, TestIterator(entry1, OffsetBounds(start_index, end_index), 2, 4).iterate()))
+      self.assertEqual(items, [b"ab", b"cd", b"ef"])
+
   def test_next(self):
     database: TestDatabase = TestDatabase()
     log: TestTable = database.create_table("log")
@@ -114,6 +138,219 @@ class IteratorMethods(unittest.TestCase):
       self.assertEqual(f.read(), "".join(list(map(lambda entry: entry.get_content().decode("utf-8"), entries))))
     os.remove(temp_name)
 
+  def test_combine_sort(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    table1.add_entry("test1.new_line", "1 a\n4 b\n7 c\n")
+    table1.add_entry("test2.new_line", "2 d\n4 e\n8 f\n9 g\n")
+    table1.add_entry("test3.new_line", "")
+    table1.add_entry("test4.new_line", "0 h\n3 i\n")
+    entries: List[TestEntry] = database.get_entries(table1.name)
+
+    temp_name = "/tmp/ripple_test"
+    with open(temp_name, "wb+") as f:
+      metadata = SortIterator.combine(entries, f, {"sort": True, "identifier": None})
+
+    with open(temp_name) as f:
+      self.assertEqual(f.read(), "0 h\n1 a\n2 d\n3 i\n4 b\n4 e\n7 c\n8 f\n9 g")
+    zone = Zone.from_metadata(metadata, None)
+    self.assertEqual([zone.minimum, zone.maximum, zone.count], [0, 9, 9])
+    os.remove(temp_name)
+
+  def test_combine_sort_full_batches(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    table1.add_entry("test1.new_line", "1 a\n3 b\n")
+    table1.add_entry("test2.new_line", "2 c\n4 d\n")
+    entries: List[TestEntry] = database.get_entries(table1.name)
+
+    # The count is a multiple of the batch size, so the last batch is empty
+    temp_name = "/tmp/ripple_test"
+    with open(temp_name, "wb+") as f:
+      metadata = SortIterator.combine(entries, f, {"sort": True, "identifier": None})
+
+    with open(temp_name) as f:
+      self.assertEqual(f.read(), "1 a\n2 c\n3 b\n4 d")
+    zone = Zone.from_metadata(metadata, None)
+    self.assertEqual([zone.minimum, zone.maximum, zone.count], [1, 4, 2 * SortIterator.merge_batch_size])
+    os.remove(temp_name)
+
+  def test_combine_disjoint(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    table1.add_entry("test1.new_line", "4 a\n5 b\n", Zone("None", 4, 5, 2).to_metadata())
+    table1.add_entry("test2.new_line", "1 c\n2 d\n", Zone("None", 1, 2, 2).to_metadata())
+    table1.add_entry("test3.new_line", "2 e\n3 f\n", Zone("None", 2, 3, 2).to_metadata())
+    entries: List[TestEntry] = database.get_entries(table1.name)
+
+    # Zones that touch out of entry order have to be merged to keep ties stable
+    self.assertIsNone(SortIterator.__disjoint_order__(list(map(lambda entry: Zone.from_metadata(entry.get_metadata(), None), entries[::-1]))))
+
+    temp_name = "/tmp/ripple_test"
+    with open(temp_name, "wb+") as f:
+      metadata = SortIterator.combine(entries, f, {"sort": True, "identifier": None})
+
+    # Entries are appended without reading them item by item
+    with open(temp_name) as f:
+      self.assertEqual(f.read(), "1 c\n2 d\n2 e\n3 f\n4 a\n5 b\n")
+    self.assertEqual(database.statistics.read_count, 3)
+    self.assertEqual(metadata, Zone("None", 1, 5, 6).to_metadata())
+    os.remove(temp_name)
+
+  def test_index(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    content = "1 a\n4 b\n7 c\n2 d\n4 e\n8 f\n9 g"
+    entry1: TestEntry = table1.add_entry("test.new_line", content)
+    SortIterator.index_block_size = 6
+    index = SortIterator.create_index(str.encode(content), "key")
+    self.assertEqual(list(index.offsets), [0, 8, 16, 24])
+    self.assertEqual(list(index.counts), [2, 2, 2, 1])
+    self.assertEqual(list(index.minimums), [1, 2, 4, 9])
+    self.assertEqual(list(index.maximums), [4, 7, 8, 9])
+    self.assertEqual(index.count(), 7)
+    self.assertEqual(index.align(9), 16)
+    self.assertEqual(index.align(25), len(content))
+
+    index = RecordIndex.from_bytes(index.to_bytes())
+    self.assertEqual(list(index.offsets), [0, 8, 16, 24])
+    self.assertEqual(list(index.maximums), [4, 7, 8, 9])
+    SortIterator.index_block_size = new_line.Iterator.index_block_size
+
+    # Indexing an output file gives the same sidecar
+    SortIterator.index_block_size = 6
+    self.assertEqual(write_file_index(SortIterator, str.encode(content), "key"), SortIterator.create_index(str.encode(content), "key").to_bytes())
+    SortIterator.index_block_size = new_line.Iterator.index_block_size
+
+    # Aligned bounds don't read around the split to find the record boundary
+    it = new_line.Iterator(entry1, OffsetBounds(8, 15, aligned=True))
+    [items, offset_bounds, more] = it.next()
+    self.assertEqual(list(items), [b"7 c", b"2 d"])
+    self.assertEqual(database.statistics.read_count, 1)
+
+  def test_spans(self):
+    content: bytes = b"A B C\n\n  \na b c\n1 2 3"
+    [starts, ends] = new_line.Iterator.delimiter.spans(content)
+    self.assertEqual(list(starts), [0, 10, 16])
+    self.assertEqual(list(ends), [5, 15, 21])
+    self.assertEqual(list(new_line.Iterator.to_array(content)), [b"A B C", b"a b c", b"1 2 3"])
+
+    [starts, ends] = new_line.Iterator.delimiter.spans(b"")
+    self.assertEqual(len(starts), 0)
+
+  def test_record_views(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test.new_line", "A B C\na b c\n1 2 3 4 5 6\nD E F\n")
+
+    it = TestIterator(entry1, None, 11, 8)
+    it.record_views = True
+    bounds: List[OffsetBounds] = []
+    items: List[Any] = []
+    more: bool = True
+    while more:
+      [chunk, offset_bounds, more] = it.next()
+      items += chunk
+      if offset_bounds is not None:
+        bounds.append(offset_bounds)
+    self.assertTrue(all(map(lambda item: isinstance(item, RecordView), items)))
+    self.assertEqual(list(map(bytes, items)), [b"A B C", b"a b c", b"1 2 3 4 5 6", b"D E F"])
+    # Partial records are read again with the next chunk, unless the chunk has no complete record
+    self.assertEqual(bounds, [OffsetBounds(0, 5), OffsetBounds(6, 11), OffsetBounds(12, 29)])
+
+    with open("/tmp/record_views", "wb+") as f:
+      [content, metadata] = new_line.Iterator.from_array(items, f, {})
+    with open("/tmp/record_views", "rb") as f:
+      self.assertEqual(f.read(), b"A B C\na b c\n1 2 3 4 5 6\nD E F")
+    os.remove("/tmp/record_views")
+    self.assertEqual(new_line.Iterator.from_array(items[1:3], None, {})[0], b"a b c\n1 2 3 4 5 6")
+
+  def read_all(self, it: new_line.Iterator) -> Tuple[List[bytes], List[OffsetBounds]]:
+    bounds: List[OffsetBounds] = []
+    items: List[bytes] = []
+    more: bool = True
+    while more:
+      [chunk, offset_bounds, more] = it.next()
+      items += list(map(bytes, chunk))
+      bounds.append(offset_bounds)
+    return (items, bounds)
+
+  def test_prefetch(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    content = "".join(list(map(lambda i: "{0:d} {1:d}\n".format(i, i * i), range(100))))
+    entry1: TestEntry = table1.add_entry("test.new_line", content)
+    [expected_items, expected_bounds] = self.read_all(TestIterator(entry1, None, 11, 20))
+    read_count: int = database.statistics.read_count
+
+    it = TestIterator(entry1, None, 11, 20)
+    it.prefetch_depth = 2
+    self.assertEqual(self.read_all(it), (expected_items, expected_bounds))
+    # Every chunk after the first was already in flight, and nothing is read twice
+    self.assertEqual(database.statistics.prefetch_count, len(expected_bounds) - 1)
+    self.assertEqual(database.statistics.read_count, 2 * read_count)
+    self.assertIsNone(it.prefetcher)
+
+    # Views reread partial records, so only the next range is prefetched
+    it = TestIterator(entry1, None, 11, 20)
+    it.prefetch_depth = 2
+    it.record_views = True
+    [items, bounds] = self.read_all(it)
+    self.assertEqual(items, expected_items)
+
+    # Stopping early cancels the reads in flight
+    it = TestIterator(entry1, None, 11, 20)
+    it.prefetch_depth = 2
+    it.next()
+    it.close()
+    self.assertIsNone(it.prefetcher)
+
+  def test_adjust_window(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    entry1: TestEntry = table1.add_entry("test.new_line", "A B C D E F\na b c d e f\n1 2 3 4 5 6\n")
+
+    # Records are longer than the adjust window, so it has to grow
+    it = TestIterator(entry1, OffsetBounds(15, 28), 4, 30)
+    [items, offset_bounds, more] = it.next()
+    self.assertEqual(list(items), [b"a b c d e f"])
+    self.assertEqual(offset_bounds, OffsetBounds(12, 23))
+    self.assertEqual(database.statistics.adjust_chunk_size, 8)
+
+  def test_chunk_sizer(self):
+    class TestSizer(ChunkSizer):
+      available: Optional[int] = None
+
+      def available_memory(self) -> Optional[int]:
+        return self.available
+
+    # Requests with 50ms of latency and 100MB/s settle where they take the target time
+    sizer = TestSizer(1000*1000, 64*1000, 64*1000*1000, 0.5)
+    sizes: List[int] = []
+    for i in range(20):
+      sizes.append(sizer.observe(sizer.size, 0.05 + sizer.size / (100.0*1000*1000)))
+    self.assertEqual(sizes[:4], [2000000, 4000000, 8000000, 16000000])
+    self.assertAlmostEqual(0.05 + sizes[-1] / (100.0*1000*1000), 0.5, places=2)
+
+    # Memory pressure shrinks the size
+    sizer.available = 40*1000*1000
+    self.assertEqual(sizer.observe(sizer.size, 0.5), 10*1000*1000)
+    sizer.available = 0
+    self.assertEqual(sizer.observe(sizer.size, 0.5), 64*1000)
+
+    # Iterators record the size of every chunk
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    content = "".join(list(map(lambda i: "{0:d} {1:d}\n".format(i, i * i), range(100))))
+    entry1: TestEntry = table1.add_entry("test.new_line", content)
+    it = TestIterator(entry1, None, 11, 20)
+    it.min_read_chunk_size = 20
+    it.set_read_options({"target_request_time": 1.0})
+    [items, bounds] = self.read_all(it)
+    self.assertEqual(len(items), 100)
+    sizes = database.statistics.read_chunk_sizes
+    self.assertEqual(sizes[:3], [21, 41, 81])
+
 
 if __name__ == "__main__":
   unittest.main()
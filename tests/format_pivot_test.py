@@ -3,7 +3,7 @@ import unittest
 from formats import pivot
 from formats.iterator import OffsetBounds
 from tutils import TestDatabase, TestEntry, TestTable
-from typing import Any, ClassVar, Optional
+from typing import Any, ClassVar, List, Optional
 
 
 class TestIterator(pivot.Iterator):
@@ -47,50 +47,40 @@ class PivotMethods(unittest.TestCase):
     table1.add_entry("test2.pivot", "{0:s}\nkey2\n1\t40\t50\t63\t81".format(table1.name))
     table1.add_entry("test3.pivot", "{0:s}\nkey3\n10\t12\t40\t41\t42".format(table1.name))
 
+    # Files without counts weigh each bucket equally
     entries: List[TestEntry] = database.get_entries(table1.name)
     temp_name = "/tmp/ripple_test"
-    # 1 10 12 20 25 40 40 41 42 50 60 61 63 80 81
-    # *             *              *           *
-    it = TestIterator(entry1, None, increment=7)
     with open(temp_name, "wb+") as f:
-      it.combine(entries, f, {})
+      pivot.Iterator.combine(entries, f, {"num_pivot_bins": 3})
 
     with open(temp_name) as f:
-      self.assertEqual(f.read(), "{0:s}\nkey3\n1.0\t40.0\t60.0\t81.0".format(table1.name))
-
-    # 1 10 12 20 25 40 40 41 42 50 60 61 63 80 81
-    # *                                        *
-    with open(temp_name, "wb+") as f:
-      pivot.Iterator.combine(entries, f, {})
-
-    with open(temp_name) as f:
-      self.assertEqual(f.read(), "{0:s}\nkey3\n1.0\t81.0".format(table1.name))
+      [file_bucket, file_key, pivots, counts] = pivot.parse(f.read())
+    self.assertEqual([file_bucket, file_key], [table1.name, "key3"])
+    self.assertEqual([pivots[0], pivots[-1]], [1.0, 81.0])
+    self.assertEqual(counts, [4.0, 4.0, 4.0])
     os.remove(temp_name)
 
-  def test_combine_edge_case(self):
-    # If we always increment by an integer amount, we may run into the
-    # case where the last bin has significantly less values than the rest
-    # of the bins. We want to make sure values are distributed across
-    # bins as uniformly as possible, so we increment by non-integer values.
-    # This test tests the non-uniform case.
+  def test_combine_skew(self):
+    # A heavy hitter is split into point bins instead of making one bin much larger than the rest
     database: TestDatabase = TestDatabase()
     table1: TestTable = database.create_table("table1")
-    entry1: TestEntry = table1.add_entry("test1.pivot", "bucket1\nkey1\n20\t25\t60\t61\t80")
-    entry2: TestEntry = table1.add_entry("test2.pivot", "bucket1\nkey2\n1\t40\t50\t63\t81")
-    entry3: TestEntry = table1.add_entry("test3.pivot", "bucket1\nkey3\n10\t12\t40\t41\t42")
+    values = sorted(list(range(0, 1000, 5)) + [500] * 600)
+    [pivots, counts] = pivot.create_buckets(values, 4)
+    self.assertEqual(pivots, [0, 500, 500, 996.0])
+    self.assertEqual(counts, [100, 601, 99])
+    table1.add_entry("test1.pivot", pivot.to_content("bucket1", "key1", pivots, counts))
+    table1.add_entry("test2.pivot", pivot.to_content("bucket1", "key2", pivots, counts))
     entries: List[TestEntry] = database.get_entries(table1.name)
 
-    # 1 10 12 20 25 40 40 41 42 50 60 61 63 80 81
-    # *          *           *        *        *
     temp_name = "/tmp/ripple_test"
-    it = TestIterator(entry1, None, increment=4)
     with open(temp_name, "wb+") as f:
-      it.combine(entries, f, {})
+      pivot.Iterator.combine(entries, f, {"num_pivot_bins": 4})
 
     with open(temp_name) as f:
-      self.assertEqual(f.read(), "bucket1\nkey3\n1.0\t25.0\t42.0\t61.0\t81.0")
+      [_, _, pivots, counts] = pivot.parse(f.read())
+    self.assertEqual(pivots, [0.0, 500.0, 500.0, 500.0, 500.0, 500.0, 996.0])
+    self.assertEqual(counts, [200.0, 300.0, 300.0, 300.0, 300.0, 198.0])
     os.remove(temp_name)
 
-
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+from formats import fastq, registry
+
+
+class RegistryMethods(unittest.TestCase):
+  def test_get(self):
+    format_lib = registry.get("fastq")
+    self.assertIs(format_lib, registry.get("fastq"))
+    self.assertIs(format_lib.iterator, fastq.Iterator)
+    self.assertEqual(format_lib.identifier("minimizer"), fastq.Identifiers.minimizer)
+    with self.assertRaises(Exception):
+      format_lib.identifier("mass")
+
+    self.assertIsNone(registry.find("iterator"))
+    self.assertIsNone(registry.find("unknown"))
+    with self.assertRaises(Exception):
+      registry.get("unknown")
+
+  def test_capabilities(self):
+    format_lib = registry.get("mzML")
+    self.assertEqual([format_lib.has_header, format_lib.offset_index, format_lib.binary, format_lib.views], [True, True, False, False])
+    format_lib = registry.get("binary")
+    self.assertEqual([format_lib.has_header, format_lib.binary, format_lib.offset_index, format_lib.identifiers], [True, True, False, {}])
+    self.assertTrue(registry.get("blast").views)
+
+  def test_sources(self):
+    sources = registry.sources()
+    self.assertTrue("iterator" not in sources)
+    self.assertTrue("registry" not in sources)
+    self.assertEqual(sources["confidence"].intersection(sources.keys()), set(["new_line", "tsv"]))
+    self.assertTrue("numpy" in sources["fastq"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -1,6 +1,6 @@
 import os
 import unittest
-from formats import tsv
+from formats import confidence, tsv
 from formats.iterator import OffsetBounds
 from typing import Any, Optional
 from tutils import TestEntry
@@ -37,6 +37,36 @@ class IteratorMethods(unittest.TestCase):
     self.assertEqual(offset_bounds, OffsetBounds(0, 17))
     self.assertFalse(more)
 
+  def test_columns(self):
+    columns = tsv.Columns(b"A\t1.5\tX\n\nB\t20\tY\nC\t0.001\tZ", "\t")
+    self.assertEqual(len(columns), 3)
+    self.assertEqual(columns.column(1).tolist(), [1.5, 20.0, 0.001])
+    self.assertEqual(columns.strings(0).tolist(), [b"A", b"B", b"C"])
+    self.assertEqual(columns.count(1, 1.5), 2)
+    self.assertEqual(columns.filter(columns.column(1) > 1), [b"A\t1.5\tX", b"B\t20\tY"])
+
+    # A long field isn't padded into every row
+    long_field = b"x" * (tsv.Columns.max_fixed_width + 1)
+    columns = tsv.Columns(b"A\t1\t" + long_field + b"\nB\t2\tY\n", "\t")
+    self.assertEqual(columns.strings(2).tolist(), [long_field, b"Y"])
+    self.assertEqual(columns.strings(0).dtype, "S1")
+    self.assertEqual(columns.column(1).tolist(), [1.0, 2.0])
+
+    with self.assertRaises(Exception):
+      tsv.Columns(b"A\t1\nB\n", "\t").column(1)
+
+  def test_fraction(self):
+    lines = list(map(lambda i: "\t".join(["x"] * 9 + [str((i % 7) / 100.0)]), range(50)))
+    entry = TestEntry("test.confidence", "HEADER\n" + "\n".join(lines) + "\n")
+    it = confidence.Iterator(entry)
+    it.read_chunk_size = 100
+    it.adjust_chunk_size = 100
+    [count, total] = it.fraction(confidence.Identifiers.qvalue)
+    self.assertEqual(count, len(list(filter(lambda i: (i % 7) / 100.0 <= 0.01, range(50)))))
+    self.assertTrue(total > 1)
+    values = confidence.Iterator.get_record_values(list(map(str.encode, lines)), confidence.Identifiers.qvalue)
+    self.assertEqual(values, list(map(lambda i: (i % 7) / 100.0, range(50))))
+
   def test_combine(self):
     entry1 = TestEntry("test1.tsv", "HEADER\nA\tB\tC\na\tb\tc\n1\t2\t3\n")
     entry2 = TestEntry("test2.tsv", "HEADER\nD\tE\tF\nd\te\tf\n4\t5\t6\n")
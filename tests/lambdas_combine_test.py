@@ -33,6 +33,39 @@ class CombineFunction(unittest.TestCase):
     self.assertEqual(combined_entry.key, "1/123.400000-13/1-1/1-0.000000-1-suffix.new")
     self.assertEqual(combined_entry.get_content().decode("utf-8"), "A B C\nD E F\nG H I\nJ K L\n")
 
+  def test_tracker(self):
+    database: TestDatabase = TestDatabase()
+    table1: TestTable = database.create_table("table1")
+    database.create_table("manifest")
+    entry1: TestEntry = table1.add_entry("0/123.400000-13/1-1/2-0.00000-2-suffix.new", "G H I\nJ K L\n")
+    entry2: TestEntry = table1.add_entry("0/123.400000-13/1-1/1-0.0000-2-suffix.new", "A B C\nD E F\n")
+    log = database.create_table("log")
+    params = {
+      "bucket": table1.name,
+      "file": "combine_file",
+      "format": "new_line",
+      "log": log.name,
+      "name": "combine",
+      "sort": False,
+      "output_format": "new_line",
+      "timeout": 60,
+      "tracker": "database",
+      "tracker_table": "manifest",
+    }
+    database.params = params
+    for entry in [entry1, entry2]:
+      event = tutils.create_event(database, table1.name, entry.key)
+      context = tutils.create_context(params)
+      combine_files.main(event, context)
+      entries: List[TestEntry] = database.get_entries(table1.name)
+      self.assertEqual(len(entries), 2 if entry == entry1 else 3)
+
+    combined_entry = database.get_entries(table1.name)[-1]
+    self.assertEqual(combined_entry.key, "1/123.400000-13/1-1/1-0.000000-1-suffix.new")
+    self.assertEqual(combined_entry.get_content().decode("utf-8"), "A B C\nD E F\nG H I\nJ K L\n")
+    # Both invocations finished, so both wrote logs
+    self.assertEqual(len(database.get_entries(log.name)), 2)
+
 
 if __name__ == "__main__":
   unittest.main()
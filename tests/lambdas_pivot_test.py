@@ -47,7 +47,7 @@ optimal_alignment_score: 193 suboptimal_alignment_score: 48""")
     pivot_file.main(event, context)
     entries = database.get_entries(table1.name)
     self.assertEqual(len(entries), 2)
-    self.assertEqual(entries[1].get_content().decode("utf-8"), "{0:s}\n{1:s}\n2009.0\t290321.0\t540010.0".format(table1.name, entry1.key))
+    self.assertEqual(entries[1].get_content().decode("utf-8"), "{0:s}\n{1:s}\n2009.0\t290321.0\t540010.0\n2\t3".format(table1.name, entry1.key))
 
   def test_offsets(self):
     params = {
@@ -90,7 +90,42 @@ optimal_alignment_score: 193 suboptimal_alignment_score: 48""")
     pivot_file.main(event, context)
     entries = database.get_entries(table1.name)
     self.assertEqual(len(entries), 2)
-    self.assertEqual(entries[1].get_content().decode("utf-8"), "{0:s}\n{1:s}\n2009.0\t290321.0\t540010.0".format(table1.name, entry1.key))
+    self.assertEqual(entries[1].get_content().decode("utf-8"), "{0:s}\n{1:s}\n2009.0\t290321.0\t540010.0\n2\t3".format(table1.name, entry1.key))
+
+  def test_sample(self):
+    params = {
+      "bucket": "table1",
+      "file": "sort",
+      "input_format": "blast",
+      "identifier": "score",
+      "log": "log",
+      "name": "sort",
+      "num_pivot_bins": 4,
+      "pivot_samples": 10,
+      "pivot_window_size": 400,
+      "timeout": 60,
+    }
+
+    database: TestDatabase = TestDatabase(params)
+    log: TestTable = database.create_table(params["log"])
+    table1: TestTable = database.create_table(params["bucket"])
+    item = "target_name: 1\nquery_name: 1\noptimal_alignment_score: {0:d} suboptimal_alignment_score: 0"
+    content = "\n\n".join(list(map(lambda i: item.format(i), range(1000))))
+    entry1: TestEntry = table1.add_entry("0/123.400000-13/1-1/1-0.0000-1-suffix.blast", content)
+
+    event = tutils.create_event(database, table1.name, entry1.key)
+    context = tutils.create_context(params)
+    pivot_file.main(event, context)
+    entries = database.get_entries(table1.name)
+    self.assertEqual(len(entries), 2)
+
+    # Only the sampled windows are read
+    self.assertLess(database.statistics.read_byte_count, len(content) / 2)
+    pivots = list(map(lambda p: float(p) / 1000, entries[1].get_content().decode("utf-8").split("\n")[2].split("\t")))
+    self.assertEqual(len(pivots), 5)
+    error = float(entries[1].get_metadata()["pivot_rank_error"])
+    for i in range(1, 4):
+      self.assertLess(abs(pivots[i] - i * 250), 2 * error * 1000)
 
 
 if __name__ == "__main__":
@@ -1,13 +1,18 @@
+import os
+import tempfile
 from formats import blast
+from formats.iterator import Zone
 from lambdas import sort
 import tutils
 import unittest
 from tutils import TestDatabase, TestTable, TestEntry
+from typing import Any, Dict, List
+from unittest import mock
 
 
 
 class SortMethods(unittest.TestCase):
-  def test_basic(self):
+  def check_basic(self, record_views: bool):
     pivots: List[Dict[str, Any]] = []
     increment = 300000
     for i in range(3):
@@ -25,6 +30,7 @@ class SortMethods(unittest.TestCase):
       "log": "log",
       "name": "sort",
       "pivots": pivots,
+      "record_views": record_views,
       "timeout": 60,
     }
 
@@ -68,6 +74,17 @@ optimal_alignment_score: 540 suboptimal_alignment_score: 9""")
 
     self.assertEqual(objs[3].get_content().decode("utf-8"), "")
 
+    # Bins record the range of their identifier values
+    zone = Zone.from_metadata(objs[2].get_metadata(), "score")
+    self.assertEqual([zone.minimum, zone.maximum, zone.count], [300112, 540009, 2])
+    self.assertEqual(Zone.from_metadata(objs[3].get_metadata(), "score").count, 0)
+
+  def test_basic(self):
+    self.check_basic(False)
+
+  def test_record_views(self):
+    self.check_basic(True)
+
   def test_offsets(self):
     pivots = []
     increment = 300000
@@ -124,6 +141,117 @@ optimal_alignment_score: 540 suboptimal_alignment_score: 9""")
 
     self.assertEqual(entries[2].get_content().decode("utf-8"), "")
 
+  def test_external(self):
+    pivots = []
+    increment = 300000
+    for i in range(3):
+      start = i * increment
+      pivots.append({
+        "range": [start, start + increment],
+        "bin": i + 1
+      })
+
+    params = {
+      "bucket": "table1",
+      "file": "sort",
+      "identifier": "score",
+      "input_format": "blast",
+      "log": "log",
+      "memory_budget": 100,
+      "name": "sort",
+      "pivots": pivots,
+      "timeout": 60,
+    }
+    s3 = TestDatabase(params)
+    s3.create_table(params["log"])
+    table1 = s3.create_table(params["bucket"])
+
+    entry1 = table1.add_entry("0/123.400000-13/1-1/1-0.0000-1-suffix.blast",
+"""target_name: 1
+query_name: 1
+optimal_alignment_score: 540 suboptimal_alignment_score: 9
+
+target_name: 1
+query_name: 1
+optimal_alignment_score: 193 suboptimal_alignment_score: 48
+
+target_name: 1
+query_name: 1
+optimal_alignment_score: 300 suboptimal_alignment_score: 112
+
+target_name: 1
+query_name: 1
+optimal_alignment_score: 193 suboptimal_alignment_score: 47""")
+
+    event = tutils.create_event(s3, table1.name, entry1.key)
+    context = tutils.create_context(params)
+    spilled: List[str] = self.spill_files()
+    sort.main(event, context)
+    entries = sorted(s3.get_entries(table1.name, "1/"), key=lambda e: e.key)
+    self.assertEqual(len(entries), 3)
+    self.assertEqual(entries[0].get_content().decode("utf-8"), """target_name: 1
+query_name: 1
+optimal_alignment_score: 193 suboptimal_alignment_score: 47
+
+target_name: 1
+query_name: 1
+optimal_alignment_score: 193 suboptimal_alignment_score: 48""")
+
+    self.assertEqual(entries[1].get_content().decode("utf-8"), """target_name: 1
+query_name: 1
+optimal_alignment_score: 300 suboptimal_alignment_score: 112
+
+target_name: 1
+query_name: 1
+optimal_alignment_score: 540 suboptimal_alignment_score: 9""")
+
+    self.assertEqual(entries[2].get_content().decode("utf-8"), "")
+    self.assertEqual(self.spill_files(), spilled)
+
+    # Spill files are removed when writing a bin fails
+    s3 = TestDatabase(params)
+    s3.create_table(params["log"])
+    s3.create_table(params["bucket"]).add_entry(entry1.key, entry1.get_content())
+    event = tutils.create_event(s3, table1.name, entry1.key)
+    with mock.patch.object(s3, "put", side_effect=Exception("put failed")):
+      with self.assertRaisesRegex(Exception, "put failed"):
+        sort.main(event, context)
+    self.assertEqual(self.spill_files(), spilled)
+
+    # Merged records are written to their bin a batch at a time
+    s3 = TestDatabase(params)
+    s3.create_table(params["log"])
+    s3.create_table(params["bucket"]).add_entry(entry1.key, entry1.get_content())
+    event = tutils.create_event(s3, table1.name, entry1.key)
+    write_items = blast.Iterator.__write_items__.__func__
+    batches: List[int] = []
+
+    def write_batch(cls, items, f, extra, count):
+      batches.append(len(items))
+      return write_items(cls, items, f, extra, count)
+
+    with mock.patch.object(blast.Iterator, "merge_batch_size", 1), mock.patch.object(blast.Iterator, "__write_items__", classmethod(write_batch)):
+      sort.main(event, context)
+    self.assertEqual(batches, [1, 1, 1, 1, 0])
+    batched = sorted(s3.get_entries(table1.name, "1/"), key=lambda e: e.key)
+    self.assertEqual(list(map(lambda e: e.get_content(), batched)), list(map(lambda e: e.get_content(), entries)))
+    self.assertEqual(list(map(lambda e: e.get_metadata(), batched)), list(map(lambda e: e.get_metadata(), entries)))
+    self.assertEqual(self.spill_files(), spilled)
+
+  def spill_files(self) -> List[str]:
+    return sorted(filter(lambda name: name.startswith("sort-"), os.listdir(tempfile.gettempdir())))
+
+  def test_bin_input(self):
+    # Values outside the sampled pivots go to the outer bins
+    bin_ranges = [{"range": [10, 20], "bin": 1}, {"range": [20, 30], "bin": 2}]
+    items = [(5, "a"), (10, "b"), (20, "c"), (29, "d"), (40, "e")]
+    self.assertEqual(sort.bin_input(items, bin_ranges), [["a", "b"], ["c", "d", "e"]])
+
+    # Records with a heavy hitter value are dealt between its point bins
+    bin_ranges = [{"range": [10, 20], "bin": 1}, {"range": [20, 20], "bin": 2}, {"range": [20, 20], "bin": 3}, {"range": [20, 30], "bin": 4}]
+    items = [(15, "a"), (20, "b"), (20, "c"), (20, "d"), (21, "e")]
+    self.assertEqual(sort.bin_input(items, bin_ranges), [["a"], ["b", "d"], ["c"], ["e"]])
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -1,4 +1,6 @@
 import json
+from formats import new_line
+from formats.iterator import index_key
 from lambdas import split_file
 import tutils
 import unittest
@@ -53,6 +55,53 @@ class SplitFunction(unittest.TestCase):
     expected_invokes = [invoke1, invoke2]
     self.check_payload_equality(expected_invokes, database.payloads)
 
+  def test_record_index(self):
+    params = {
+      "bucket": "table1",
+      "file": "split_file",
+      "format": "new_line",
+      "log": "log",
+      "name": "split",
+      "output_function": "an-output-function",
+      "ranges": False,
+      "record_index": True,
+      "split_size": 20,
+      "timeout": 60,
+    }
+    database = TestDatabase(params)
+    table1 = database.create_table(params["bucket"])
+    log = database.create_table(params["log"])
+    content = "A B C\nD E F\nG H I\nJ K L\nM N O\nP Q R\n"
+    entry1 = table1.add_entry("0/123.400000-13/1-1/1-0.0000-1-suffix.new_line", content)
+    index_block_size = new_line.Iterator.index_block_size
+    new_line.Iterator.index_block_size = 10
+    index = new_line.Iterator.create_index(str.encode(content))
+    new_line.Iterator.index_block_size = index_block_size
+    table1.add_entry(index_key(entry1.key), index.to_bytes())
+
+    event = tutils.create_event(database, table1.name, entry1.key)
+    context = tutils.create_context(params)
+    split_file.main(event, context)
+
+    payloads = sorted(database.payloads, key=lambda p: p["log"])
+    self.assertEqual(len(payloads), 2)
+    extra_params = list(map(lambda payload: payload["Records"][0]["s3"]["extra_params"], payloads))
+    self.assertEqual(list(map(lambda extra: extra["offsets"], extra_params)), [[0, 23], [24, 35]])
+    self.assertTrue(extra_params[0]["aligned"])
+
+    # A sidecar written for an older version of the object is ignored
+    database = TestDatabase(params)
+    table1 = database.create_table(params["bucket"])
+    database.create_table(params["log"])
+    table1.add_entry(entry1.key, "A B\n" + content)
+    table1.add_entry(index_key(entry1.key), index.to_bytes())
+    event = tutils.create_event(database, table1.name, entry1.key)
+    split_file.main(event, context)
+    payloads = sorted(database.payloads, key=lambda p: p["log"])
+    extra_params = list(map(lambda payload: payload["Records"][0]["s3"]["extra_params"], payloads))
+    self.assertEqual(list(map(lambda extra: extra["offsets"], extra_params)), [[0, 19], [20, 39]])
+    self.assertFalse(util.is_set(extra_params[0], "aligned"))
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,58 @@
+from formats import blast
+from formats.iterator import Zone, index_key
+from lambdas import top
+import tutils
+import unittest
+from tutils import TestDatabase, TestEntry, TestTable
+
+
+def create_item(score: int) -> str:
+  return "target_name: 1\nquery_name: 1\noptimal_alignment_score: {0:d} suboptimal_alignment_score: 0".format(score)
+
+
+class TopMethods(unittest.TestCase):
+  def run_top(self, record_index: bool):
+    params = {
+      "bucket": "table1",
+      "file": "top",
+      "identifier": "score",
+      "input_format": "blast",
+      "log": "log",
+      "name": "top",
+      "number": 2,
+      "record_index": record_index,
+      "timeout": 60,
+    }
+
+    database: TestDatabase = TestDatabase(params)
+    database.create_table(params["log"])
+    table1: TestTable = database.create_table(params["bucket"])
+    scores = [5, 3, 90, 1, 2, 80, 4, 6]
+    content = "\n\n".join(list(map(create_item, scores)))
+    entry1: TestEntry = table1.add_entry("0/123.400000-13/1-1/1-0.0000-1-suffix.blast", content)
+    index_block_size = blast.Iterator.index_block_size
+    blast.Iterator.index_block_size = 2 * len(create_item(0))
+    index = blast.Iterator.create_index(str.encode(content), "score")
+    blast.Iterator.index_block_size = index_block_size
+    self.assertEqual(list(index.counts), [2, 2, 2, 2])
+    table1.add_entry(index_key(entry1.key), index.to_bytes())
+
+    event = tutils.create_event(database, table1.name, entry1.key)
+    context = tutils.create_context(params)
+    top.main(event, context)
+
+    entries = database.get_entries(table1.name, "1/")
+    self.assertEqual(len(entries), 1)
+    items = sorted(list(blast.Iterator.to_array(entries[0].get_content())), key=lambda item: blast.Iterator.get_identifier_value(item, "score"))
+    self.assertEqual(items, [str.encode(create_item(80)), str.encode(create_item(90))])
+    zone = Zone.from_metadata(entries[0].get_metadata(), "score")
+    self.assertEqual([zone.minimum, zone.maximum, zone.count], [80000, 90000, 2])
+    return database.statistics.read_byte_count
+
+  def test_index(self):
+    # Blocks whose maximum can't make the top are never read
+    self.assertLess(self.run_top(True), self.run_top(False))
+
+
+if __name__ == "__main__":
+  unittest.main()
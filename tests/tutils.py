@@ -42,7 +42,8 @@ def create_payload(table_name: str, key: str, prefix: int, file_id: Optional[int
 
 
 class TestEntry(Entry):
-  def __init__(self, key: str, content: Optional[Union[str, bytes]], statistics: Optional[Statistics]=None):
+  def __init__(self, key: str, content: Optional[Union[str, bytes]], statistics: Optional[Statistics]=None, metadata: Optional[Dict[str, str]]=None):
+    self.metadata = metadata if metadata is not None else {}
     self.file_name = key.replace("/tmp/s3/", "")
     self.file_name = key.replace("/tmp/", "")
     self.file_name = self.file_name.replace("/", "-")
@@ -85,7 +86,7 @@ class TestEntry(Entry):
       os.remove(self.file_name)
 
   def get_metadata(self) -> Dict[str, str]:
-    return {}
+    return self.metadata
 
   def last_modified_at(self) -> float:
     return self.last_modified
@@ -98,8 +99,8 @@ class TestTable(Table):
     Table.__init__(self, name, statistics, resources)
     self.entries = {}
 
-  def add_entry(self, key: str, content: Union[str, bytes]) -> TestEntry:
-    entry = TestEntry(key, content, self.statistics)
+  def add_entry(self, key: str, content: Union[str, bytes], metadata: Optional[Dict[str, str]]=None) -> TestEntry:
+    entry = TestEntry(key, content, self.statistics, metadata)
     self.entries[key] = entry
     return entry
 
@@ -144,10 +145,10 @@ class TestDatabase(S3):
     self.__write__(table_name, key, f.read(), metadata)
 
   def __read__(self, table_name: str, key: str) -> str:
-    return self.get_entry(table_name, key).content
+    return self.get_entry(table_name, key).get_content()
 
   def __write__(self, table_name: str, key: str, content: bytes, metadata: Dict[str, str], invoke=False):
-    self.add_entry(table_name, key, content)
+    self.add_entry(table_name, key, content, metadata)
     if not key.endswith(".log"):
       self.payloads.append({
         "Records": [{
@@ -162,8 +163,14 @@ class TestDatabase(S3):
         }]
       })
 
-  def add_entry(self, table_name: str, key: str, content: bytes):
-    self.tables[table_name].add_entry(key, content)
+  def __write_if_absent__(self, table_name: str, key: str, content: bytes) -> bool:
+    if self.contains(table_name, key):
+      return False
+    self.add_entry(table_name, key, content)
+    return True
+
+  def add_entry(self, table_name: str, key: str, content: bytes, metadata: Optional[Dict[str, str]]=None):
+    self.tables[table_name].add_entry(key, content, metadata)
 
   def add_table(self, table_name: str) -> Table:
     if table_name in self.tables:
@@ -221,3 +228,17 @@ def create_event(database: Database, table_name: str, key: str, offsets=None):
 
 def create_context(params):
   return Context(params["timeout"])
+
+
+def write_file_index(iterator_class: Any, content: bytes, identifier: Optional[Any] = None) -> bytes:
+  # Writes the sidecar for content from a file, the way stages index their outputs
+  from formats.iterator import index_key, write_index
+  database: TestDatabase = TestDatabase()
+  database.create_table("index")
+  temp_name: str = "/tmp/ripple_index_test"
+  with open(temp_name, "wb") as f:
+    f.write(content)
+  with open(temp_name, "rb") as f:
+    write_index(database, "index", "test", iterator_class, f, identifier)
+  os.remove(temp_name)
+  return database.read("index", index_key("test"))
@@ -19,6 +19,8 @@ import os
 import random
 import time
 import util
+from formats import registry
+from formats.iterator import index_key
 
 
 def create_s3_key_name(key, execute=None):
@@ -44,7 +46,7 @@ def create_s3_key_name(key, execute=None):
 
 
 # TODO: Storage class?
-def upload(bucket_name, key, input_bucket_name=None, execute=None):
+def upload(bucket_name, key, input_bucket_name=None, execute=None, record_index=False):
   s3 = boto3.resource("s3")
   s3_key = create_s3_key_name(key, execute)
 
@@ -70,6 +72,8 @@ def upload(bucket_name, key, input_bucket_name=None, execute=None):
     config = boto3.s3.transfer.TransferConfig(multipart_threshold=64*1024*1024, max_concurrency=10,
                                               multipart_chunksize=16*1024*1024, use_threads=False)
     boto3.client("s3").upload_file(key, bucket_name, s3_key, Config=config)
+    if record_index:
+      upload_index(bucket_name, key, s3_key)
 
   end = time.time()
 
@@ -81,14 +85,27 @@ def upload(bucket_name, key, input_bucket_name=None, execute=None):
   return s3_key, timestamp, duration
 
 
+def upload_index(bucket_name, key, s3_key):
+  ext = s3_key.split(".")[-1]
+  format_lib = registry.find(ext)
+  if format_lib is None:
+    return
+  iterator_class = format_lib.iterator
+  with open(key, "rb") as f:
+    index = iterator_class.create_index(f.read())
+  if index is not None:
+    boto3.client("s3").put_object(Bucket=bucket_name, Key=index_key(s3_key), Body=index.to_bytes())
+
+
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument("--destination_bucket_name", type=str, required=True, help="Destination bucket for object")
   parser.add_argument("--key", type=str, required=True, help="Name of object to upload")
   parser.add_argument("--source_bucket_name", type=str, default=None,
                       help="Source bucket for object. If not specified, script looks for object in data folder")
+  parser.add_argument("--record_index", action="store_true", help="Upload a record index alongside the object")
   args = parser.parse_args()
-  upload(args.destination_bucket_name, args.key, args.source_bucket_name)
+  upload(args.destination_bucket_name, args.key, args.source_bucket_name, record_index=args.record_index)
 
 
 if __name__ == "__main__":
@@ -21,6 +21,8 @@ import re
 import subprocess
 import threading
 import time
+from database import connections, tracker
+from database.local import LocalDatabase
 from database.s3 import S3
 from botocore.client import Config
 
@@ -142,6 +144,13 @@ def combine_instance(bucket_name, key, params={}):
   # So the current plan is to to just combine if everything is present and have the combiner
   # write the logs. This should prevent overwrites from affecting combines and allow fault
   # tolerance to work.
+  if "tracker" in params:
+    # Register the file in the manifest instead of polling the folder
+    m = parse_file_name(key)
+    completion_tracker = tracker.create(params)
+    [done, keys] = completion_tracker.register(key_prefix(key), key, m["num_files"])
+    return [done, key if done else None, keys]
+
   done = False
   num_attempts = 30
   m = parse_file_name(key)
@@ -178,6 +187,9 @@ def load_parameters(s3_dict, key_fields, start_time):
   if is_set(s3_dict, "test"):
     params = s3_dict["load_func"]()
     params["test"] = True
+  elif "local_params" in s3_dict:
+    # Stages run by the local dispatcher get their parameters with the event
+    params = dict(s3_dict["local_params"])
   else:
     params = json.loads(open("{0:d}.json".format(prefix)).read())
 
@@ -205,6 +217,8 @@ def load_parameters(s3_dict, key_fields, start_time):
   if is_set(s3_dict, "test"):
     s3 = s3_dict["s3"]
     s3.params = params
+  elif "local_root" in params:
+    s3 = LocalDatabase(params, params["local_root"])
   else:
     s3 = S3(params)
 
@@ -256,7 +270,8 @@ def handle(argv, func):
     entry = prior_execution(log_format, params)
     params["ancestry"].append((token, log_format["prefix"], log_format["bin"], log_format["num_bins"], log_format["file_id"], log_format["num_files"]))
     if entry is None:
-      if not is_set(params, "test"):
+      # Local stages share /tmp with everything else on the machine
+      if not is_set(params, "test") and "local_root" not in params:
         clear_tmp(params)
       make_folder(output_format)
       try:
@@ -277,6 +292,16 @@ def handle(argv, func):
         params["database"].invoke(params["output_function"], payload)
 
 
+def stage_parameters(configuration, stage):
+  # The parameters the function for a pipeline stage runs with
+  pipeline_params = configuration["pipeline"][stage]
+  params = {**configuration["functions"][pipeline_params["name"]], **pipeline_params}
+  for value in ["timeout", "num_bins", "bucket", "storage_class", "log", "scheduler"]:
+    if value in configuration:
+      params[value] = configuration[value]
+  return params
+
+
 def get_formats(input_format, params):
   output_format = dict(input_format)
   output_format["prefix"] = params["prefix"] + 1
@@ -344,11 +369,10 @@ def write_log(duration, input_format, bucket_format, params):
 
 def setup_client(service, params):
   extra_time = 20
-  config = Config(read_timeout=params["timeout"] + extra_time)
-  client = boto3.client(service,
-                        region_name=params["region"],
-                        config=config
-                        )
+  client = connections.client(service,
+                              region=params["region"],
+                              read_timeout=params["timeout"] + extra_time
+                              )
   return client
 
 